@@ -0,0 +1,153 @@
+"""
+Compare a full-library rating run using the offline IMDb dataset against the per-title
+lookups done through OMDB/IMDB.
+
+The dumps are generated as fixture files in a temporary directory, shaped like the public
+IMDb datasets. The per-title path requests every movie, show and season of the same library
+through utils/omdb.py from a local OMDB stub with a fixed latency, on the OMDB worker pool of the
+updater. IMDB is left out, imdbpie can't be pointed at a local server.
+
+Usage: python -m benchmarks.bench_dataset [--movies 2000] [--shows 300] [--latency 0.02] [--rate-limit 0]
+"""
+import argparse
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.stubs import StubServer, omdb_route
+from utils import config, dataset, limiter, omdb
+from utils.pipeline import Pipeline
+
+
+def write_fixtures(directory, movies, shows, seasons, episodes):
+    """
+    Write title.ratings and title.episode dumps for a synthetic library
+    :return: list of movie ids, list of (show id, season count)
+    """
+    rng = random.Random(42)
+    movie_ids = ["tt{0:07d}".format(1000000 + i) for i in range(movies)]
+    show_ids = ["tt{0:07d}".format(3000000 + i) for i in range(shows)]
+    next_episode = 5000000
+    with gzip.open(os.path.join(directory, dataset.RATINGS_FILE), "wt") as ratings, \
+            gzip.open(os.path.join(directory, dataset.EPISODES_FILE), "wt") as episode_dump:
+        ratings.write("tconst\taverageRating\tnumVotes\n")
+        episode_dump.write("tconst\tparentTconst\tseasonNumber\tepisodeNumber\n")
+        for imdb_id in movie_ids + show_ids:
+            ratings.write("{0}\t{1:.1f}\t{2}\n".format(imdb_id, rng.uniform(1, 10), rng.randint(5, 500000)))
+        for show_id in show_ids:
+            for season in range(1, seasons + 1):
+                for episode in range(1, episodes + 1):
+                    tconst = "tt{0:07d}".format(next_episode)
+                    next_episode += 1
+                    episode_dump.write("{0}\t{1}\t{2}\t{3}\n".format(tconst, show_id, season, episode))
+                    ratings.write("{0}\t{1:.1f}\t{2}\n".format(tconst, rng.uniform(1, 10), rng.randint(5, 5000)))
+    return movie_ids, show_ids
+
+
+def read_fixtures(directory):
+    """
+    Read the ratings of the fixture dumps back, to answer the OMDB stub with
+    :return: dict of IMDB id and rating, dict of (IMDB id, season) and a dict of episode number and rating
+    """
+    ratings = {imdb_id: float(rating) for imdb_id, rating, votes in
+               dataset._read_dump(os.path.join(directory, dataset.RATINGS_FILE))}
+    seasons = {}
+    for tconst, parent, season, episode in dataset._read_dump(os.path.join(directory, dataset.EPISODES_FILE)):
+        seasons.setdefault((parent, int(season)), {})[int(episode)] = ratings[tconst]
+    return ratings, seasons
+
+
+def fetch_per_title(titles, seasons):
+    """
+    Request every title and season from OMDB on the OMDB worker pool
+    :param titles: the IMDB ids of the movies and shows
+    :param seasons: list of IMDB id and season pairs
+    :return: the number of titles and seasons found
+    """
+    found = [0]
+
+    def handle(result, error):
+        if result:
+            found[0] += 1
+
+    pipeline = Pipeline({"omdb": config.CONCURRENCY["omdb"]})
+    for imdb_id in titles:
+        pipeline.submit(handle, "omdb", omdb.get_imdb_rating_from_omdb, imdb_id)
+        pipeline.drain()
+    for imdb_id, season in seasons:
+        pipeline.submit(handle, "omdb", omdb.get_season_from_omdb, imdb_id, season)
+        pipeline.drain()
+    pipeline.join()
+    pipeline.shutdown()
+    return found[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=2000)
+    parser.add_argument("--shows", type=int, default=300)
+    parser.add_argument("--seasons", type=int, default=5)
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per OMDB request")
+    parser.add_argument("--rate-limit", type=int, default=0, help="OMDB requests per second, 0 for no limit")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    stub = None
+    try:
+        movie_ids, show_ids = write_fixtures(directory, args.movies, args.shows, args.seasons, args.episodes)
+        config.IMDB_DATASET_DIR = directory
+        config.IMDB_DATASET_INDEX = os.path.join(directory, "index.sqlite")
+
+        start = time.perf_counter()
+        dataset.build_index()
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = sum(1 for imdb_id in movie_ids + show_ids if dataset.get_title_ratings(imdb_id))
+        for show_id in show_ids:
+            for season in range(1, args.seasons + 1):
+                found += 1 if dataset.get_season(show_id, season) else 0
+        lookup_time = time.perf_counter() - start
+        unchanged_start = time.perf_counter()
+        dataset.build_index()
+        unchanged_time = time.perf_counter() - unchanged_start
+
+        stub = StubServer(omdb_route(*read_fixtures(directory)), latency=args.latency,
+                          rate_limit=args.rate_limit or None).start()
+        config.OMDB_API_KEY = "bench"
+        config.OMDB_API_URL = stub.url
+        if args.rate_limit:
+            config.RATE_LIMITS = dict(config.RATE_LIMITS, omdb=(args.rate_limit, args.rate_limit))
+        else:
+            config.RATE_LIMITS = dict(config.RATE_LIMITS, omdb=(1000000, 1000000))
+        limiter.limiters.clear()
+        omdb.client = None
+        # one request per movie/show and one season request per season
+        seasons = [(show_id, season) for show_id in show_ids for season in range(1, args.seasons + 1)]
+        start = time.perf_counter()
+        found_per_title = fetch_per_title(movie_ids + show_ids, seasons)
+        per_title_time = time.perf_counter() - start
+
+        print("library: {0} movies, {1} shows, {2} episodes".format(
+            len(movie_ids), len(show_ids), len(show_ids) * args.seasons * args.episodes))
+        print("index size:           {0:.1f} MB".format(os.path.getsize(config.IMDB_DATASET_INDEX) / 1e6))
+        print("index build:          {0:.2f} s".format(build_time))
+        print("index check (no-op):  {0:.4f} s".format(unchanged_time))
+        print("dataset lookups:      {0:.2f} s (0 requests, {1} found)".format(lookup_time, found))
+        print("per-title path:       {0:.2f} s ({1} requests, {2} found, {3} rate limited)".format(
+            per_title_time, stub.requests, found_per_title, stub.rate_limited))
+    finally:
+        if stub is not None:
+            stub.stop()
+        if dataset.connection is not None:
+            dataset.connection.close()
+            dataset.connection = None
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
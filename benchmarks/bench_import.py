@@ -0,0 +1,59 @@
+"""
+Measure the import cost of the updater and of the provider modules, every one in a fresh interpreter
+with python -X importtime. Single-item runs triggered by Plex webhooks pay it on every call.
+
+Reports the median cumulative import time of every module over the repeats, and the slowest
+third-party packages pulled in by the entry point.
+
+Usage: python -m benchmarks.bench_import [--repeat 5] [--top 8]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULES = ("update_imdb_ratings", "models", "utils.tmdb", "utils.omdb", "utils.imdb", "utils.dataset",
+           "utils.seasons", "utils.incremental")
+# loaded on demand, only by the runs that use them
+LAZY = ("plexapi", "imdbpie", "omdb", "tqdm")
+
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter
+    :return: dict of the cumulative import time in seconds of every module loaded on the way
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="the number of slowest packages to show")
+    args = parser.parse_args()
+
+    print("{0:<22} {1:>10}".format("module", "import (ms)"))
+    for module in MODULES:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        print("{0:<22} {1:10.1f}".format(module, statistics.median(run[module] for run in runs) * 1000))
+        if module == "update_imdb_ratings":
+            entry = runs
+    loaded = set.intersection(*(set(run) for run in entry))
+    packages = sorted(((statistics.median(run[name] for run in entry), name) for name in loaded
+                       if "." not in name and name not in ("site", "update_imdb_ratings")), reverse=True)
+    print("\nslowest packages imported by update_imdb_ratings:")
+    for seconds, name in packages[:args.top]:
+        print("  {0:<20} {1:8.1f}".format(name, seconds * 1000))
+    print("\nnot imported up front: {0}".format(", ".join(name for name in LAZY if name not in loaded) or "none"))
+
+
+if __name__ == "__main__":
+    main()
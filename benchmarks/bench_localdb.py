@@ -0,0 +1,201 @@
+"""
+Compare the local DB (db.sqlite) of the previous schema with the current one at scale. The previous
+schema stored IMDB ids and dates as text, had no index on the parent show of episodes, the IMDB id or the last
+update, and used the default journal mode and pragmas. The current schema packs IMDB ids and dates into integers,
+has these indexes and runs in WAL mode.
+
+For every schema it reports the size of the DB, the time to load the local index and to plan the first
+refreshes from it, to look up the episodes of a show and a title by its IMDB id, and to flush a batch of changed
+ratings. Then it times
+migrating a DB of the previous schema in place.
+
+Usage: python -m benchmarks.bench_localdb [--shows 2000] [--episodes 100] [--movies 20000] [--lookups 500]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import models
+from models import create_tables, Movie, Show, Episode
+from utils import config
+from utils.index import LocalIndex
+
+# the title tables as created by the previous version
+LEGACY_SCHEMA = """
+CREATE TABLE "show" ("plex_id" INTEGER NOT NULL PRIMARY KEY, "title" VARCHAR(255) NOT NULL, "imdb_id" VARCHAR(255),
+    "tmdb_id" INTEGER, "rating" REAL, "imdb_rating" REAL, "votes" INTEGER, "last_update" DATETIME NOT NULL,
+    "release_date" DATETIME, "next_refresh" DATETIME, "tvdb_id" INTEGER);
+CREATE INDEX "show_next_refresh" ON "show" ("next_refresh");
+CREATE TABLE "movie" ("plex_id" INTEGER NOT NULL PRIMARY KEY, "title" VARCHAR(255) NOT NULL, "imdb_id" VARCHAR(255),
+    "rating" REAL, "imdb_rating" REAL, "votes" INTEGER, "last_update" DATETIME NOT NULL, "release_date" DATETIME,
+    "next_refresh" DATETIME, "tmdb_id" INTEGER);
+CREATE INDEX "movie_next_refresh" ON "movie" ("next_refresh");
+CREATE TABLE "episode" ("plex_id" INTEGER NOT NULL PRIMARY KEY, "title" VARCHAR(255) NOT NULL,
+    "imdb_id" VARCHAR(255), "tmdb_id" INTEGER, "rating" REAL, "imdb_rating" REAL, "votes" INTEGER,
+    "last_update" DATETIME NOT NULL, "release_date" DATETIME, "next_refresh" DATETIME,
+    "parent_plex_id" INTEGER NOT NULL, "episode" INTEGER NOT NULL, "season" INTEGER NOT NULL);
+CREATE INDEX "episode_next_refresh" ON "episode" ("next_refresh");
+"""
+
+
+def create_rows(args):
+    """
+    :return: dict of model and the rows of its table, with the IMDB ids as text
+    """
+    random.seed(42)
+    now = datetime(2020, 6, 1)
+
+    def row(plex_id, number):
+        last_update = now - timedelta(minutes=random.randrange(60 * 24 * 30))
+        rating = round(random.uniform(4, 9.5), 1)
+        return {"plex_id": plex_id, "title": "Title {0}".format(plex_id), "imdb_id": "tt{0:07d}".format(number),
+                "rating": rating, "imdb_rating": rating, "votes": random.randrange(10, 100000),
+                "last_update": last_update, "release_date": now - timedelta(days=random.randrange(10000)),
+                "next_refresh": last_update + timedelta(days=14)}
+
+    rows = {Movie: [], Show: [], Episode: []}
+    plex_id = 1
+    for number in range(args.movies):
+        rows[Movie].append(row(plex_id, 1000000 + number))
+        plex_id += 1
+    for number in range(args.shows):
+        show_id = plex_id
+        rows[Show].append(dict(row(show_id, 3000000 + number), tvdb_id=70000 + number))
+        plex_id += 1
+        for episode in range(args.episodes):
+            rows[Episode].append(dict(row(plex_id, 5000000 + plex_id), parent_plex_id=show_id,
+                                      season=episode // 10 + 1, episode=episode % 10 + 1))
+            plex_id += 1
+    return rows
+
+
+def open_database(path, pragmas):
+    models.database.close()
+    models.database.init(path, timeout=config.LOCK_TIMEOUT, pragmas=pragmas)
+    models.database.connect()
+
+
+def fill_database(rows):
+    with models.database.atomic():
+        for model, model_rows in rows.items():
+            for start in range(0, len(model_rows), 50):
+                model.insert_many(model_rows[start:start + 50]).execute()
+
+
+def fill_legacy_database(rows):
+    # the previous version stored dates and times as text
+    with models.database.atomic():
+        for model, model_rows in rows.items():
+            columns = list(model_rows[0])
+            models.database.connection().executemany('INSERT INTO "{table}" ({columns}) VALUES ({values})'.format(
+                table=model._meta.table_name, columns=", ".join('"{0}"'.format(column) for column in columns),
+                values=", ".join("?" * len(columns))),
+                [[str(row[column]) if isinstance(row[column], datetime) else row[column] for column in columns]
+                 for row in model_rows])
+
+
+def size(path):
+    # the WAL is checkpointed into the DB and removed when the last connection closes
+    models.database.close()
+    conn = sqlite3.connect(path)
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(path) / 1024.0 / 1024.0
+
+
+def measure(path, pragmas, rows, args):
+    """
+    :return: dict of the timings of the workloads on the DB
+    """
+    random.seed(7)
+    shows = random.sample([row["plex_id"] for row in rows[Show]], min(args.lookups, len(rows[Show])))
+    imdb_ids = [row["imdb_id"] for row in random.sample(rows[Movie], min(args.lookups, len(rows[Movie])))]
+    result = {}
+    open_database(path, pragmas)
+
+    start = time.perf_counter()
+    index = LocalIndex().load()
+    result["load"] = time.perf_counter() - start
+
+    # the dates are converted when they are first read, planning reads the next refresh of every row
+    start = time.perf_counter()
+    index.plan(datetime(2020, 6, 10))
+    result["plan"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for show_id in shows:
+        list(Episode.select().where(Episode.parent_plex_id == show_id).tuples())
+    result["episodes of a show"] = (time.perf_counter() - start) / len(shows)
+
+    start = time.perf_counter()
+    for imdb_id in imdb_ids:
+        Movie.select().where(Movie.imdb_id == imdb_id).tuples().first()
+    result["title by imdb id"] = (time.perf_counter() - start) / len(imdb_ids)
+
+    for record in list(index.records[Episode].values())[:args.flush]:
+        index.update_rating(record, 7.0)
+    start = time.perf_counter()
+    index.flush()
+    result["flush"] = time.perf_counter() - start
+    models.database.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shows", type=int, default=2000)
+    parser.add_argument("--episodes", type=int, default=100, help="episodes per show")
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--lookups", type=int, default=500, help="number of shows and titles looked up")
+    parser.add_argument("--flush", type=int, default=20000, help="number of changed episodes flushed")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        rows = create_rows(args)
+        legacy_path = os.path.join(directory, "legacy.sqlite")
+        current_path = os.path.join(directory, "current.sqlite")
+
+        open_database(legacy_path, {})
+        models.database.connection().executescript(LEGACY_SCHEMA)
+        fill_legacy_database(rows)
+        legacy_size = size(legacy_path)
+        migrated_path = os.path.join(directory, "migrated.sqlite")
+        shutil.copy(legacy_path, migrated_path)
+
+        open_database(current_path, config.LOCAL_DB_PRAGMAS)
+        create_tables()
+        fill_database(rows)
+        current_size = size(current_path)
+
+        results = [("previous", legacy_size, measure(legacy_path, {}, rows, args)),
+                   ("current", current_size, measure(current_path, config.LOCAL_DB_PRAGMAS, rows, args))]
+
+        print("local DB: {0} movies, {1} shows, {2} episodes".format(len(rows[Movie]), len(rows[Show]),
+                                                                      len(rows[Episode])))
+        print("{0:<10} {1:>9} {2:>9} {3:>9} {4:>16} {5:>16} {6:>11}".format(
+            "schema", "size (MB)", "load (s)", "plan (s)", "show eps (ms)", "imdb id (ms)", "flush (s)"))
+        for name, db_size, result in results:
+            print("{0:<10} {1:9.1f} {2:9.2f} {3:9.2f} {4:16.3f} {5:16.3f} {6:11.2f}".format(
+                name, db_size, result["load"], result["plan"], result["episodes of a show"] * 1000,
+                result["title by imdb id"] * 1000, result["flush"]))
+
+        open_database(migrated_path, config.LOCAL_DB_PRAGMAS)
+        start = time.perf_counter()
+        create_tables()
+        migration_time = time.perf_counter() - start
+        print("\nmigrating the previous schema in place: {0:.2f} s, {1:.1f} MB after VACUUM".format(
+            migration_time, size(migrated_path)))
+    finally:
+        models.database.close()
+        models.database.init(models.DATABASE, timeout=config.LOCK_TIMEOUT, pragmas=config.LOCAL_DB_PRAGMAS)
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measure recomputing the ratings of a whole library after a change of the rating policy, as done by
+--recompute: building the rating table from the records of the local index, shrinking the ratings with
+few votes toward the average, rounding them and finding the ones that change. Compares applying the
+policy rating by rating with the columns of utils/ratings.py, with arrays of the standard library and
+with numpy when it is installed.
+
+Runs on synthetic episode records, no DB or provider is involved.
+
+Usage: python -m benchmarks.bench_ratings [--items 200000] [--decimals 1] [--shrinkage-votes 50]
+"""
+import argparse
+import random
+import time
+
+from models import Episode
+from utils import ratings
+from utils.index import RECORD_TYPES
+from utils.ratings import RatingTable, RatingPolicy
+
+
+def create_records(count):
+    random.seed(42)
+    records = []
+    for plex_id in range(1, count + 1):
+        record = RECORD_TYPES[Episode]()
+        record.plex_id = plex_id
+        record.imdb_rating = round(random.uniform(4.0, 9.5), 1) if random.random() < 0.95 else None
+        record.votes = int(random.paretovariate(0.8)) if random.random() < 0.9 else None
+        record.rating = record.imdb_rating
+        records.append(record)
+    return records
+
+
+def per_item(records, policy):
+    return [(record.plex_id, rating) for record, rating in
+            ((record, policy.apply(Episode, record.imdb_rating, record.votes)) for record in records)
+            if rating is not None and rating != record.rating]
+
+
+def columns(records, policy, use_numpy):
+    start = time.perf_counter()
+    table = RatingTable.from_records(records, use_numpy)
+    built = time.perf_counter()
+    new_ratings = policy.apply_table(Episode, table)
+    applied = time.perf_counter()
+    changes = table.changes(new_ratings)
+    return changes, built - start, applied - built, time.perf_counter() - applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=200000)
+    parser.add_argument("--decimals", type=int, default=1)
+    parser.add_argument("--shrinkage-votes", type=int, default=50)
+    args = parser.parse_args()
+
+    records = create_records(args.items)
+    prior = RatingTable.from_records(records, use_numpy=False).prior()
+    policy = RatingPolicy(args.decimals, args.shrinkage_votes, {Episode: prior})
+
+    start = time.perf_counter()
+    expected = per_item(records, policy)
+    per_item_time = time.perf_counter() - start
+
+    print("items:    {0}, {1} ratings change".format(len(records), len(expected)))
+    print("per item: {0:8.1f} ms".format(per_item_time * 1000))
+    backends = [("arrays", False)] + ([("numpy", True)] if ratings.get_numpy() is not None else [])
+    for name, use_numpy in backends:
+        changes, build_time, apply_time, changes_time = columns(records, policy, use_numpy)
+        assert changes == expected, "{0} differs from the per item result".format(name)
+        print("{0:<8}: {1:8.1f} ms to apply, {2:.1f} ms to list the changes, {3:.1f} ms to build the table".format(
+            name, apply_time * 1000, changes_time * 1000, build_time * 1000))
+    if ratings.get_numpy() is None:
+        print("numpy:    not installed")
+
+
+if __name__ == "__main__":
+    main()
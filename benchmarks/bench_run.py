@@ -0,0 +1,163 @@
+"""
+Run the whole updater against a synthetic library, fully offline. TMDb and OMDB are local stub
+servers with a configurable latency and rate limit, Plex is a fake server on a synthetic Plex DB,
+read through the plexapi code path or straight from the DB with --source db.
+
+Scenarios, run in this order on the same state:
+  cold         empty local DB and response cache, every item is fetched
+  warm         a re-run right after, nothing is due
+  incremental  a run after adding movies and episodes and touching some items
+
+Every scenario runs in a fresh process, to measure its peak RSS. Reports the wall time, the
+requests to every provider, the HTTP connections opened to them and the peak RSS.
+
+Usage: python -m benchmarks.bench_run [--movies 1000] [--shows 50] [--seasons 3] [--episodes 10]
+                                      [--latency 0.01] [--rate-limit 40] [--plex-latency 0.0]
+                                      [--source api|db] [--json]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.stubs import StubServer, omdb_route, tmdb_route
+from benchmarks.synthetic import create_plex_database, change_plex_database
+
+SCENARIOS = ("cold", "warm", "incremental")
+
+
+def create_stubs(args, extra_movies):
+    """
+    Start the TMDb and OMDB stubs knowing every movie, show and episode of the synthetic library.
+    Shows are numbered like the offline dataset fixtures: TVDB 70000 + n, TMDb n and IMDB tt3000000 + n
+    """
+    ratings = {"tt{0:07d}".format(1000000 + number): round(5 + (number % 50) / 10.0, 1)
+               for number in range(args.movies + extra_movies)}
+    seasons = {}
+    for number in range(args.shows):
+        imdb_id = "tt{0:07d}".format(3000000 + number)
+        ratings[imdb_id] = 8.0
+        for season in range(1, args.seasons + 1):
+            # one episode more than in the library, for the episodes added before the incremental run
+            seasons[(imdb_id, season)] = {episode: 7.5 for episode in range(1, args.episodes + 2)}
+    tmdb = StubServer(tmdb_route(shows={str(number): "tt{0:07d}".format(3000000 + number)
+                                        for number in range(args.shows)},
+                                 tvdb={str(70000 + number): str(number) for number in range(args.shows)}),
+                      latency=args.latency, rate_limit=args.rate_limit).start()
+    omdb = StubServer(omdb_route(ratings, seasons), latency=args.latency, rate_limit=args.rate_limit).start()
+    return {"tmdb": tmdb, "omdb": omdb}
+
+
+def run_scenario(directory, urls, args, incremental):
+    """
+    Run the updater once, in its own process
+    :return: dict of the wall time, the peak RSS in MB, the Plex API calls and the metrics summary
+    """
+    os.chdir(directory)
+    # keep the progress bars of the run out of the report
+    sys.stderr = open(os.devnull, "w")
+    import update_imdb_ratings as updater
+    from benchmarks.fakeplex import FakeServer
+    from models import create_tables
+    from utils import config
+
+    plex_path = os.path.join(directory, "plex.db")
+    servers = []
+
+    def connect(url, token):
+        servers.append(FakeServer(plex_path, args.plex_latency))
+        return servers[-1]
+
+    config.TMDB_API_KEY = config.OMDB_API_KEY = "bench"
+    config.TMDB_API_URL = urls["tmdb"] + "/3"
+    config.OMDB_API_URL = urls["omdb"]
+    config.RATE_LIMITS = {"tmdb": (args.rate_limit, args.rate_limit), "omdb": (args.rate_limit, args.rate_limit)}
+    updater.connect_plex = connect
+    updater.LIBRARY_NAMES = ["Movies", "TV Shows"]
+    updater.PLEX_DATABASE_FILE = plex_path
+    updater.ENUMERATE_FROM_DATABASE = args.source == "db"
+    updater.INCREMENTAL = incremental
+    updater.EPISODE_RATINGS_SOURCE = "omdb"
+    updater.DRY_RUN = False
+    logging.getLogger("plex-imdb-updater").setLevel(logging.WARNING)
+
+    create_tables()
+    start = time.perf_counter()
+    updater.main()
+    elapsed = time.perf_counter() - start
+    with open(config.METRICS_FILE) as file:
+        summary = json.load(file)
+    # ru_maxrss is in kilobytes on Linux
+    return {"wall": elapsed, "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            "plex": servers[0].requests if servers else 0, "metrics": summary}
+
+
+def counter(summary, name, **labels):
+    return sum(entry["value"] for entry in summary["counters"]
+               if entry["name"] == name and all(entry["labels"].get(key) == value for key, value in labels.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=1000)
+    parser.add_argument("--shows", type=int, default=50)
+    parser.add_argument("--seasons", type=int, default=3)
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per TMDb and OMDB request")
+    parser.add_argument("--rate-limit", type=int, default=40, help="TMDb and OMDB requests per second")
+    parser.add_argument("--plex-latency", type=float, default=0.0, help="seconds per Plex API call")
+    parser.add_argument("--source", choices=["api", "db"], default="api", help="enumerate via the Plex API or DB")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    new_items = max(1, args.movies // 100)
+    stubs = create_stubs(args, new_items)
+    urls = {name: stub.url for name, stub in stubs.items()}
+    # a fresh interpreter per scenario, so the peak RSS of one doesn't carry over to the next
+    context = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        create_plex_database(os.path.join(directory, "plex.db"), movies=args.movies, shows=args.shows,
+                             seasons=args.seasons, episodes=args.episodes)
+        for scenario in SCENARIOS:
+            if scenario == "incremental":
+                change_plex_database(os.path.join(directory, "plex.db"), new_movies=new_items, updated=new_items,
+                                     new_episodes=min(args.shows, new_items))
+            requests = {name: stub.requests for name, stub in stubs.items()}
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                # the cold run is incremental too, it finds no watermark, processes everything and stores one
+                result = pool.submit(run_scenario, directory, urls, args, scenario != "warm").result()
+            result["scenario"] = scenario
+            result["requests"] = {name: stub.requests - requests[name] for name, stub in stubs.items()}
+            result["updated"] = counter(result["metrics"], "items", result="updated")
+            result["connections"] = counter(result["metrics"], "http_connections")
+            results.append(result)
+    finally:
+        for stub in stubs.values():
+            stub.stop()
+        shutil.rmtree(directory)
+
+    if args.json:
+        print(json.dumps([{key: value for key, value in result.items() if key != "metrics"} for result in results],
+                         indent=2))
+        return
+    items = args.movies + args.shows * (1 + args.seasons * args.episodes)
+    print("library: {0} movies, {1} shows, {2} items, enumerated via the Plex {3}".format(
+        args.movies, args.shows, items, args.source.upper()))
+    print("{0:<12} {1:>8} {2:>8} {3:>6} {4:>6} {5:>6} {6:>6} {7:>9}".format(
+        "scenario", "wall (s)", "updated", "tmdb", "omdb", "plex", "conns", "rss (MB)"))
+    for result in results:
+        print("{r[scenario]:<12} {r[wall]:8.2f} {r[updated]:8d} {r[requests][tmdb]:6d} {r[requests][omdb]:6d} "
+              "{r[plex]:6d} {r[connections]:6d} {r[rss]:9.1f}".format(r=result))
+
+
+if __name__ == "__main__":
+    main()
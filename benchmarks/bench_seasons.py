@@ -0,0 +1,108 @@
+"""
+Count the season rating requests of a synthetic show library, fetching per outdated episode as
+the updater used to, per season through the memoizing SeasonRatings provider, and per show from
+the offline IMDb dataset.
+
+The seasons and episodes are read from a synthetic Plex DB. Season requests are answered by a
+counting stand-in for IMDB with a fixed latency, run on the IMDB worker pool.
+
+Usage: python -m benchmarks.bench_seasons [--shows 500] [--seasons 3] [--episodes 10] [--latency 0.005]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_dataset import write_fixtures
+from benchmarks.synthetic import create_plex_database, SHOW
+from utils import config, dataset, plexdb
+from utils.pipeline import Pipeline
+from utils.seasons import SeasonRatings
+
+
+class CountingSource(object):
+    """
+    Stand-in for IMDB answering season requests after a fixed latency
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def get_season(self, imdb_id, season):
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        return {1: {"rating": 7.5, "imdb_id": imdb_id}}
+
+
+def run(shows, fetch):
+    """
+    Request the ratings of every episode of every show on the IMDB pool
+    :param shows: list of IMDB id and seasons pairs
+    :param fetch: function(imdb_id, season) called once per episode
+    :return: the wall time in seconds
+    """
+    pipeline = Pipeline({"imdb": config.CONCURRENCY["imdb"]})
+    start = time.perf_counter()
+    for imdb_id, seasons in shows:
+        for season, episodes in seasons:
+            for _ in episodes:
+                pipeline.submit(lambda result, error: None, "imdb", fetch, imdb_id, season.index)
+                pipeline.drain()
+    pipeline.shutdown()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shows", type=int, default=500)
+    parser.add_argument("--seasons", type=int, default=3)
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per season request")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "plex.db")
+        ids = create_plex_database(path, movies=0, shows=args.shows, seasons=args.seasons, episodes=args.episodes)
+        conn = plexdb.connect(path)
+        # the dataset fixtures number the shows the same way, from tt3000000
+        shows = [("tt{0:07d}".format(3000000 + number), plexdb.get_seasons(conn, show_id))
+                 for number, show_id in enumerate(ids[SHOW])]
+        conn.close()
+        write_fixtures(directory, 0, args.shows, args.seasons, args.episodes)
+        config.IMDB_DATASET_DIR = directory
+        config.IMDB_DATASET_INDEX = os.path.join(directory, "index.sqlite")
+        dataset.build_index()
+
+        episodes = sum(len(episodes) for imdb_id, seasons in shows for season, episodes in seasons)
+        print("library: {0} shows, {1} episodes".format(len(shows), episodes))
+
+        source = CountingSource(args.latency)
+        elapsed = run(shows, source.get_season)
+        print("per episode:         {0:6d} requests, {1:.2f} s".format(source.requests, elapsed))
+
+        source = CountingSource(args.latency)
+        seasons = SeasonRatings(source.get_season)
+        elapsed = run(shows, seasons.get)
+        print("per season:          {0:6d} requests, {1:.2f} s ({2} shared)".format(
+            source.requests, elapsed, seasons.shared))
+
+        source = CountingSource(args.latency)
+        seasons = SeasonRatings(source.get_season, dataset.get_show)
+        elapsed = run(shows, seasons.get)
+        print("per show (dataset):  {0:6d} requests, {1:.2f} s ({2} local queries)".format(
+            source.requests, elapsed, seasons.requests))
+    finally:
+        if dataset.connection is not None:
+            dataset.connection.close()
+            dataset.connection = None
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
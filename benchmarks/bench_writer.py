@@ -0,0 +1,106 @@
+"""
+Compare writing ratings to the Plex DB item by item, with the statements the updater used to run in
+autocommit mode, against the batched writes of utils/writer.py. Then refresh the same ratings
+again, as most runs do, which the batched writes find unchanged.
+
+Runs against a synthetic copy of the metadata_items schema.
+
+Usage: python -m benchmarks.bench_writer [--items 20000] [--batch-size 500]
+"""
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from benchmarks.synthetic import create_plex_database, MOVIE, EPISODE
+from utils import db
+from utils.writer import BatchWriter
+
+
+def _set_rating_and_imdb_image(cursor, plex_id, rating):
+    # the statements of the updater before the batched writes
+    cursor.execute("UPDATE metadata_items SET rating = ? WHERE id = ?", [rating, plex_id])
+    extra_data = cursor.execute("SELECT extra_data FROM metadata_items WHERE id = ?", [plex_id]).fetchone()[0]
+    if extra_data:
+        extra_data = re.sub(r"at%3AratingImage=.+?&|at%3AaudienceRatingImage=.+?&", '', extra_data)
+        cursor.execute("UPDATE metadata_items SET extra_data = ? WHERE id = ?", [extra_data, plex_id])
+    cursor.execute("UPDATE metadata_items SET extra_data = ? || extra_data WHERE id = ?",
+                   ['at%3AratingImage=imdb%3A%2F%2Fimage%2Erating&', plex_id])
+    cursor.execute("UPDATE metadata_items SET extra_data = trim(extra_data, '&') WHERE id = ?", [plex_id])
+
+
+def _set_locked_fields(cursor, plex_id):
+    user_fields = cursor.execute("SELECT user_fields FROM metadata_items WHERE id = ? AND user_fields NOT LIKE ?",
+                                 [plex_id, '%lockedFields=%5%']).fetchone()
+    if user_fields is not None:
+        for field in user_fields[0].split(","):
+            if "lockedFields" in field:
+                cursor.execute("UPDATE metadata_items SET user_fields = ? WHERE id = ?",
+                               [re.sub(r"lockedFields=.+?", '', user_fields[0]), plex_id])
+                cursor.execute("UPDATE metadata_items SET user_fields = ? || user_fields WHERE id = ?",
+                               [field + "|5", plex_id])
+
+
+def per_item(path, plex_ids):
+    conn = sqlite3.connect(path)
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    for plex_id in plex_ids:
+        _set_rating_and_imdb_image(cursor, plex_id, 7.5)
+        _set_locked_fields(cursor, plex_id)
+    conn.close()
+
+
+def batched(path, plex_ids, batch_size):
+    conn = db.PlexDatabase(path)
+    writer = BatchWriter(conn, batch_size)
+    for plex_id in plex_ids:
+        writer.set_rating(plex_id, 7.5)
+        if writer.is_full():
+            writer.flush()
+    writer.flush()
+    conn.close()
+    return writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "plex.db")
+        ids = create_plex_database(path, movies=args.items // 2, shows=max(1, args.items // 60),
+                                   seasons=3, episodes=10)
+        plex_ids = (ids[MOVIE] + ids[EPISODE])[:args.items]
+        per_item_path = os.path.join(directory, "per_item.db")
+        shutil.copy(path, per_item_path)
+
+        start = time.perf_counter()
+        per_item(per_item_path, plex_ids)
+        per_item_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        writer = batched(path, plex_ids, args.batch_size)
+        batched_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        refresh = batched(path, plex_ids, args.batch_size)
+        refresh_time = time.perf_counter() - start
+
+        print("items:     {0}".format(len(plex_ids)))
+        print("per item:  {0:.2f} s (a transaction per statement)".format(per_item_time))
+        print("batched:   {0:.2f} s ({1} write transactions)".format(batched_time, writer.transactions))
+        print("unchanged: {0:.2f} s ({1} write transactions, {2} items unchanged)".format(
+            refresh_time, refresh.transactions, refresh.unchanged))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
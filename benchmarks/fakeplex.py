@@ -0,0 +1,180 @@
+"""
+Stand-ins for the plexapi server, library section, show, season and episode objects, read from a
+synthetic Plex DB, so the update loop can be benchmarked through the Plex API code path offline.
+"""
+import sqlite3
+import time
+from urllib.parse import parse_qs
+
+from plexapi.exceptions import NotFound
+
+from utils.plexdb import to_datetime, MOVIE, SHOW, SEASON, EPISODE, TYPES
+
+
+class FakeVideo(object):
+    """
+    A movie, show or episode with the attributes of the plexapi objects the updater reads
+    """
+
+    def __init__(self, server, row):
+        self.server = server
+        (metadata_type, self.ratingKey, self.librarySectionID, self.parentRatingKey, self.title, self.guid,
+         self.rating, self.index, released, added, updated) = row
+        self.TYPE = TYPES[metadata_type]
+        self.originallyAvailableAt = to_datetime(released)
+        self.addedAt = to_datetime(added)
+        self.updatedAt = to_datetime(updated)
+        self.grandparentRatingKey = None
+
+    def seasons(self):
+        self.server.wait()
+        return self.server.children.get(self.ratingKey, [])
+
+
+class FakeSeason(FakeVideo):
+    def episodes(self):
+        self.server.wait()
+        episodes = self.server.children.get(self.ratingKey, [])
+        for episode in episodes:
+            episode.grandparentRatingKey = self.parentRatingKey
+        return episodes
+
+
+class FakeSection(object):
+    """
+    A library section answering the queries of the updater from the synthetic Plex DB
+    """
+
+    def __init__(self, server, key, title, section_type):
+        self.server = self._server = server
+        self.key = key
+        self.title = title
+        self.type = TYPES[section_type]
+        self.section_type = section_type
+
+    def all(self):
+        self.server.wait()
+        return [item for item in self.server.top_level() if item.librarySectionID == self.key]
+
+    def fetchItems(self, key):
+        """
+        Supports the addedAt>>= and updatedAt>>= filters used by incremental runs, type=4 for episodes,
+        the X-Plex-Container-Start and -Size paging of streamed runs and /library/metadata/<ids>
+        """
+        self.server.wait()
+        if key.startswith("/library/metadata/"):
+            items = self.server.load_ids(key.split("/")[3].split(","))
+            if not items:
+                raise NotFound("Items {ids} not found".format(ids=key.split("/")[3]))
+            return items
+        query = parse_query(key)
+        if "X-Plex-Container-Start" in query:
+            return self.server.load_section(self.key, int(query["X-Plex-Container-Start"]),
+                                            int(query["X-Plex-Container-Size"]))
+        if query.get("type") == str(EPISODE):
+            items = [item for item in self.server.load(EPISODE) if item.librarySectionID == self.key]
+            seasons = {season.ratingKey: season for season in self.server.load(SEASON)}
+            for item in items:
+                item.grandparentRatingKey = seasons[item.parentRatingKey].parentRatingKey
+        else:
+            items = [item for item in self.server.top_level() if item.librarySectionID == self.key]
+        for attribute in ("addedAt", "updatedAt"):
+            # plex filters as addedAt>>=<timestamp>, meaning greater than
+            value = query.get(attribute + ">>")
+            if value is not None:
+                since = int(value)
+                items = [item for item in items if getattr(item, attribute) is not None and
+                         getattr(item, attribute).timestamp() > since]
+        return items
+
+    def fetchItem(self, plex_id):
+        self.server.wait()
+        for item in self.server.top_level():
+            if item.ratingKey == int(plex_id):
+                return item
+        raise NotFound("Item {id} not found".format(id=plex_id))
+
+
+class FakeResponse(object):
+    def __init__(self, attrib):
+        self.attrib = attrib
+
+
+def parse_query(key):
+    return {name: values[0] for name, values in parse_qs(key.split("?", 1)[1]).items()} if "?" in key else {}
+
+
+class FakeLibrary(object):
+    def __init__(self, server):
+        self.server = server
+
+    def section(self, title):
+        self.server.wait()
+        row = self.server.conn.execute("SELECT id, name, section_type FROM library_sections WHERE name = ?",
+                                       [title]).fetchone()
+        if row is None:
+            raise NotFound("Invalid library section: {title}".format(title=title))
+        return FakeSection(self.server, *row)
+
+
+class FakeServer(object):
+    """
+    A Plex server backed by a synthetic Plex DB, taking the given latency for every call like the
+    HTTP round trip of the Plex API. Nobody is ever watching.
+    """
+
+    def __init__(self, path, latency=0.0):
+        """
+        :param path: the synthetic Plex DB
+        :param latency: seconds every call to the Plex API takes
+        """
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.latency = latency
+        self.library = FakeLibrary(self)
+        self.children = {}
+        self.requests = 0
+        for item in self.load(SEASON) + self.load(EPISODE):
+            self.children.setdefault(item.parentRatingKey, []).append(item)
+
+    def wait(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def load(self, metadata_type):
+        item_class = FakeSeason if metadata_type == SEASON else FakeVideo
+        rows = self.conn.execute('SELECT metadata_type, id, library_section_id, parent_id, title, guid, rating, '
+                                 '"index", originally_available_at, added_at, updated_at FROM metadata_items '
+                                 'WHERE metadata_type = ? ORDER BY id', [metadata_type])
+        return [item_class(self, row) for row in rows]
+
+    def load_section(self, section, start, size):
+        rows = self.conn.execute('SELECT metadata_type, id, library_section_id, parent_id, title, guid, rating, '
+                                 '"index", originally_available_at, added_at, updated_at FROM metadata_items '
+                                 'WHERE library_section_id = ? AND metadata_type IN (?, ?) ORDER BY id '
+                                 'LIMIT ? OFFSET ?', [section, MOVIE, SHOW, size, start])
+        return [FakeVideo(self, row) for row in rows]
+
+    def load_ids(self, plex_ids):
+        rows = self.conn.execute('SELECT metadata_type, id, library_section_id, parent_id, title, guid, rating, '
+                                 '"index", originally_available_at, added_at, updated_at FROM metadata_items '
+                                 'WHERE id IN ({ids}) ORDER BY id'.format(ids=",".join("?" * len(plex_ids))),
+                                 [int(plex_id) for plex_id in plex_ids])
+        return [(FakeSeason if row[0] == SEASON else FakeVideo)(self, row) for row in rows]
+
+    def top_level(self):
+        return self.load(MOVIE) + self.load(SHOW)
+
+    def query(self, key):
+        """
+        Answers the container size query of a library section, the only raw query of the updater
+        """
+        self.wait()
+        section = int(key.split("/")[3])
+        total = self.conn.execute("SELECT COUNT(*) FROM metadata_items WHERE library_section_id = ? AND "
+                                  "metadata_type IN (?, ?)", [section, MOVIE, SHOW]).fetchone()[0]
+        return FakeResponse({"size": "0", "totalSize": str(total)})
+
+    def sessions(self):
+        self.wait()
+        return []
@@ -0,0 +1,189 @@
+"""
+Local stub HTTP servers standing in for the TMDb and OMDB APIs, so the fetch pipeline can be
+tested and benchmarked without network access.
+"""
+import collections
+import json
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # a client gave up waiting, like a request that timed out
+        if not issubclass(sys.exc_info()[0], ConnectionError):
+            super(QuietServer, self).handle_error(request, client_address)
+
+
+class StubServer(object):
+    """
+    HTTP server answering GET requests from a route function
+    """
+
+    def __init__(self, route, latency=0.0, rate_limit=None, etag=False):
+        """
+        :param route: function(path, query) returning a (status, json body) pair
+        :param latency: seconds to wait before answering each request
+        :param rate_limit: maximum requests per second, more are answered with a 429
+        :param etag: send an ETag with every response and answer matching conditional requests with a 304
+        """
+        self.route = route
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.etag = etag
+        self.requests = 0
+        self.rate_limited = 0
+        self.not_modified = 0
+        # requests being answered right now, and the most at once
+        self.active = 0
+        self.max_active = 0
+        self.recent = collections.deque()
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{port}".format(port=self.server.server_address[1])
+
+    def is_rate_limited(self):
+        """
+        Count a request, checking whether it is over the limit of the last second
+        """
+        with self.lock:
+            self.requests += 1
+            if self.rate_limit is None:
+                return False
+            now = time.monotonic()
+            while self.recent and self.recent[0] < now - 1:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate_limit:
+                self.rate_limited += 1
+                return True
+            self.recent.append(now)
+            return False
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep connections open like the real APIs. The headers and the body are written separately,
+            # without TCP_NODELAY the body waits for the delayed ACK of the headers
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.active += 1
+                    stub.max_active = max(stub.max_active, stub.active)
+                try:
+                    self.answer()
+                finally:
+                    with stub.lock:
+                        stub.active -= 1
+
+            def answer(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub.is_rate_limited():
+                    status, body = 429, {"status_message": "Request count over limit."}
+                else:
+                    parsed = urlparse(self.path)
+                    query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                    status, body = stub.route(parsed.path, query)
+                data = json.dumps(body).encode("utf-8")
+                etag = '"{0:x}"'.format(zlib.crc32(data)) if stub.etag and status == 200 else None
+                if etag is not None and self.headers.get("If-None-Match") == etag:
+                    with stub.lock:
+                        stub.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = QuietServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def tmdb_route(movies=None, shows=None, tvdb=None):
+    """
+    Route function for the TMDb endpoints used by utils/tmdb.py
+    :param movies: dict of TMDb movie id and IMDB id
+    :param shows: dict of TMDb show id and IMDB id
+    :param tvdb: dict of TVDB id and TMDb show id
+    """
+    movies = movies or {}
+    shows = shows or {}
+    tvdb = tvdb or {}
+
+    def route(path, query):
+        parts = path.strip("/").split("/")
+        if len(parts) == 3 and parts[1] == "movie" and parts[2] in movies:
+            return 200, {"id": int(parts[2]), "imdb_id": movies[parts[2]]}
+        if len(parts) == 4 and parts[1] == "tv" and parts[3] == "external_ids" and parts[2] in shows:
+            return 200, {"id": int(parts[2]), "imdb_id": shows[parts[2]]}
+        if len(parts) == 3 and parts[1] == "find":
+            if parts[2] in tvdb:
+                return 200, {"tv_results": [{"id": int(tvdb[parts[2]])}]}
+            return 200, {"tv_results": []}
+        return 404, {"status_message": "The resource you requested could not be found."}
+
+    return route
+
+
+def omdb_route(ratings=None, seasons=None):
+    """
+    Route function for the OMDB API
+    :param ratings: dict of IMDB id and rating
+    :param seasons: dict of (IMDB id, season) and a dict of episode number and rating
+    """
+    ratings = ratings or {}
+    seasons = seasons or {}
+
+    def route(path, query):
+        imdb_id = query.get("i")
+        if "Season" in query:
+            episodes = seasons.get((imdb_id, int(query["Season"])))
+            if episodes is None:
+                return 200, {"Response": "False", "Error": "Series or season not found!"}
+            return 200, {"Title": imdb_id, "Season": query["Season"], "Response": "True", "Episodes": [
+                {"Episode": str(number), "imdbRating": str(rating), "imdbID": "{0}e{1}".format(imdb_id, number)}
+                for number, rating in sorted(episodes.items())
+            ]}
+        if imdb_id in ratings:
+            return 200, {"Title": imdb_id, "imdbID": imdb_id, "imdbRating": str(ratings[imdb_id]),
+                         "imdbVotes": "1,234", "Response": "True"}
+        return 200, {"Response": "False", "Error": "Incorrect IMDb ID."}
+
+    return route
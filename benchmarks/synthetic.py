@@ -0,0 +1,112 @@
+"""
+Generators for synthetic Plex libraries, used by the benchmarks and tests.
+"""
+import random
+import sqlite3
+import time
+
+# metadata_type values used by Plex
+MOVIE = 1
+SHOW = 2
+SEASON = 3
+EPISODE = 4
+
+# the subset of the Plex library schema this project reads and writes
+PLEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS library_sections (
+    id INTEGER PRIMARY KEY, name TEXT, section_type INTEGER
+);
+CREATE TABLE IF NOT EXISTS metadata_items (
+    id INTEGER PRIMARY KEY, library_section_id INTEGER, parent_id INTEGER, metadata_type INTEGER,
+    guid TEXT, title TEXT, "index" INTEGER, rating REAL, originally_available_at DATETIME,
+    added_at DATETIME, updated_at DATETIME, extra_data TEXT, user_fields TEXT
+);
+CREATE INDEX IF NOT EXISTS index_metadata_items_on_parent_id ON metadata_items (parent_id);
+CREATE INDEX IF NOT EXISTS index_metadata_items_on_library_section_id ON metadata_items (library_section_id);
+"""
+
+EXTRA_DATA = "at%3AratingImage=themoviedb%3A%2F%2Fimage%2Erating&pv%3AdurationMs=5400000"
+
+
+def create_plex_database(path, movies=1000, shows=100, seasons=3, episodes=10, seed=42):
+    """
+    Create a Plex library DB with a movie section and a show section
+    :param path: the file to create the DB in
+    :param movies: number of movies
+    :param shows: number of shows
+    :param seasons: number of seasons per show, not counting specials
+    :param episodes: number of episodes per season
+    :return: dict of metadata type and list of ids
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(PLEX_SCHEMA)
+    conn.execute("INSERT INTO library_sections VALUES (1, 'Movies', 1), (2, 'TV Shows', 2)")
+    ids = {MOVIE: [], SHOW: [], SEASON: [], EPISODE: []}
+    rows = []
+    next_id = [1]
+
+    def add(section, parent, metadata_type, guid, title, index):
+        item_id = next_id[0]
+        next_id[0] += 1
+        user_fields = rng.choice(["", "lockedFields=2|15", "lockedFields=5"])
+        rows.append((item_id, section, parent, metadata_type, guid, title, index, round(rng.uniform(1, 10), 1),
+                     "2010-01-01 00:00:00", 1500000000 + item_id, 1500000000 + item_id, EXTRA_DATA, user_fields))
+        ids[metadata_type].append(item_id)
+        return item_id
+
+    for number in range(movies):
+        add(1, None, MOVIE, "com.plexapp.agents.imdb://tt{0:07d}?lang=en".format(1000000 + number),
+            "Movie {}".format(number), None)
+    for number in range(shows):
+        show = add(2, None, SHOW, "com.plexapp.agents.thetvdb://{0}?lang=en".format(70000 + number),
+                   "Show {}".format(number), None)
+        for season_number in range(seasons + 1):
+            season = add(2, show, SEASON, "", "Season {}".format(season_number), season_number)
+            for episode_number in range(1, episodes + 1):
+                add(2, season, EPISODE, "", "Episode {}".format(episode_number), episode_number)
+    conn.executemany("INSERT INTO metadata_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def change_plex_database(path, new_movies=10, updated=10, new_episodes=10, seed=7):
+    """
+    Make the changes an incremental run picks up: add movies, touch existing items and add an episode
+    to the first season of some shows. The new movies continue the numbering of create_plex_database.
+    :param path: the synthetic Plex DB
+    :param new_movies: number of movies to add
+    :param updated: number of existing movies and shows of which to bump the updated time
+    :param new_episodes: number of shows to add an episode to
+    :return: dict of metadata type and list of added ids
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    now = int(time.time())
+    movies = conn.execute("SELECT COUNT(*) FROM metadata_items WHERE metadata_type = ?", [MOVIE]).fetchone()[0]
+    next_id = conn.execute("SELECT MAX(id) FROM metadata_items").fetchone()[0] + 1
+    added = {MOVIE: [], EPISODE: []}
+    rows = []
+    for number in range(movies, movies + new_movies):
+        rows.append((next_id, 1, None, MOVIE, "com.plexapp.agents.imdb://tt{0:07d}?lang=en".format(1000000 + number),
+                     "Movie {}".format(number), None, None, "2010-01-01 00:00:00", now, now, EXTRA_DATA, ""))
+        added[MOVIE].append(next_id)
+        next_id += 1
+    seasons = conn.execute("SELECT season.id, MAX(episode.\"index\") FROM metadata_items season "
+                           "JOIN metadata_items episode ON episode.parent_id = season.id "
+                           "WHERE season.metadata_type = ? AND season.\"index\" = 1 GROUP BY season.id ORDER BY season.id",
+                           [SEASON]).fetchall()
+    for season, last_episode in seasons[:new_episodes]:
+        rows.append((next_id, 2, season, EPISODE, "", "Episode {}".format(last_episode + 1), last_episode + 1, None,
+                     "2010-01-01 00:00:00", now, now, EXTRA_DATA, ""))
+        added[EPISODE].append(next_id)
+        next_id += 1
+    conn.executemany("INSERT INTO metadata_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    touched = conn.execute("SELECT id FROM metadata_items WHERE metadata_type IN (?, ?) AND added_at < ?",
+                           [MOVIE, SHOW, now]).fetchall()
+    conn.executemany("UPDATE metadata_items SET updated_at = ? WHERE id = ?",
+                     [(now, row[0]) for row in rng.sample(touched, min(updated, len(touched)))])
+    conn.commit()
+    conn.close()
+    return added
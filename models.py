@@ -1,12 +1,60 @@
 import datetime
+import logging
 
-from peewee import SqliteDatabase, Model, IntegerField, CharField, DateTimeField, DoubleField
+from peewee import SqliteDatabase, Model, IntegerField, CharField, DoubleField, BooleanField, \
+    CompositeKey
+from playhouse.migrate import SqliteMigrator, migrate
+
+from utils import config
+from utils.dataset import tconst_to_int, int_to_tconst
 
 DATABASE = 'db.sqlite'
+logger = logging.getLogger("plex-imdb-updater")
 
 # create a peewee database instance -- our models will use this database to
 # persist information
-database = SqliteDatabase(DATABASE)
+database = SqliteDatabase(DATABASE, timeout=config.LOCK_TIMEOUT, pragmas=config.LOCAL_DB_PRAGMAS)
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_SECOND = datetime.timedelta(seconds=1)
+
+
+class TconstField(IntegerField):
+    """
+    IMDB id like 'tt0074053', stored as the integer 74053. Ids that are not a valid title id are stored as NULL.
+    """
+    # the types of the values as they come out of the DB, text in an older DB that has not been migrated yet
+    stored_types = (int,)
+
+    def db_value(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        return tconst_to_int(value)
+
+    def python_value(self, value):
+        # rows of an older DB that has not been migrated yet still hold the text
+        return int_to_tconst(value) if isinstance(value, int) else value
+
+
+class EpochField(IntegerField):
+    """
+    Date and time stored as the number of seconds since 1970-01-01, taken as the same local time it is given in,
+    so it reads back exactly as written. A fraction of the size of the text of a DateTimeField, and much faster
+    to read. Fractions of seconds are dropped.
+    """
+    stored_types = (int, str)
+
+    def db_value(self, value):
+        if value is None or isinstance(value, int):
+            return value
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime(value.year, value.month, value.day)
+        return (value.replace(tzinfo=None) - EPOCH) // ONE_SECOND
+
+    def python_value(self, value):
+        if isinstance(value, int):
+            return EPOCH + datetime.timedelta(seconds=value)
+        # rows of an older DB that has not been migrated yet still hold the text
+        return datetime.datetime.fromisoformat(value) if value is not None else None
 
 
 # model definitions -- the standard "pattern" is to define a base model class
@@ -16,11 +64,14 @@ database = SqliteDatabase(DATABASE)
 class BaseModel(Model):
     plex_id = IntegerField(primary_key=True, unique=True)
     title = CharField()
-    imdb_id = CharField(null=True)
+    imdb_id = TconstField(null=True, index=True)
     tmdb_id = IntegerField(null=True)
-    rating = DoubleField(null=True)
-    last_update = DateTimeField(default=datetime.datetime.now)
-    release_date = DateTimeField(null=True)
+    rating = DoubleField(null=True)  # the rating in Plex, the IMDB rating after the rating policy
+    imdb_rating = DoubleField(null=True)  # the IMDB rating as fetched
+    votes = IntegerField(null=True)  # the number of votes of the IMDB rating
+    last_update = EpochField(default=datetime.datetime.now, index=True)
+    release_date = EpochField(null=True)
+    next_refresh = EpochField(null=True, index=True)
 
     class Meta:
         database = database
@@ -31,7 +82,7 @@ class Show(BaseModel):
 
 
 class Episode(BaseModel):
-    parent_plex_id = IntegerField()
+    parent_plex_id = IntegerField(index=True)
     episode = IntegerField()
     season = IntegerField()
 
@@ -40,7 +91,136 @@ class Movie(BaseModel):
     tmdb_id = IntegerField(null=True)
 
 
+class IdMapping(Model):
+    """
+    IMDB id of a TVDB or TMDb id, so an id only has to be looked up once
+    """
+    source = CharField()  # tvdb, tmdb_movie or tmdb_show
+    external_id = CharField()
+    imdb_id = TconstField()
+    tmdb_id = IntegerField(null=True)
+    manual = BooleanField(default=False)  # manual overrides are never replaced by lookups
+    last_update = EpochField(default=datetime.datetime.now)
+
+    class Meta:
+        database = database
+        primary_key = CompositeKey('source', 'external_id')
+
+
+class LibraryWatermark(Model):
+    """
+    Latest added and updated time seen in a library, to only enumerate changes on the next run
+    """
+    library = CharField(primary_key=True)
+    added_at = EpochField()
+    updated_at = EpochField()
+    last_run = EpochField(default=datetime.datetime.now)
+
+    class Meta:
+        database = database
+
+
+class PendingWrite(Model):
+    """
+    Rating change a run could not write to the Plex DB, written by the next run
+    """
+    plex_id = IntegerField(primary_key=True)
+    rating = DoubleField(null=True)  # None to reset the rating
+
+    class Meta:
+        database = database
+
+
+# the number of an IMDB id like tt0074053 in SQL, NULL if it is not a valid title id
+TCONST_TO_INT = ("CASE WHEN {column} GLOB 'tt[0-9]*' AND substr({column}, 3) NOT GLOB '*[^0-9]*' "
+                 "THEN CAST(substr({column}, 3) AS INTEGER) END")
+# the seconds since 1970-01-01 of a date and time as text in SQL, without converting it from local time
+TEXT_TO_EPOCH = "CAST(strftime('%s', {column}) AS INTEGER)"
+
+# columns added after the tables were first created, added to existing tables by migrate_tables
+ADDED_COLUMNS = [
+    (Show, 'next_refresh'),
+    (Movie, 'next_refresh'),
+    (Episode, 'next_refresh'),
+    (Show, 'imdb_rating'),
+    (Movie, 'imdb_rating'),
+    (Episode, 'imdb_rating'),
+    (Show, 'votes'),
+    (Movie, 'votes'),
+    (Episode, 'votes'),
+]
+# columns of which the type changed, converted in place by migrate_tables with the SQL expression converting the
+# old values
+CHANGED_COLUMNS = [(model, column, 'integer', convert) for model in (Show, Movie, Episode) for column, convert in (
+    ('imdb_id', TCONST_TO_INT),
+    ('last_update', TEXT_TO_EPOCH),
+    ('release_date', TEXT_TO_EPOCH),
+    ('next_refresh', TEXT_TO_EPOCH),
+)] + [
+    (IdMapping, 'imdb_id', 'integer', TCONST_TO_INT),
+    (IdMapping, 'last_update', 'integer', TEXT_TO_EPOCH),
+    (LibraryWatermark, 'added_at', 'integer', TEXT_TO_EPOCH),
+    (LibraryWatermark, 'updated_at', 'integer', TEXT_TO_EPOCH),
+    (LibraryWatermark, 'last_run', 'integer', TEXT_TO_EPOCH),
+]
+
+
+def migrate_tables():
+    """
+    Add the columns of newer versions to the tables of an existing local DB, and convert the columns of which
+    the type changed
+    """
+    migrator = SqliteMigrator(database)
+    for model, column in ADDED_COLUMNS:
+        table = model._meta.table_name
+        if not database.table_exists(table):
+            continue
+        if column not in [existing.name for existing in database.get_columns(table)]:
+            migrate(migrator.add_column(table, column, model._meta.fields[column]))
+    conversions = {}
+    for model, column, data_type, convert in CHANGED_COLUMNS:
+        table = model._meta.table_name
+        if not database.table_exists(table):
+            continue
+        existing = {existing.name: existing.data_type for existing in database.get_columns(table)}
+        if existing.get(column, data_type).lower() != data_type:
+            conversions.setdefault(model, {})[column] = convert
+    for model, columns in conversions.items():
+        logger.info("Converting {columns} of the {table} table of the local DB".format(
+            columns=", ".join(sorted(columns)), table=model._meta.table_name))
+        rebuild_table(model, columns)
+
+
+def rebuild_table(model, conversions):
+    """
+    Copy a table into a new one with the current schema and indexes of its model, as SQLite can't change the
+    type of a column. The columns missing from the model are dropped, and so are the rows that don't fit the new
+    schema, like an id mapping to an IMDB id that is not a title id.
+    :param model: the model of the table
+    :param conversions: dict of column and the SQL expression converting its old values, with {column} for the column
+    """
+    table = model._meta.table_name
+    old_table = table + "__old"
+    with database.atomic():
+        columns = [existing.name for existing in database.get_columns(table) if existing.name in model._meta.columns]
+        # the indexes go with the old table, so the new one can get them under the same names
+        database.execute_sql('ALTER TABLE "{table}" RENAME TO "{old}"'.format(table=table, old=old_table))
+        for index in database.get_indexes(old_table):
+            if index.sql is None:
+                # the automatic indexes of constraints go with the table
+                continue
+            database.execute_sql('DROP INDEX "{index}"'.format(index=index.name))
+        model.create_table(safe=False)
+        values = [conversions[column].format(column='"{0}"'.format(column)) if column in conversions
+                  else '"{0}"'.format(column) for column in columns]
+        database.execute_sql('INSERT OR IGNORE INTO "{table}" ({columns}) SELECT {values} FROM "{old}"'.format(
+            table=table, columns=", ".join('"{0}"'.format(column) for column in columns), values=", ".join(values),
+            old=old_table))
+        database.execute_sql('DROP TABLE "{old}"'.format(old=old_table))
+
+
 # simple utility function to create tables
 def create_tables():
     with database:
-        database.create_tables([Show, Movie, Episode])
+        migrate_tables()
+        database.create_tables([Show, Movie, Episode, IdMapping, LibraryWatermark, PendingWrite])
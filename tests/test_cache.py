@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+
+from benchmarks.stubs import StubServer, tmdb_route
+from utils import cache, tmdb
+
+
+def route(path, query):
+    return 200, {"path": path, "i": query.get("i"), "padding": "x" * 100}
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cache.sqlite")
+        self.stub = StubServer(route, etag=True).start()
+        cache.open_cache(self.path, ratings_ttl=timedelta(days=1))
+        self.session = cache.CachedSession("omdb", "ratings")
+
+    def tearDown(self):
+        cache.close_cache()
+        self.stub.stop()
+        shutil.rmtree(self.directory)
+
+    def get(self, imdb_id):
+        return self.session.get(self.stub.url + "/", params={"i": imdb_id, "apikey": "secret"}, timeout=5)
+
+    def test_hit(self):
+        self.assertEqual(self.get("tt0074053").json()["i"], "tt0074053")
+        self.assertEqual(self.get("tt0074053").json()["i"], "tt0074053")
+        self.assertEqual(self.get("tt0074054").json()["i"], "tt0074054")
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(cache.stats()["omdb"], {"hits": 1, "misses": 2, "revalidated": 0})
+
+    def test_key_leaves_out_api_key(self):
+        self.assertEqual(cache.cache_key("omdb", "http://x/", {"i": "tt1", "apikey": "secret"}), "omdb:http://x/?i=tt1")
+
+    def test_persistent(self):
+        self.get("tt0074053")
+        cache.close_cache()
+        cache.open_cache(self.path)
+        self.assertEqual(self.get("tt0074053").json()["i"], "tt0074053")
+        self.assertEqual(self.stub.requests, 1)
+
+    def test_revalidate_expired(self):
+        cache.store.ttls["ratings"] = timedelta(seconds=0)
+        self.get("tt0074053")
+        time.sleep(0.01)
+        self.assertEqual(self.get("tt0074053").json()["i"], "tt0074053")
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(self.stub.not_modified, 1)
+        self.assertEqual(cache.stats()["omdb"], {"hits": 0, "misses": 1, "revalidated": 1})
+
+    def test_refresh_expired(self):
+        cache.store.ttls["ratings"] = timedelta(seconds=0)
+        self.get("tt0074053")
+        time.sleep(0.01)
+        # without a stored ETag the provider sends the whole response again
+        cache.store.conn.execute("UPDATE responses SET headers = '{}'")
+        self.get("tt0074053")
+        self.assertEqual(self.stub.not_modified, 0)
+        self.assertEqual(cache.stats()["omdb"], {"hits": 0, "misses": 2, "revalidated": 0})
+
+    def test_skip_responses_without_mapping(self):
+        stub = StubServer(tmdb_route(shows={"1": "tt0907683", "2": None}, tvdb={"82506": "1"})).start()
+        self.addCleanup(stub.stop)
+        session = cache.CachedSession("tmdb", "ids", tmdb.has_mapping)
+        for _ in range(2):
+            for path in ("/3/find/82506", "/3/find/99999", "/3/tv/1/external_ids", "/3/tv/2/external_ids"):
+                self.assertEqual(session.get(stub.url + path, timeout=5).status_code, 200)
+        # a show TMDb doesn't map yet is asked again, it may be mapped by now
+        self.assertEqual(stub.requests, 6)
+        self.assertEqual(cache.stats()["tmdb"], {"hits": 2, "misses": 6, "revalidated": 0})
+
+    def test_evict_least_recently_used(self):
+        for number in range(10):
+            self.get("tt{0:07d}".format(number))
+        size = cache.store.size
+        cache.store.max_size = size // 2
+        self.get("tt0000000")
+        self.get("tt0000010")
+        self.assertLessEqual(cache.store.size, size // 2)
+        # the entry used last is kept, the oldest ones are gone
+        requests = self.stub.requests
+        self.get("tt0000000")
+        self.assertEqual(self.stub.requests, requests)
+        self.get("tt0000001")
+        self.assertEqual(self.stub.requests, requests + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
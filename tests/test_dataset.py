@@ -0,0 +1,80 @@
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from utils import config, dataset
+
+
+def write_dump(path, header, rows):
+    with gzip.open(path, "wt", encoding="utf-8") as dump:
+        dump.write(header + "\n")
+        for row in rows:
+            dump.write("\t".join(row) + "\n")
+
+
+class DatasetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ratings = os.path.join(self.directory, dataset.RATINGS_FILE)
+        self.episodes = os.path.join(self.directory, dataset.EPISODES_FILE)
+        write_dump(self.ratings, "tconst\taverageRating\tnumVotes", [
+            ["tt0074053", "7.1", "1200"],
+            ["tt0907683", "8.4", "56000"],
+            ["tt0907684", "7.9", "12000"],
+        ])
+        write_dump(self.episodes, "tconst\tparentTconst\tseasonNumber\tepisodeNumber", [
+            ["tt0907684", "tt0907683", "1", "1"],
+            ["tt0907685", "tt0907683", "1", "2"],
+            ["tt0907686", "tt0907683", "\\N", "\\N"],
+        ])
+        config.IMDB_DATASET_DIR = self.directory
+        config.IMDB_DATASET_INDEX = os.path.join(self.directory, "index.sqlite")
+
+    def tearDown(self):
+        if dataset.connection is not None:
+            dataset.connection.close()
+            dataset.connection = None
+        config.IMDB_DATASET_DIR = ''
+        config.IMDB_DATASET_INDEX = 'imdb-dataset.sqlite'
+        shutil.rmtree(self.directory)
+
+    def test_tconst_packing(self):
+        self.assertEqual(dataset.tconst_to_int("tt0074053"), 74053)
+        self.assertEqual(dataset.int_to_tconst(74053), "tt0074053")
+        self.assertEqual(dataset.int_to_tconst(10048342), "tt10048342")
+        self.assertIsNone(dataset.tconst_to_int("nm0000001"))
+
+    def test_lookups(self):
+        self.assertTrue(dataset.build_index())
+        self.assertEqual(dataset.get_title_ratings("tt0074053"), {"rating": 7.1, "votes": 1200})
+        self.assertIsNone(dataset.get_title_ratings("tt9999999"))
+        self.assertEqual(dataset.get_season("tt0907683", 1), {
+            1: {"rating": 7.9, "imdb_id": "tt0907684", "votes": 12000},
+            2: 'N/A',
+        })
+        self.assertIsNone(dataset.get_season("tt0907683", 2))
+
+    def test_missing_dump(self):
+        os.remove(self.episodes)
+        self.assertTrue(dataset.build_index())
+        self.assertEqual(dataset.get_title_ratings("tt0074053")["rating"], 7.1)
+        self.assertIsNone(dataset.get_season("tt0907683", 1))
+        self.assertEqual(dataset.get_show("tt0907683"), {})
+
+    def test_incremental_rebuild(self):
+        self.assertTrue(dataset.build_index())
+        self.assertFalse(dataset.build_index())
+        write_dump(self.ratings, "tconst\taverageRating\tnumVotes", [["tt0074053", "6.5", "1300"]])
+        later = time.time() + 10
+        os.utime(self.ratings, (later, later))
+        self.assertTrue(dataset.build_index())
+        self.assertEqual(dataset.get_title_ratings("tt0074053")["rating"], 6.5)
+        # the episode dump did not change, so it is kept as is
+        self.assertEqual(dataset.get_season("tt0907683", 1)[2], 'N/A')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,17 @@
+import subprocess
+import sys
+import unittest
+
+
+class ImportTestCase(unittest.TestCase):
+    def test_lazy_imports(self):
+        # single-item runs start fast when the slow packages are only loaded once they are used
+        code = ("import sys, update_imdb_ratings; "
+                "print(' '.join(name for name in ('plexapi', 'imdbpie', 'omdb', 'tqdm') if name in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True,
+                                check=True).stdout
+        self.assertEqual(output.strip(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from collections import namedtuple
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import models
+import update_imdb_ratings
+from benchmarks.fakeplex import FakeServer
+from benchmarks.synthetic import create_plex_database, change_plex_database, MOVIE, SHOW, EPISODE
+from models import create_tables, Movie
+from utils import incremental, plexdb
+from utils.index import LocalIndex
+
+Item = namedtuple("Item", ["addedAt", "updatedAt"])
+
+
+def timestamp(plex_id):
+    # the synthetic library adds and updates every item at 1500000000 + id
+    return datetime.fromtimestamp(1500000000 + plex_id)
+
+
+class IncrementalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "com.plexapp.plugins.library.db")
+        self.ids = create_plex_database(self.path, movies=10, shows=2, seasons=1, episodes=2)
+        self.conn = plexdb.connect(self.path)
+        models.database.init(os.path.join(self.directory, "db.sqlite"))
+        create_tables()
+
+    def tearDown(self):
+        self.conn.close()
+        models.database.close()
+        models.database.init(models.DATABASE)
+        shutil.rmtree(self.directory)
+
+    def test_changed_movies(self):
+        movies = plexdb.get_section(self.conn, "Movies")
+        watermark = (timestamp(self.ids[MOVIE][7]), timestamp(self.ids[MOVIE][7]))
+        self.assertEqual([item.ratingKey for item in movies.changed(*watermark)], self.ids[MOVIE][7:])
+
+    def test_show_with_new_episode(self):
+        shows = plexdb.get_section(self.conn, "TV Shows")
+        last = self.ids[EPISODE][-1]
+        watermark = (timestamp(last) + timedelta(seconds=1), timestamp(last) + timedelta(seconds=1))
+        self.assertEqual(shows.changed(*watermark), [])
+        # a new episode of the first show, Plex doesn't touch the show itself
+        conn = sqlite3.connect(self.path)
+        season = conn.execute("SELECT id FROM metadata_items WHERE parent_id = ? AND \"index\" = 1",
+                              [self.ids[SHOW][0]]).fetchone()[0]
+        conn.execute("INSERT INTO metadata_items (id, library_section_id, parent_id, metadata_type, title, \"index\", "
+                     "added_at, updated_at) VALUES (1000, 2, ?, ?, 'New', 3, ?, ?)",
+                     [season, EPISODE, 1600000000, 1600000000])
+        conn.commit()
+        conn.close()
+        self.assertEqual([item.ratingKey for item in shows.changed(*watermark)], [self.ids[SHOW][0]])
+
+    def test_changed_items_via_plex_api(self):
+        # the same changes through the queries of the Plex API path
+        last = self.ids[EPISODE][-1]
+        watermark = (timestamp(last) + timedelta(seconds=1), timestamp(last) + timedelta(seconds=1))
+        added = change_plex_database(self.path, new_movies=2, updated=0, new_episodes=1)
+        server = FakeServer(self.path)
+        movies = server.library.section("Movies")
+        shows = server.library.section("TV Shows")
+        self.assertEqual([item.ratingKey for item in incremental.changed_items(movies, watermark)], added[MOVIE])
+        self.assertEqual([item.ratingKey for item in incremental.changed_items(shows, watermark)], [self.ids[SHOW][0]])
+        self.assertEqual([item.ratingKey for item in incremental.fetch_items(movies, [self.ids[MOVIE][0], 999])],
+                         [self.ids[MOVIE][0]])
+
+    def test_advance(self):
+        watermark = (datetime(2020, 1, 1), datetime(2020, 1, 1))
+        items = [Item(datetime(2020, 1, 2), datetime(2020, 1, 3)), Item(datetime(2020, 1, 5), None)]
+        self.assertEqual(incremental.advance(watermark, items, []), (datetime(2020, 1, 5), datetime(2020, 1, 3)))
+        # failed items are enumerated again on the next run
+        self.assertEqual(incremental.advance(watermark, items, items[:1]),
+                         (datetime(2020, 1, 2) - timedelta(seconds=1), datetime(2020, 1, 3) - timedelta(seconds=1)))
+        self.assertEqual(incremental.advance(None, [], []), (datetime.fromtimestamp(0), datetime.fromtimestamp(0)))
+
+    def test_failed_seasons_hold_back(self):
+        run = update_imdb_ratings.UpdateRun(*[None] * 12)
+        show = SimpleNamespace(title="Show", addedAt=datetime(2020, 1, 2), updatedAt=datetime(2020, 1, 3))
+        update_imdb_ratings.handle_seasons(run, show, "tt0907683", None, IOError("unreachable"))
+        update_imdb_ratings.handle_season_ratings(run, show, None, [(None, None)] * 2, None, IOError("unreachable"))
+        self.assertEqual(run.errors, [show, show])
+        self.assertEqual(run.failed, 3)
+        # the new episodes of the show are enumerated again on the next run
+        self.assertEqual(incremental.advance(None, [show], run.errors)[0], datetime(2020, 1, 2) - timedelta(seconds=1))
+
+    def test_enumerate_changed_and_due(self):
+        movies = plexdb.get_section(self.conn, "Movies")
+        items, watermark = incremental.enumerate_library(movies, LocalIndex().load())
+        self.assertIsNone(watermark)
+        self.assertEqual(len(items), 10)
+        incremental.save_watermark("Movies", incremental.advance(watermark, items, []))
+
+        for plex_id in self.ids[MOVIE][:3]:
+            Movie.create(plex_id=plex_id, title="Movie", imdb_id="tt0074053", rating=7.1,
+                         next_refresh=datetime.now() + timedelta(days=1.5 - plex_id))
+        index = LocalIndex().load()
+        index.plan()
+        items, watermark = incremental.enumerate_library(movies, index)
+        self.assertEqual(watermark, (timestamp(self.ids[MOVIE][-1]), timestamp(self.ids[MOVIE][-1])))
+        # the last movie is at the watermark, the second and third one are due
+        self.assertEqual([item.ratingKey for item in items], [self.ids[MOVIE][-1]] + self.ids[MOVIE][1:3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+import math
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import models
+from models import create_tables, Movie, Show, Episode, IdMapping
+from utils import incremental, ratings
+from utils.index import LocalIndex, IdMappings, TVDB, TMDB_MOVIE, TMDB_SHOW
+from utils.ratings import RatingTable
+from utils.util import check_media_needs_update
+
+
+class LocalIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        models.database.init(os.path.join(self.directory, "db.sqlite"))
+        create_tables()
+        Show.create(plex_id=1, title="Show", imdb_id="tt0907683", tvdb_id=82506, rating=8.4)
+        Episode.create(plex_id=2, parent_plex_id=1, title="Pilot", season=1, episode=1, rating=7.9,
+                       release_date=datetime(2010, 1, 1))
+        Movie.create(plex_id=3, title="Movie", imdb_id="tt0074053", rating=7.1)
+
+    def tearDown(self):
+        models.database.close()
+        models.database.init(models.DATABASE)
+        shutil.rmtree(self.directory)
+
+    def test_load(self):
+        index = LocalIndex().load()
+        self.assertEqual(index.get(Show, "1").tvdb_id, 82506)
+        self.assertEqual(index.get(Movie, 3).imdb_id, "tt0074053")
+        self.assertIsNone(index.get(Movie, 1))
+        self.assertEqual([episode.plex_id for episode in index.show_episodes(1)], [2])
+        self.assertEqual(index.get(Episode, 2).release_date, datetime(2010, 1, 1))
+        self.assertIsInstance(index.get(Episode, 2).last_update, datetime)
+
+    def test_load_items(self):
+        index = LocalIndex()
+        self.assertEqual(index.load_items(["1", 9]), 1)
+        self.assertEqual([episode.plex_id for episode in index.show_episodes(1)], [2])
+        self.assertIsNone(index.get(Movie, 3))
+        # items loaded before keep their changes
+        index.update_rating(index.get(Show, 1), 9.0)
+        self.assertEqual(index.load_items([1, 3]), 1)
+        self.assertEqual(index.get(Show, 1).rating, 9.0)
+        self.assertEqual(len(index.show_episodes(1)), 1)
+        self.assertEqual(LocalIndex().load().load_items([1]), 0)
+
+    def test_stored_prior(self):
+        index = LocalIndex().load()
+        self.assertTrue(math.isnan(ratings.stored_prior(Movie)))
+        index.create(Movie, plex_id=5, title="Five", rating=8.0, votes=100)
+        index.create(Movie, plex_id=6, title="Six", rating=7.0, imdb_rating=6.0, votes=300)
+        index.flush()
+        table = RatingTable.from_records(LocalIndex().load().records[Movie].values(), use_numpy=False)
+        self.assertAlmostEqual(ratings.stored_prior(Movie), table.prior())
+        self.assertAlmostEqual(ratings.stored_prior(Movie), 6.5)
+
+    def test_flush(self):
+        index = LocalIndex().load()
+        index.update_rating(index.get(Movie, 3), 6.5, imdb_rating=6.54, votes=321)
+        index.create(Episode, plex_id=4, parent_plex_id=1, title="Second", season=1, episode=2)
+        self.assertEqual(len(index.show_episodes(1)), 2)
+        self.assertEqual(Movie.get(Movie.plex_id == 3).rating, 7.1)
+        self.assertEqual(index.flush(), 2)
+        self.assertEqual(index.flush(), 0)
+        self.assertEqual(Movie.get(Movie.plex_id == 3).rating, 6.5)
+        self.assertEqual((Movie.get(Movie.plex_id == 3).imdb_rating, Movie.get(Movie.plex_id == 3).votes), (6.54, 321))
+        self.assertEqual(Episode.get(Episode.plex_id == 4).title, "Second")
+        self.assertIsNotNone(Episode.get(Episode.plex_id == 4).last_update)
+
+    def test_ratings_as_float(self):
+        # OMDB returns the ratings as text, Plex has them as float
+        index = LocalIndex().load()
+        movie = index.get(Movie, 3)
+        index.update_rating(movie, "7.3")
+        self.assertEqual((movie.rating, movie.imdb_rating), (7.3, 7.3))
+        self.assertFalse(check_media_needs_update(movie, SimpleNamespace(rating=7.3), due=False))
+        show = index.create(Show, plex_id=5, title="New", rating="N/A", imdb_rating="8.1")
+        self.assertEqual((show.rating, show.imdb_rating), (None, 8.1))
+
+    def test_plan_most_overdue_first(self):
+        now = datetime.now()
+        index = LocalIndex().load()
+        index.get(Movie, 3).next_refresh = now - timedelta(days=1)
+        index.get(Show, 1).next_refresh = now + timedelta(days=5)
+        index.get(Episode, 2).next_refresh = now - timedelta(days=2)
+        index.create(Movie, plex_id=5, title="Later", next_refresh=now + timedelta(days=1))
+        # the show is due because of its episode
+        self.assertEqual([(model, plex_id) for due_time, model, plex_id in index.due(now)], [(Show, 1), (Movie, 3)])
+        self.assertEqual(index.plan(now, budget=1), 1)
+        self.assertTrue(index.is_planned(Show, "1"))
+        self.assertFalse(index.is_planned(Movie, 3))
+        index.create(Movie, plex_id=6, title="Older", next_refresh=now - timedelta(days=3))
+        index.plan(now)
+        self.assertEqual(index.planned_ids(Movie), [6, 3])
+        # a shard only plans its own items
+        self.assertEqual(index.plan(now, owns=lambda plex_id: int(plex_id) % 2 == 1), 2)
+        self.assertEqual(index.plan(now, owns=lambda plex_id: int(plex_id) % 2 == 0), 1)
+
+    def test_migrate_existing_db(self):
+        models.database.execute_sql("DROP TABLE movie")
+        models.database.execute_sql("CREATE TABLE movie (plex_id INTEGER PRIMARY KEY, title VARCHAR(255), "
+                                    "imdb_id VARCHAR(255), tmdb_id INTEGER, rating REAL, last_update DATETIME, "
+                                    "release_date DATETIME)")
+        models.database.execute_sql("CREATE INDEX movie_tmdb_id ON movie (tmdb_id)")
+        models.database.execute_sql("INSERT INTO movie VALUES (3, 'Movie', 'tt0074053', NULL, 7.1, '2020-01-01', NULL)")
+        models.database.execute_sql("INSERT INTO movie VALUES (4, 'Other', 'nm0000001', NULL, 6.0, '2020-01-01', NULL)")
+        create_tables()
+        index = LocalIndex().load()
+        self.assertIn(3, [record.plex_id for record in index.unscheduled() if record.model is Movie])
+        self.assertEqual(index.get(Movie, 3).imdb_id, "tt0074053")
+        self.assertEqual(index.get(Movie, 3).last_update, datetime(2020, 1, 1))
+        self.assertIsNone(index.get(Movie, 4).imdb_id)
+        # the added column is empty, the movie is scheduled on the next run
+        self.assertIsNone(index.get(Movie, 3).next_refresh)
+        self.assertEqual(models.database.execute_sql("SELECT imdb_id, last_update FROM movie WHERE plex_id = 3")
+                         .fetchone(), (74053, 1577836800))
+        self.assertEqual(set(idx.name for idx in models.database.get_indexes("movie")),
+                         {"movie_next_refresh", "movie_imdb_id", "movie_last_update"})
+        # migrating again leaves the table as it is
+        create_tables()
+        self.assertEqual(Movie.get(Movie.plex_id == 3).rating, 7.1)
+
+    def test_packed_imdb_ids(self):
+        self.assertEqual(Movie.get(Movie.imdb_id == "tt0074053").plex_id, 3)
+        self.assertEqual(Show.get(Show.plex_id == 1).imdb_id, "tt0907683")
+        index = LocalIndex().load()
+        index.create(Episode, plex_id=4, parent_plex_id=1, title="Second", season=1, episode=2, imdb_id="tt10872600")
+        index.flush()
+        self.assertEqual(LocalIndex().load().get(Episode, 4).imdb_id, "tt10872600")
+        # the packed values are converted when they are read, and written back as they are
+        movie = LocalIndex().load().get(Movie, 3)
+        self.assertEqual(movie._imdb_id, 74053)
+        self.assertEqual(movie.row(), Movie.select(*Movie._meta.sorted_fields).where(Movie.plex_id == 3)
+                         .tuples().get())
+        self.assertEqual(movie._imdb_id, "tt0074053")
+        self.assertIn("episode_parent_plex_id", [idx.name for idx in models.database.get_indexes("episode")])
+        self.assertEqual(models.database.execute_sql("PRAGMA journal_mode").fetchone()[0], "wal")
+
+
+class IdMappingsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        models.database.init(os.path.join(self.directory, "db.sqlite"))
+        create_tables()
+
+    def tearDown(self):
+        models.database.close()
+        models.database.init(models.DATABASE)
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_overrides_take_priority(self):
+        mappings = IdMappings()
+        self.assertTrue(mappings.add(TVDB, 73817, "tt0000001", 1234))
+        self.assertEqual(mappings.load_overrides(self.write("overrides.txt", "73817=tt0074053\n\n82506=tt0907683")), 2)
+        self.assertEqual(mappings.get(TVDB, "73817"), ("tt0074053", None))
+        self.assertFalse(mappings.add(TVDB, 73817, "tt0000001"))
+        self.assertEqual(mappings.get(TVDB, 73817), ("tt0074053", None))
+
+    def test_seed_and_flush(self):
+        mappings = IdMappings()
+        path = self.write("export.tsv", "imdb_id\ttvdb_id\ttmdb_id\ttype\n"
+                                        "tt0907683\t82506\t1413\t\n"
+                                        "tt0074053\t\t11\tmovie\n"
+                                        "invalid\t1\t2\t\n")
+        self.assertEqual(mappings.seed(path), 3)
+        self.assertEqual(mappings.get(TMDB_SHOW, 1413), ("tt0907683", 1413))
+        self.assertEqual(mappings.get(TMDB_MOVIE, "11"), ("tt0074053", 11))
+        self.assertEqual(mappings.flush(), 3)
+        self.assertEqual(mappings.flush(), 0)
+        self.assertEqual(IdMapping.select().count(), 3)
+        self.assertEqual(IdMappings().load().get(TVDB, 82506), ("tt0907683", 1413))
+        self.assertEqual(models.database.execute_sql("SELECT imdb_id FROM idmapping WHERE external_id = '82506'")
+                         .fetchone(), (907683,))
+
+    def test_invalid_imdb_ids(self):
+        mappings = IdMappings()
+        self.assertFalse(mappings.add(TMDB_MOVIE, 11, "nm0000001"))
+        self.assertEqual(mappings.load_overrides(self.write("overrides.txt", "73817=tt0074053\n82506=0907683")), 1)
+        self.assertIsNone(mappings.get(TVDB, 82506))
+        self.assertEqual(mappings.flush(), 1)
+
+    def test_migrate_existing_db(self):
+        models.database.execute_sql("DROP TABLE idmapping")
+        models.database.execute_sql("DROP TABLE librarywatermark")
+        models.database.execute_sql("CREATE TABLE idmapping (source VARCHAR(255), external_id VARCHAR(255), "
+                                    "imdb_id VARCHAR(255), tmdb_id INTEGER, manual INTEGER, last_update DATETIME, "
+                                    "PRIMARY KEY (source, external_id))")
+        models.database.execute_sql("INSERT INTO idmapping VALUES ('tvdb', '82506', 'tt0907683', 1413, 0, "
+                                    "'2020-01-01 10:00:00.123456')")
+        models.database.execute_sql("INSERT INTO idmapping VALUES ('tvdb', '1', 'invalid', NULL, 1, '2020-01-01')")
+        models.database.execute_sql("CREATE TABLE librarywatermark (library VARCHAR(255) PRIMARY KEY, "
+                                    "added_at DATETIME, updated_at DATETIME, last_run DATETIME)")
+        models.database.execute_sql("INSERT INTO librarywatermark VALUES ('Movies', '2020-01-01 10:00:00', "
+                                    "'2020-01-02 10:00:00', '2020-01-03 10:00:00.5')")
+        create_tables()
+        self.assertEqual(IdMappings().load().mappings, {(TVDB, "82506"): ("tt0907683", 1413, False)})
+        self.assertEqual(IdMapping.get().last_update, datetime(2020, 1, 1, 10))
+        self.assertEqual(incremental.get_watermark("Movies"), (datetime(2020, 1, 1, 10), datetime(2020, 1, 2, 10)))
+        incremental.save_watermark("Movies", (datetime(2020, 2, 1, 10), datetime(2020, 2, 2, 10)))
+        self.assertEqual(incremental.get_watermark("Movies"), (datetime(2020, 2, 1, 10), datetime(2020, 2, 2, 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import time
+import unittest
+
+import requests
+
+from benchmarks.stubs import StubServer
+from utils import config, limiter
+from utils.limiter import TokenBucket
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=20, burst=5)
+        start = time.monotonic()
+        for _ in range(10):
+            bucket.acquire()
+        elapsed = time.monotonic() - start
+        # the burst is free, the other 5 requests take 1/20th of a second each
+        self.assertGreater(elapsed, 0.2)
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(bucket.requests, 10)
+        self.assertGreater(bucket.throttled, 0.2)
+
+    def test_block(self):
+        bucket = TokenBucket(rate=100, burst=100)
+        bucket.block(0.3)
+        start = time.monotonic()
+        bucket.acquire()
+        self.assertGreater(time.monotonic() - start, 0.25)
+        self.assertEqual(bucket.rate_limited, 1)
+
+    def test_acquire_async(self):
+        bucket = TokenBucket(rate=20, burst=1)
+
+        async def acquire_all():
+            await asyncio.gather(*[bucket.acquire_async() for _ in range(5)])
+
+        start = time.monotonic()
+        asyncio.run(acquire_all())
+        self.assertGreater(time.monotonic() - start, 0.15)
+        self.assertEqual(bucket.requests, 5)
+
+
+class CallTestCase(unittest.TestCase):
+    def setUp(self):
+        self.max_retries = config.MAX_RETRIES
+        self.backoff = config.RETRY_BACKOFF
+        config.RETRY_BACKOFF = 0.01
+        limiter.limiters.clear()
+
+    def tearDown(self):
+        config.MAX_RETRIES = self.max_retries
+        config.RETRY_BACKOFF = self.backoff
+        limiter.limiters.clear()
+
+    def test_backoff_is_bounded(self):
+        config.RETRY_BACKOFF = 1.0
+        for attempt in range(1, 20):
+            self.assertLessEqual(limiter.backoff(attempt), config.RETRY_BACKOFF_MAX)
+
+    def test_retry_after_429(self):
+        with StubServer(lambda path, query: (200, {}), rate_limit=2) as stub:
+            start = time.monotonic()
+            responses = [limiter.call("stub", requests.get, stub.url) for _ in range(3)]
+            self.assertEqual([r.status_code for r in responses], [200, 200, 200])
+            # the third request was rate limited and waited for the Retry-After of the stub
+            self.assertGreater(time.monotonic() - start, 0.9)
+            self.assertEqual(limiter.stats()["stub"]["rate_limited"], 1)
+
+    def test_gives_up_after_max_retries(self):
+        config.MAX_RETRIES = 2
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise requests.ConnectionError("no connection")
+
+        self.assertRaises(requests.ConnectionError, limiter.call, "failing", fail)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(limiter.stats()["failing"]["retries"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils import metrics
+from utils.metrics import Histogram, Metrics
+from utils.pipeline import Pipeline
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in [0.002] * 90 + [0.3] * 9 + [120]:
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.quantile(0.5), 0.005)
+        self.assertEqual(histogram.quantile(0.95), 0.5)
+        self.assertEqual(histogram.quantile(1), 120)
+        self.assertIsNone(Histogram().quantile(0.5))
+
+    def test_summary(self):
+        registry = Metrics()
+        registry.inc("items", 3, result="updated")
+        registry.inc("items", result="updated")
+        registry.gauge("cache_hit_ratio", 0.5, provider="omdb")
+        with registry.timer("stage_seconds", stage="omdb"):
+            pass
+        summary = registry.summary()
+        self.assertEqual(summary["counters"], [{"name": "items", "labels": {"result": "updated"}, "value": 4}])
+        self.assertEqual(summary["gauges"][0]["value"], 0.5)
+        self.assertEqual(summary["timers"][0]["labels"], {"stage": "omdb"})
+        self.assertEqual(summary["timers"][0]["count"], 1)
+
+    def test_prometheus(self):
+        registry = Metrics()
+        registry.inc("items", 2, result="updated")
+        registry.observe("request_seconds", 0.02, provider="tmdb")
+        registry.observe("request_seconds", 7, provider="tmdb")
+        lines = registry.prometheus({"shard": "1/2"}).splitlines()
+        self.assertIn("# TYPE plex_imdb_updater_items_total counter", lines)
+        self.assertIn('plex_imdb_updater_items_total{result="updated",shard="1/2"} 2', lines)
+        self.assertIn('plex_imdb_updater_request_seconds_bucket{provider="tmdb",shard="1/2",le="0.025"} 1', lines)
+        self.assertIn('plex_imdb_updater_request_seconds_bucket{provider="tmdb",shard="1/2",le="+Inf"} 2', lines)
+        self.assertIn('plex_imdb_updater_request_seconds_count{provider="tmdb",shard="1/2"} 2', lines)
+        self.assertEqual(len([line for line in lines if line.startswith("# TYPE")]), 3)
+
+    def test_export(self):
+        directory = tempfile.mkdtemp()
+        try:
+            metrics.inc("items", result="failed")
+            json_file = os.path.join(directory, "metrics.json")
+            prometheus_file = os.path.join(directory, "updater.prom")
+            metrics.export(json_file, prometheus_file)
+            with open(json_file) as file:
+                self.assertEqual(json.load(file)["counters"][0]["value"], 1)
+            with open(prometheus_file) as file:
+                self.assertIn('plex_imdb_updater_items_total{result="failed"} 1', file.read())
+            self.assertEqual(sorted(os.listdir(directory)), ["metrics.json", "updater.prom"])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_pipeline_stages(self):
+        pipeline = Pipeline({"omdb": 2, "imdb": 1})
+        for _ in range(3):
+            pipeline.submit(lambda result, error: None, "omdb", len, "abc")
+        pipeline.shutdown()
+        timers = {timer["labels"]["stage"]: timer for timer in metrics.registry.summary()["timers"]}
+        self.assertEqual(timers["omdb"]["count"], 3)
+        self.assertNotIn("imdb", timers)
+
+
+if __name__ == "__main__":
+    unittest.main()
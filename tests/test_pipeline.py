@@ -0,0 +1,89 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+import update_imdb_ratings
+from benchmarks.stubs import StubServer, tmdb_route, omdb_route
+from utils import config, omdb
+from utils.index import IdMappings, TMDB_MOVIE
+from utils.pipeline import Pipeline, next_stage
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.results = []
+
+    def handler(self, result, error):
+        self.results.append((result, error))
+
+    def test_slow_provider_does_not_block_others(self):
+        pipeline = Pipeline({"slow": 1, "fast": 2})
+        released = threading.Event()
+        pipeline.submit(self.handler, "slow", released.wait, 10)
+        for value in range(4):
+            pipeline.submit(self.handler, "fast", abs, -value)
+        while len(self.results) < 4:
+            pipeline.drain(block=True)
+        # the fast jobs are all done while the slow one is still waiting
+        self.assertFalse(released.is_set())
+        self.assertEqual(sorted(result for result, error in self.results), [0, 1, 2, 3])
+        released.set()
+        pipeline.shutdown()
+        self.assertEqual(len(self.results), 5)
+        self.assertEqual(self.results[-1], (True, None))
+
+    def test_stages_and_errors(self):
+        pipeline = Pipeline({"first": 1, "second": 1})
+        pipeline.submit(self.handler, "first", lambda value: next_stage("second", abs, value), -3)
+        pipeline.submit(self.handler, "first", int, "not a number")
+        pipeline.submit_stage(self.handler, 7)
+        pipeline.shutdown()
+        self.assertIn((3, None), self.results)
+        self.assertIn((7, None), self.results)
+        self.assertTrue(any(isinstance(error, ValueError) for result, error in self.results))
+
+
+class StubProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmdb = StubServer(tmdb_route(movies={str(i): "tt{0:07d}".format(i) for i in range(8)}),
+                               latency=0.2).start()
+        self.omdb = StubServer(omdb_route(ratings={"tt{0:07d}".format(i): 5 + i / 10 for i in range(8)}),
+                               latency=0.2).start()
+        for name, value in (("TMDB_API_KEY", "key"), ("TMDB_API_URL", self.tmdb.url + "/3"),
+                            ("OMDB_API_KEY", "key"), ("OMDB_API_URL", self.omdb.url)):
+            patcher = patch.object(config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(omdb, "client", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmdb.stop()
+        self.omdb.stop()
+
+    def test_resolve_and_fetch_concurrently(self):
+        results = []
+        mappings = IdMappings()
+        pipeline = Pipeline({"tmdb": 4, "omdb": 4, "imdb": 1})
+        for tmdb_id in range(8):
+            pipeline.submit(lambda result, error: results.append(result), "tmdb", update_imdb_ratings.fetch_ids,
+                            mappings, True, "com.plexapp.agents.themoviedb://{0}?lang=en".format(tmdb_id))
+        pipeline.shutdown()
+        # the requests to every provider overlap, up to the number of workers of its pool
+        for stub in (self.tmdb, self.omdb):
+            self.assertGreater(stub.max_active, 1)
+            self.assertLessEqual(stub.max_active, 4)
+        self.assertEqual(self.tmdb.requests, 8)
+        self.assertEqual(self.omdb.requests, 8)
+        self.assertIn(("tt0000003", "3", None, "5.3", "OMDB", 1234), results)
+        # every lookup is remembered, resolving again doesn't need TMDb
+        self.assertEqual(mappings.get(TMDB_MOVIE, 3), ("tt0000003", 3))
+        guid = "com.plexapp.agents.themoviedb://3?lang=en"
+        self.assertFalse(update_imdb_ratings.needs_id_lookup(mappings, True, guid))
+        self.assertEqual(update_imdb_ratings.resolve_guid(mappings, True, guid), ("tt0000003", 3, None))
+        self.assertEqual(self.tmdb.requests, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from benchmarks.synthetic import create_plex_database
+from utils import plexdb
+
+
+class PlexDatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "com.plexapp.plugins.library.db")
+        create_plex_database(self.path, movies=3, shows=2, seasons=2, episodes=4)
+        self.conn = plexdb.connect(self.path)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def test_connect_missing_database(self):
+        self.assertIsNone(plexdb.connect(os.path.join(self.directory, "missing.db")))
+
+    def test_sections(self):
+        movies = plexdb.get_section(self.conn, "Movies")
+        self.assertEqual(movies.type, "movie")
+        items = movies.all()
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0].TYPE, "movie")
+        self.assertTrue(items[0].guid.startswith("com.plexapp.agents.imdb://"))
+        self.assertEqual(items[0].originallyAvailableAt, datetime(2010, 1, 1))
+        self.assertIsNone(plexdb.get_section(self.conn, "Music"))
+
+    def test_seasons(self):
+        show = plexdb.get_section(self.conn, "TV Shows").all()[0]
+        self.assertEqual(show.TYPE, "show")
+        seasons = plexdb.get_seasons(self.conn, show.ratingKey)
+        # specials are skipped
+        self.assertEqual([season.index for season, episodes in seasons], [1, 2])
+        self.assertEqual([episode.index for episode in seasons[0][1]], [1, 2, 3, 4])
+        self.assertEqual(seasons[0][1][0].TYPE, "episode")
+
+    def test_read_only(self):
+        self.assertRaises(Exception, self.conn.execute, "UPDATE metadata_items SET rating = 1")
+
+
+if __name__ == '__main__':
+    unittest.main()
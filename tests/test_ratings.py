@@ -0,0 +1,86 @@
+import math
+import unittest
+
+from models import Movie, Episode
+from utils import ratings
+from utils.index import RECORD_TYPES
+from utils.ratings import RatingTable, RatingPolicy
+
+
+def record(plex_id, rating, imdb_rating=None, votes=None):
+    movie = RECORD_TYPES[Movie]()
+    movie.plex_id, movie.rating, movie.imdb_rating, movie.votes = plex_id, rating, imdb_rating, votes
+    return movie
+
+
+RECORDS = [
+    record(1, 8.0, 8.0, 100000),
+    record(2, 9.6, 9.6, 5),
+    record(3, 6.25, 6.25, None),
+    # stored before the fetched rating was kept separately
+    record(4, 7.0),
+    record(5, None),
+]
+
+
+class RatingTableTestCase(unittest.TestCase):
+    def tables(self):
+        yield RatingTable.from_records(RECORDS, use_numpy=False)
+        if ratings.get_numpy() is not None:
+            yield RatingTable.from_records(RECORDS)
+
+    def test_prior(self):
+        for table in self.tables():
+            self.assertAlmostEqual(table.prior(), (8.0 * 100000 + 9.6 * 5) / 100005)
+        self.assertTrue(math.isnan(RatingTable.from_records([record(1, 7.0)], use_numpy=False).prior()))
+
+    def test_blend(self):
+        for table in self.tables():
+            blended = list(table.blend([(table.imdb_ratings, table.votes), (5.0, 5)]))
+            self.assertAlmostEqual(blended[1], 7.3)
+            # only the second source counts where the first has no votes
+            self.assertEqual(blended[2], 5.0)
+            self.assertEqual(blended[4], 5.0)
+
+    def test_shrink(self):
+        for table in self.tables():
+            shrunk = list(table.shrink(5, 7.0))
+            self.assertAlmostEqual(shrunk[0], 8.0, places=3)
+            self.assertAlmostEqual(shrunk[1], 8.3)
+            # ratings without votes are kept
+            self.assertEqual(shrunk[2:4], [6.25, 7.0])
+            self.assertTrue(math.isnan(shrunk[4]))
+
+    def test_round(self):
+        for table in self.tables():
+            rounded = list(table.round(table.imdb_ratings, 1))
+            self.assertEqual(rounded[:4], [8.0, 9.6, 6.3, 7.0])
+            self.assertTrue(math.isnan(rounded[4]))
+
+    def test_changes(self):
+        for table in self.tables():
+            # titles without a rating are left alone
+            self.assertEqual(table.changes(table.round(table.imdb_ratings, 1)), [(3, 6.3)])
+            self.assertEqual(table.changes(table.imdb_ratings), [])
+
+
+class RatingPolicyTestCase(unittest.TestCase):
+    def test_identity(self):
+        policy = RatingPolicy()
+        self.assertEqual(policy.apply(Movie, "7.6", 12), "7.6")
+        self.assertIsNone(policy.apply(Movie, None))
+
+    def test_same_as_table(self):
+        # a fetched rating ends up the same as when it is recomputed
+        table = RatingTable.from_records(RECORDS, use_numpy=False)
+        policy = RatingPolicy(decimals=1, shrinkage_votes=25, priors={Movie: table.prior()})
+        recomputed = policy.apply_table(Movie, table)
+        for position, movie in enumerate(RECORDS[:3]):
+            self.assertEqual(policy.apply(Movie, str(movie.imdb_rating), movie.votes), recomputed[position])
+        # no prior for episodes, they are only rounded
+        self.assertEqual(policy.apply(Episode, 7.25, 10), 7.3)
+        self.assertIsNone(policy.apply(Movie, "N/A"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from utils.scheduler import RefreshScheduler
+
+
+class RefreshSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2020, 6, 1)
+        self.scheduler = RefreshScheduler(timedelta(days=1), timedelta(days=14), rng=random.Random(1))
+
+    def interval(self, age, change=None, votes=None):
+        return self.scheduler.interval(self.now - age, change, votes, now=self.now)
+
+    def test_release_age(self):
+        self.assertEqual(self.interval(timedelta(days=3)), timedelta(days=1))
+        self.assertTrue(timedelta(days=5) < self.interval(timedelta(days=180)) < timedelta(days=10))
+        self.assertTrue(timedelta(days=12) < self.interval(timedelta(days=400)) < timedelta(days=16))
+        self.assertTrue(timedelta(days=25) < self.interval(timedelta(days=5000)) < timedelta(days=31))
+
+    def test_volatility(self):
+        stable = self.interval(timedelta(days=400), change=0)
+        moved = self.interval(timedelta(days=400), change=-0.5)
+        few_votes = self.interval(timedelta(days=400), votes=10)
+        self.assertTrue(moved < few_votes < stable)
+        self.assertLessEqual(self.interval(timedelta(days=5000), change=0), timedelta(days=56))
+
+    def test_jitter_spreads_refreshes(self):
+        refreshes = {self.scheduler.next_refresh(datetime(2000, 1, 1), 7.0, 7.1, now=self.now) for _ in range(20)}
+        self.assertGreater(len({refresh.date() for refresh in refreshes}), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stubs import StubServer, omdb_route
+from utils import config, omdb
+from utils.seasons import SeasonRatings, Backend, FastestBackend, MIN_SAMPLES
+
+
+class SeasonRatingsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fetch_season(self, imdb_id, season):
+        with self.lock:
+            self.calls.append((imdb_id, season))
+        time.sleep(0.05)
+        return {1: {"rating": 8.0, "imdb_id": "{0}s{1}".format(imdb_id, season)}}
+
+    def test_fetch_once_with_concurrent_requests(self):
+        seasons = SeasonRatings(self.fetch_season)
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda args: seasons.get(*args), [("tt0907683", 1)] * 8 + [("tt0907683", 2)]))
+        self.assertEqual(sorted(self.calls), [("tt0907683", 1), ("tt0907683", 2)])
+        self.assertEqual(results[0], results[7])
+        self.assertEqual(seasons.requests, 2)
+        self.assertEqual(seasons.shared, 7)
+
+    def test_whole_show_at_once(self):
+        shows = []
+
+        def fetch_show(imdb_id):
+            shows.append(imdb_id)
+            return {1: {1: 'N/A'}, 2: {1: {"rating": 7.0, "imdb_id": "tt0000002"}}}
+
+        seasons = SeasonRatings(self.fetch_season, fetch_show)
+        self.assertEqual(seasons.get("tt0907683", 1), {1: 'N/A'})
+        self.assertEqual(seasons.get("tt0907683", 2)[1]["rating"], 7.0)
+        # seasons missing from the show are fetched on their own
+        self.assertEqual(seasons.get("tt0907683", 3)[1]["imdb_id"], "tt0907683s3")
+        self.assertEqual(shows, ["tt0907683"])
+        self.assertEqual(self.calls, [("tt0907683", 3)])
+
+    def test_show_failure_falls_back(self):
+        def fetch_show(imdb_id):
+            raise IOError("no such table")
+
+        seasons = SeasonRatings(self.fetch_season, fetch_show)
+        self.assertEqual(seasons.get("tt0907683", 1)[1]["imdb_id"], "tt0907683s1")
+        self.assertEqual(self.calls, [("tt0907683", 1)])
+
+    def test_failures_are_not_kept(self):
+        failures = [ValueError("offline")]
+
+        def fetch_season(imdb_id, season):
+            if failures:
+                raise failures.pop()
+            return {}
+
+        seasons = SeasonRatings(fetch_season)
+        self.assertRaises(ValueError, seasons.get, "tt0907683", 1)
+        self.assertEqual(seasons.get("tt0907683", 1), {})
+
+    def test_clear(self):
+        seasons = SeasonRatings(self.fetch_season)
+        seasons.get("tt0907683", 1)
+        seasons.clear()
+        seasons.get("tt0907683", 1)
+        self.assertEqual(self.calls, [("tt0907683", 1)] * 2)
+
+
+class FakeBackend(Backend):
+    def __init__(self, name, latency, episodes=None, fails=False):
+        super(FakeBackend, self).__init__()
+        self.name = name
+        self.delay = latency
+        self.episodes = episodes
+        self.fails = fails
+
+    def fetch_season(self, imdb_id, season):
+        time.sleep(self.delay)
+        if self.fails:
+            raise IOError("unreachable")
+        return self.episodes
+
+
+class FastestBackendTestCase(unittest.TestCase):
+    episodes = {1: {"rating": 8.0, "imdb_id": "tt0000001"}}
+
+    def test_abstract(self):
+        self.assertRaises(TypeError, Backend)
+
+    def test_prefers_fastest(self):
+        slow = FakeBackend("slow", 0.02, self.episodes)
+        fast = FakeBackend("fast", 0.0, self.episodes)
+        backend = FastestBackend([slow, fast])
+        for _ in range(2 * MIN_SAMPLES + 5):
+            self.assertEqual(backend.get_season("tt0907683", 1), self.episodes)
+        # both get measured, after that only the fast one is asked
+        self.assertEqual(slow.requests, MIN_SAMPLES)
+        self.assertEqual(fast.requests, MIN_SAMPLES + 5)
+
+    def test_falls_back(self):
+        failing = FakeBackend("failing", 0.0, fails=True)
+        empty = FakeBackend("empty", 0.0)
+        working = FakeBackend("working", 0.01, self.episodes)
+        backend = FastestBackend([failing, empty, working])
+        for _ in range(MIN_SAMPLES + 2):
+            self.assertEqual(backend.get_season("tt0907683", 1), self.episodes)
+        # backends raising or finding nothing are only used as fallback
+        self.assertEqual(failing.errors, MIN_SAMPLES)
+        self.assertEqual(empty.errors, MIN_SAMPLES)
+        self.assertRaises(IOError, FastestBackend([failing]).get_season, "tt0907683", 1)
+
+
+class OmdbSeasonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.omdb = StubServer(omdb_route(seasons={("tt0907683", 1): {1: 8.1, 2: "N/A"}})).start()
+        config.OMDB_API_KEY = "key"
+        config.OMDB_API_URL = self.omdb.url
+        omdb.client = None
+
+    def tearDown(self):
+        self.omdb.stop()
+        config.OMDB_API_KEY = ''
+        omdb.client = None
+
+    def test_normalized(self):
+        self.assertEqual(omdb.get_season_from_omdb("tt0907683", 1),
+                         {1: {"rating": 8.1, "imdb_id": "tt0907683e1"}, 2: 'N/A'})
+        self.assertIsNone(omdb.get_season_from_omdb("tt0907683", 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
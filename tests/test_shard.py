@@ -0,0 +1,52 @@
+import unittest
+
+from utils import limiter
+from utils.shard import Shard, BY_KEY, BY_LIBRARY, parse_shard, run_processes
+
+
+def run_shard(offset, shard=None):
+    return [plex_id + offset for plex_id in range(20) if shard.owns_item(plex_id)]
+
+
+class ShardTestCase(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_shard("2/4"), Shard(1, 4, BY_KEY))
+        self.assertEqual(parse_shard("1/1", BY_LIBRARY), Shard(0, 1, BY_LIBRARY))
+        for spec in ("0/4", "5/4", "4", "a/b"):
+            with self.assertRaises(ValueError):
+                parse_shard(spec)
+
+    def test_shards_own_every_item_once(self):
+        shards = [Shard(index, 3, BY_KEY) for index in range(3)]
+        for plex_id in range(100):
+            self.assertEqual(sum(shard.owns_item(str(plex_id)) for shard in shards), 1)
+        # splitting by library leaves the items of a library together
+        self.assertTrue(all(Shard(1, 3, BY_LIBRARY).owns_item(plex_id) for plex_id in range(10)))
+        self.assertEqual([position for position in range(5) if Shard(1, 3, BY_LIBRARY).owns_library(position)], [1, 4])
+
+    def test_split(self):
+        host = Shard(1, 3, BY_KEY)
+        processes = host.split(2)
+        self.assertEqual(processes, [Shard(1, 6, BY_KEY), Shard(4, 6, BY_KEY)])
+        for plex_id in range(100):
+            self.assertEqual(sum(shard.owns_item(plex_id) for shard in processes), int(host.owns_item(plex_id)))
+        self.assertEqual(processes[1].suffix(), " [5/6]")
+        self.assertEqual(Shard(0, 2, BY_LIBRARY).suffix(), "")
+
+    def test_run_processes(self):
+        results = run_processes(run_shard, Shard(0, 1, BY_KEY).split(3), 100)
+        self.assertEqual(sorted(sum(results, [])), list(range(100, 120)))
+
+    def test_rate_limit_share(self):
+        try:
+            limiter.set_share(0.25)
+            bucket = limiter.get_limiter("tmdb")
+            self.assertEqual(bucket.rate, 0.75)
+            self.assertEqual(bucket.burst, 7.5)
+        finally:
+            limiter.set_share(1)
+        self.assertEqual(limiter.get_limiter("tmdb").rate, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
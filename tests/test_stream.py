@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from benchmarks.fakeplex import FakeServer
+from benchmarks.synthetic import create_plex_database, MOVIE, SHOW
+from utils import incremental, plexdb, stream
+
+
+class StreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "com.plexapp.plugins.library.db")
+        self.ids = create_plex_database(self.path, movies=7, shows=3, seasons=1, episodes=2)
+        self.conn = plexdb.connect(self.path)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def test_database_pages(self):
+        items = stream.stream_library(plexdb.get_section(self.conn, "Movies"), page_size=3)
+        self.assertEqual(len(items), 7)
+        self.assertEqual([item.ratingKey for item in items], self.ids[MOVIE])
+        self.assertEqual(items.pages, 3)
+
+    def test_api_pages(self):
+        server = FakeServer(self.path)
+        items = stream.stream_library(server.library.section("TV Shows"), page_size=3)
+        self.assertEqual(len(items), 3)
+        self.assertEqual([item.ratingKey for item in items], self.ids[SHOW])
+        # a full last page takes one more request to find the end
+        self.assertEqual(items.pages, 2)
+        self.assertEqual(stream.count_items(server.library.section("Movies")), 7)
+
+    def test_paging_time(self):
+        items = stream.stream_library(FakeServer(self.path, latency=0.02).library.section("Movies"), page_size=5)
+        self.assertEqual(items.seconds, 0.0)
+        self.assertEqual(len(list(items)), 7)
+        self.assertGreaterEqual(items.seconds, 0.04)
+
+    def test_release(self):
+        page = [1, 2, 3]
+        self.assertEqual(list(stream.release(page)), [1, 2, 3])
+        self.assertEqual(page, [])
+
+    def test_latest(self):
+        latest = incremental.Latest()
+        items = stream.stream_library(plexdb.get_section(self.conn, "Movies"), page_size=2)
+        self.assertEqual(len(list(latest.track(items))), 7)
+        self.assertEqual(latest.addedAt, datetime.fromtimestamp(1500000000 + self.ids[MOVIE][-1]))
+        watermark = incremental.advance(None, [latest], [])
+        self.assertEqual(watermark, (latest.addedAt, latest.updatedAt))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import requests
+
+from benchmarks.stubs import StubServer
+from utils import config, transport
+
+
+def route(path, query):
+    return 200, {"i": query.get("i")}
+
+
+class TransportTestCase(unittest.TestCase):
+    def setUp(self):
+        transport.adapters.clear()
+
+    def tearDown(self):
+        transport.adapters.clear()
+
+    def test_reuse_connections(self):
+        with StubServer(route, latency=0.01) as stub:
+            session = transport.mount(requests.Session(), "omdb")
+            for number in range(5):
+                self.assertEqual(session.get(stub.url, params={"i": number}).json()["i"], str(number))
+            # another session of the provider shares the pool
+            transport.mount(requests.Session(), "omdb").get(stub.url)
+            self.assertEqual(transport.stats()["omdb"], {"requests": 6, "connections": 1, "version": "HTTP/1.1"})
+
+    def test_pool_size(self):
+        with patch.dict(config.CONCURRENCY, {"omdb": 3, "seasons": 1}):
+            with StubServer(route, latency=0.05) as stub:
+                session = transport.mount(requests.Session(), "omdb")
+                with ThreadPoolExecutor(4) as pool:
+                    for _ in range(3):
+                        list(pool.map(lambda number: session.get(stub.url, params={"i": number}), range(4)))
+        # every worker keeps its connection open for the next request
+        self.assertEqual(transport.stats()["omdb"]["connections"], 4)
+
+    def test_default_timeout(self):
+        with patch.object(config, "HTTP_TIMEOUT", (1, 0.05)):
+            with StubServer(route, latency=0.5) as stub:
+                session = transport.mount(requests.Session(), "tmdb")
+                started = time.monotonic()
+                self.assertRaises(requests.Timeout, session.get, stub.url)
+                self.assertLess(time.monotonic() - started, 0.4)
+
+    def test_http2_fallback(self):
+        try:
+            import h2
+            import httpx
+            self.skipTest("httpx with HTTP/2 support is installed")
+        except ImportError:
+            pass
+        with patch.object(config, "HTTP2", True):
+            self.assertIsInstance(transport.get_adapter("imdb"), transport.PooledAdapter)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from collections import namedtuple
+from unittest.mock import patch
+from urllib.request import Request, urlopen
+
+import update_imdb_ratings
+from benchmarks.fakeplex import FakeServer
+from benchmarks.synthetic import create_plex_database, MOVIE, SHOW, EPISODE
+from utils import incremental, plexdb, webhook
+
+Run = namedtuple("Run", ["libraries"])
+
+
+def multipart(payload):
+    # the body Plex posts, a thumbnail part may follow the payload
+    boundary = "------------------------b4f2a61c7e2d5d3f"
+    body = ("--{boundary}\r\nContent-Disposition: form-data; name=\"payload\"\r\n"
+            "Content-Type: application/json\r\n\r\n{payload}\r\n"
+            "--{boundary}\r\nContent-Disposition: form-data; name=\"thumb\"; filename=\"thumb.jpg\"\r\n"
+            "Content-Type: image/jpeg\r\n\r\n\xff\xd8\r\n--{boundary}--\r\n").format(boundary=boundary,
+                                                                                  payload=json.dumps(payload))
+    return body.encode("latin-1"), "multipart/form-data; boundary=" + boundary
+
+
+class WebhookTestCase(unittest.TestCase):
+    def test_parse_event(self):
+        event = {"event": "library.new", "Metadata": {"type": "movie", "ratingKey": "12"}}
+        self.assertEqual(webhook.parse_event(*multipart(event)), event)
+        self.assertEqual(webhook.parse_event(json.dumps(event).encode(), "application/json"), event)
+        self.assertIsNone(webhook.parse_event(b"nonsense", "application/json"))
+
+    def test_target(self):
+        def target(event, **metadata):
+            return webhook.get_target({"event": event, "Metadata": metadata})
+
+        self.assertEqual(target("library.new", type="movie", ratingKey="12"), ("12", True))
+        self.assertEqual(target("library.new", type="episode", ratingKey="14", parentRatingKey="13",
+                                grandparentRatingKey="12"), ("12", True))
+        self.assertEqual(target("library.new", type="season", ratingKey="13", parentRatingKey="12"), ("12", True))
+        self.assertEqual(target("media.scrobble", type="show", ratingKey="12"), ("12", False))
+        self.assertIsNone(target("media.play", type="movie", ratingKey="12"))
+        self.assertIsNone(target("library.new", type="track", ratingKey="12"))
+
+    def test_burst(self):
+        events = webhook.EventQueue(delay=0.05)
+        self.assertEqual(events.get(timeout=0.01), {})
+        events.put("1", False)
+        events.put("2", True)
+        events.put("1", True)
+        thread = threading.Timer(0.02, events.put, ["3", False])
+        thread.start()
+        started = time.monotonic()
+        self.assertEqual(events.get(), {"1": True, "2": True, "3": False})
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(events.get(timeout=0), {})
+
+    def test_server(self):
+        events = webhook.EventQueue(delay=0)
+        server = webhook.start_server(events, "127.0.0.1", 0)
+        try:
+            url = "http://127.0.0.1:{0}/".format(server.server_address[1])
+            body, content_type = multipart({"event": "library.new", "Metadata": {"type": "movie", "ratingKey": 7}})
+            with urlopen(Request(url, body, {"Content-Type": content_type})) as response:
+                self.assertEqual(response.status, 200)
+            self.assertEqual(events.get(timeout=1), {"7": True})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class LookupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "com.plexapp.plugins.library.db")
+        self.ids = create_plex_database(self.path, movies=4, shows=2, seasons=1, episodes=2)
+        self.conn = plexdb.connect(self.path)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def test_lookup_items(self):
+        server = FakeServer(self.path)
+        wanted = [self.ids[MOVIE][1], self.ids[SHOW][0], self.ids[EPISODE][0], 999]
+        for run in (Run([server.library.section("Movies"), server.library.section("TV Shows")]),
+                    Run([plexdb.get_section(self.conn, "Movies"), plexdb.get_section(self.conn, "TV Shows")])):
+            items = update_imdb_ratings.lookup_items(run, [str(plex_id) for plex_id in wanted])
+            # episodes and unknown ids are left out
+            self.assertEqual([item.ratingKey for item in items], [self.ids[MOVIE][1], self.ids[SHOW][0]])
+
+    def test_valid_ids(self):
+        with self.assertLogs("plex-imdb-updater", "WARNING") as logs:
+            self.assertEqual(update_imdb_ratings.valid_ids(["12", " 7 ", "abc", "1e3", 5, "", "-3"]), ["12", "7", "5"])
+        self.assertEqual(len(logs.output), 4)
+        # nothing is looked up when none of the ids is valid
+        self.assertEqual(update_imdb_ratings.main_items(["plex_id"]), (0, 0))
+
+    def test_fetch_metadata(self):
+        server = FakeServer(self.path)
+        movies = server.library.section("Movies")
+        with patch.object(incremental, "METADATA_CHUNK_SIZE", 2):
+            items = incremental.fetch_metadata(movies, self.ids[MOVIE] + [998, 999])
+        self.assertEqual([item.ratingKey for item in items], self.ids[MOVIE])
+        # the section, then a request per chunk of ids, the last one finds nothing
+        self.assertEqual(server.requests, 4)
+        self.assertEqual(incremental.fetch_items(movies, [self.ids[SHOW][0], self.ids[MOVIE][0]])[0].ratingKey,
+                         self.ids[MOVIE][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
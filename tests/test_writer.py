@@ -0,0 +1,219 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+
+import models
+from benchmarks.synthetic import create_plex_database, MOVIE
+from models import create_tables
+from utils import db
+from utils.writer import BatchWriter, WriteScheduler, parse_window, in_window
+
+
+class FieldsTestCase(unittest.TestCase):
+    def test_imdb_extra_data(self):
+        self.assertEqual(db.imdb_extra_data(None), db.IMDB_RATING_IMAGE)
+        self.assertEqual(db.imdb_extra_data("at%3AratingImage=rottentomatoes%3A%2F%2Fimage&pv%3Aa=1"),
+                         db.IMDB_RATING_IMAGE + "&pv%3Aa=1")
+        self.assertEqual(db.imdb_extra_data("pv%3Aa=1&at%3AaudienceRatingImage=x"),
+                         db.IMDB_RATING_IMAGE + "&pv%3Aa=1")
+        self.assertEqual(db.imdb_extra_data(db.imdb_extra_data("pv%3Aa=1")), db.IMDB_RATING_IMAGE + "&pv%3Aa=1")
+
+    def test_locked_user_fields(self):
+        self.assertEqual(db.locked_user_fields(None), "lockedFields=5")
+        self.assertEqual(db.locked_user_fields("lockedFields=2|15"), "lockedFields=2|15|5")
+        self.assertEqual(db.locked_user_fields("lockedFields=5|15"), "lockedFields=5|15")
+        self.assertEqual(db.locked_user_fields("mediaProcessingTarget=1"), "mediaProcessingTarget=1&lockedFields=5")
+
+
+class BatchWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "plex.db")
+        self.ids = create_plex_database(self.path, movies=25, shows=0)[MOVIE]
+        self.database = db.PlexDatabase(self.path, busy_timeout=0.05, retries=1)
+        self.conn = self.database.connection
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def test_flush_in_batches(self):
+        writer = BatchWriter(self.database, batch_size=10)
+        for plex_id in self.ids[:24]:
+            writer.set_rating(plex_id, 8.2)
+        writer.reset_rating(self.ids[24])
+        self.assertTrue(writer.is_full())
+        self.assertEqual(writer.flush(), 25)
+        self.assertEqual(writer.transactions, 3)
+        self.assertFalse(writer.is_full())
+
+        rating, extra_data, user_fields = self.conn.execute(
+            "SELECT rating, extra_data, user_fields FROM metadata_items WHERE id = ?", [self.ids[0]]).fetchone()
+        self.assertEqual(rating, 8.2)
+        self.assertTrue(extra_data.startswith(db.IMDB_RATING_IMAGE + "&"))
+        self.assertIn("5", user_fields.split("=")[1].split("|"))
+        rating, extra_data = self.conn.execute(
+            "SELECT rating, extra_data FROM metadata_items WHERE id = ?", [self.ids[24]]).fetchone()
+        self.assertIsNone(rating)
+        self.assertFalse(extra_data.startswith(db.IMDB_RATING_IMAGE))
+        stats = self.database.stats()
+        self.assertEqual(stats["journal_mode"], "delete")
+        self.assertEqual(stats["statements"]["UPDATE"]["count"], 3)
+
+    def test_skip_unchanged(self):
+        writer = BatchWriter(self.database, batch_size=10)
+        for plex_id in self.ids:
+            writer.set_rating(plex_id, "7.3")
+        self.assertEqual(writer.flush(), 25)
+        updates = self.database.stats()["statements"]["UPDATE"]["count"]
+        # a refresh finding the same ratings doesn't need the write lock
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        for plex_id in self.ids:
+            writer.set_rating(plex_id, 7.3)
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.pending, {})
+        self.assertEqual(writer.unchanged, 25)
+        self.assertEqual(writer.failed, 0)
+        other.execute("ROLLBACK")
+        other.close()
+        self.assertEqual(self.database.stats()["statements"]["UPDATE"]["count"], updates)
+
+        writer.set_rating(self.ids[0], 7.4)
+        writer.set_rating(self.ids[1], 7.3)
+        writer.reset_rating(self.ids[2])
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(writer.written, 27)
+        self.assertEqual([row[0] for row in self.conn.execute(
+            "SELECT rating FROM metadata_items WHERE id IN (?, ?, ?) ORDER BY id", self.ids[:3])], [7.4, 7.3, None])
+
+    def test_keep_batch_while_locked(self):
+        writer = BatchWriter(self.database, batch_size=10)
+        for plex_id in self.ids[:15]:
+            writer.set_rating(plex_id, 6.4)
+        # somebody else holds the write lock
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(len(writer.pending), 15)
+        self.assertEqual(writer.failed, 1)
+        self.assertFalse(writer.is_full())
+        self.assertEqual(self.database.stats()["retries"], 1)
+        self.assertGreater(self.database.stats()["lock_wait"], 0.05)
+        other.execute("ROLLBACK")
+        other.close()
+        self.assertEqual(writer.flush(), 15)
+        self.assertEqual(writer.pending, {})
+        self.assertEqual(writer.written, 15)
+
+    def test_keep_for_next_run(self):
+        models.database.init(os.path.join(self.directory, "db.sqlite"))
+        try:
+            create_tables()
+            writer = BatchWriter(self.database, batch_size=10)
+            writer.set_rating(self.ids[0], 6.4)
+            writer.reset_rating(self.ids[1])
+            self.assertEqual(writer.keep(), 2)
+            restored = BatchWriter(self.database, batch_size=10)
+            self.assertEqual(restored.restore(), 2)
+            self.assertEqual(restored.pending, {self.ids[0]: 6.4, self.ids[1]: None})
+            self.assertEqual(restored.flush(), 2)
+            # the written changes are gone for the run after
+            self.assertEqual(restored.keep(), 0)
+            self.assertEqual(BatchWriter(self.database).restore(), 0)
+        finally:
+            models.database.close()
+            models.database.init(models.DATABASE)
+
+    def test_write_gives_up(self):
+        other = sqlite3.connect(self.path, isolation_level=None)
+        other.execute("BEGIN EXCLUSIVE")
+        try:
+            result = self.database.write(lambda cursor: cursor.execute("UPDATE metadata_items SET rating = 1"))
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        self.assertFalse(result.ok)
+        self.assertIsInstance(result.error, sqlite3.OperationalError)
+        self.assertEqual(result.attempts, 2)
+        self.assertEqual(self.database.stats()["failed"], 1)
+        self.assertTrue(self.database.read(lambda cursor: self.database.execute(
+            cursor, "SELECT id FROM metadata_items").fetchone()).ok)
+        # other errors are not tried again
+        with self.assertRaises(sqlite3.OperationalError):
+            self.database.write(lambda cursor: cursor.execute("UPDATE missing SET rating = 1"))
+
+
+class WriteSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, "plex.db")
+        self.ids = create_plex_database(path, movies=12, shows=0)[MOVIE]
+        self.conn = sqlite3.connect(path)
+        self.sessions = ["playing"]
+        self.writer = BatchWriter(db.PlexDatabase(path), batch_size=10)
+        for plex_id in self.ids[:12]:
+            self.writer.set_rating(plex_id, 7.0)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def get_sessions(self):
+        if self.sessions is None:
+            raise IOError("unreachable")
+        return self.sessions
+
+    def test_buffer_while_playing(self):
+        writes = WriteScheduler(self.writer, self.get_sessions, interval=60, window=())
+        self.assertFalse(writes.check())
+        self.assertEqual(writes.flush_when_full(), 0)
+        self.assertEqual(writes.flush(wait=False), 0)
+        self.assertEqual(len(self.writer.pending), 12)
+        self.sessions = None
+        self.assertFalse(writes.check())
+        self.sessions = []
+        self.assertTrue(writes.check())
+        self.assertEqual(writes.flush_when_full(), 12)
+        self.assertEqual(self.writer.transactions, 2)
+
+    def test_wait_for_idle_in_background(self):
+        writes = WriteScheduler(self.writer, self.get_sessions, interval=0.02, window=()).start()
+        try:
+            threading.Timer(0.1, self.sessions.clear).start()
+            self.assertEqual(writes.flush(), 12)
+            self.assertGreater(writes.waited, 0.05)
+            self.assertGreater(writes.checks, 2)
+        finally:
+            writes.stop()
+
+    def test_bounded_wait(self):
+        writes = WriteScheduler(self.writer, self.get_sessions, interval=0.02, window=()).start()
+        try:
+            start = time.monotonic()
+            self.assertEqual(writes.flush(timeout=0.1), 0)
+            self.assertLess(time.monotonic() - start, 1)
+            self.assertEqual(len(self.writer.pending), 12)
+        finally:
+            writes.stop()
+
+    def test_maintenance_window(self):
+        window = parse_window(("23:00", "02:00"))
+        self.assertTrue(in_window(window, datetime(2020, 1, 1, 23, 30)))
+        self.assertTrue(in_window(window, datetime(2020, 1, 1, 1, 59)))
+        self.assertFalse(in_window(window, datetime(2020, 1, 1, 2, 0)))
+        self.assertTrue(in_window(parse_window(("03:00", "06:00")), datetime(2020, 1, 1, 3, 0)))
+        # inside the window the changes are written even though somebody is watching
+        writes = WriteScheduler(self.writer, self.get_sessions, interval=60, window=("00:00", "23:59"))
+        writes.check()
+        self.assertEqual(writes.can_write(datetime(2020, 1, 1, 12, 0)), True)
+        self.assertEqual(writes.can_write(datetime(2020, 1, 1, 23, 59, 30)), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,18 +11,28 @@
 # ------------------------------------------------------------------------------
 
 # Requires: plexapi, imdbpie, omdb
+# plexapi, imdbpie, omdb and tqdm take long to import, they are imported where they are first used, so
+# a run only loads what it needs
+import argparse
 import logging
+import os
+import signal
 import sys
-import sqlite3
-from datetime import datetime, timedelta
-from time import sleep
+import time
+from datetime import timedelta
+from functools import partial
 
-from plexapi.server import PlexServer
-from imdbpie import Imdb
-from tqdm import tqdm
+import requests
 
-from models import create_tables, Movie, Show, Episode
-from utils import omdb, db, tmdb, config, imdb, util
+from models import database, create_tables, Movie, Show, Episode
+from utils import omdb, db, tmdb, config, imdb, util, dataset, limiter, plexdb, cache, incremental, metrics, stream, \
+    transport, webhook, ratings
+from utils.pipeline import Pipeline, next_stage
+from utils.writer import BatchWriter, WriteScheduler
+from utils.index import LocalIndex, IdMappings, TVDB, TMDB_MOVIE, TMDB_SHOW
+from utils.scheduler import RefreshScheduler
+from utils.seasons import SeasonRatings, create_backend
+from utils.shard import Shard, BY_KEY, BY_LIBRARY, parse_shard, run_processes
 
 # EDIT SETTINGS ###
 # Plex settings
@@ -30,32 +40,86 @@ PLEX_URL = 'http://localhost:32400'
 PLEX_TOKEN = ''
 LIBRARY_NAMES = []
 PLEX_DATABASE_FILE = "/var/lib/plexmediaserver/Library/Application Support/Plex Media Server/Plug-in Support/Databases/com.plexapp.plugins.library.db"
+ENUMERATE_FROM_DATABASE = False  # Read the libraries straight from the Plex DB instead of via the Plex API
+INCREMENTAL = False  # Only process items added or changed since the previous run, and items that are due
 
 # Updater settings
 EPISODE_RATINGS = True  # Whether to fetch episode ratings
-EPISODE_RATINGS_SOURCE = "imdb"  # How to fetch the episode ratings. Via OMDB or directly from IMDB
+EPISODE_RATINGS_SOURCE = "imdb"  # How to fetch the episode ratings: "imdb", "omdb", "dataset" or "fastest" available
 DRY_RUN = True  # Dry run without modifying the database (True or False)
 DEBUG_LEVEL = logging.INFO
 THRESHOLD_SHORT = timedelta(days=1)
 THRESHOLD_NORMAL = timedelta(days=14)
+REFRESH_BUDGET = 0  # Maximum number of due movies and shows to refresh per run, most overdue first. 0 for no limit
 
+logger = logging.getLogger("plex-imdb-updater")
 
-def main(plex_id=None, force=False):
-    logger = logging.getLogger("plex-imdb-updater")
-    db.create_connection("db.sqlite")
+
+class UpdateRun(object):
+    """
+    State of a single run, shared by the writer handlers
+    """
+
+    def __init__(self, plex, plex_db, libraries, writer, writes, pipeline, index, mappings, scheduler,
+                 episode_backend, seasons, policy):
+        self.plex = plex
+        self.plex_db = plex_db
+        self.libraries = libraries
+        self.writer = writer
+        self.writes = writes
+        self.index = index
+        self.mappings = mappings
+        self.scheduler = scheduler
+        self.episode_backend = episode_backend
+        self.seasons = seasons
+        self.policy = policy
+        self.pipeline = pipeline
+        self.success = 0
+        self.failed = 0
+        # items of which fetching failed, to try again on the next incremental run
+        self.errors = []
+
+
+def start_run(shard=None, targeted=False):
+    """
+    Connect to Plex and the databases and load the local state, everything needed before items can be updated
+    :param shard: only process the libraries of this shard, None for all of them
+    :param targeted: only given items are updated, their rows of the local DB are loaded when they are updated
+    :return: the run, None if the Plex server was not found
+    """
+    metrics.reset()
+    # a single connection to the local DB for the whole run
+    database.connect(reuse_if_open=True)
+    if shard is not None:
+        # the shards share the provider rate limits
+        limiter.set_share(1.0 / shard.count)
+        logger.info("Running shard {shard}".format(shard=shard))
+    # refresh the offline IMDb index if a newer dump has been downloaded
+    if dataset.is_enabled():
+        dataset.build_index()
     # Connect to the Plex server
     logger.info("Connecting to the Plex server at '{base_url}'...".format(base_url=PLEX_URL))
     try:
-        plex = PlexServer(PLEX_URL, PLEX_TOKEN)
+        plex = connect_plex(PLEX_URL, PLEX_TOKEN)
     except:
         logger.error("No Plex server found at: {base_url}".format(base_url=PLEX_URL))
         return
+    # ratings of new releases change quickly, cached responses live as long as the short threshold
+    cache.open_cache(ratings_ttl=THRESHOLD_SHORT)
 
     libraries = []
+    plex_db = plexdb.connect(PLEX_DATABASE_FILE) if ENUMERATE_FROM_DATABASE else None
 
     # Get list of movies from the Plex server
-    for library_name in LIBRARY_NAMES:
+    for position, library_name in enumerate(LIBRARY_NAMES):
+        if shard is not None and not shard.owns_library(position):
+            continue
         logger.info("Retrieving a list of movies/shows from the '{library}' library in Plex...".format(library=library_name))
+        if plex_db is not None:
+            section = plexdb.get_section(plex_db, library_name)
+            if section is not None:
+                libraries.append(section)
+                continue
         try:
             libraries.append(plex.library.section(library_name))
         except:
@@ -63,185 +127,635 @@ def main(plex_id=None, force=False):
             continue
 
     if not DRY_RUN:
-        conn_db = sqlite3.connect(PLEX_DATABASE_FILE)
-        conn_db.isolation_level = None
-        database = conn_db.cursor()
+        # the Plex server and other shards lock the DB, locked writes are tried again or kept for later
+        conn_db = db.PlexDatabase(PLEX_DATABASE_FILE)
+        logger.info("The Plex DB is in {mode} journal mode".format(mode=conn_db.journal_mode))
+        writer = BatchWriter(conn_db)
+        restored = writer.restore()
+        if restored:
+            logger.info("{count} changes kept by the previous run are written by this run".format(count=restored))
+        # checks for playback in the background, the changes are written while nobody is watching
+        writes = WriteScheduler(writer, plex.sessions).start()
     else:
-        database = None
+        conn_db = None
+        writer = None
+        writes = None
 
-    success = 0
-    failed = 0
+    # known id mappings, the manual overrides take priority over anything looked up or imported
+    mappings = IdMappings().load()
+    if config.ID_MAPPINGS_IMPORT:
+        mappings.seed(config.ID_MAPPINGS_IMPORT)
+    mappings.load_overrides(config.ID_OVERRIDES_FILE)
+    episode_backend = create_backend(EPISODE_RATINGS_SOURCE)
+    if targeted:
+        index = LocalIndex()
+    else:
+        with metrics.timer("local_db_seconds", operation="load"):
+            index = LocalIndex().load()
+    return UpdateRun(plex, plex_db, libraries, writer, writes, Pipeline(), index, mappings,
+                     RefreshScheduler(THRESHOLD_SHORT, THRESHOLD_NORMAL), episode_backend,
+                     create_season_ratings(episode_backend), ratings.create_policy(index))
+
+
+def main(force=False, shard=None):
+    """
+    Update the ratings of the configured libraries
+    :param force: update even if the rating is not due yet
+    :param shard: only process the items or libraries of this shard, None for all of them
+    :return: pair of the number of updated and failed items, None if the Plex server was not found
+    """
+    from tqdm import tqdm
+    run = start_run(shard)
+    if run is None:
+        return
+    # spread the refreshes of items stored before they were scheduled, then pick the most overdue items.
+    # A shard only touches its own items, the others may already have updated theirs
+    owns = shard.owns_item if shard is not None else None
+    if run.scheduler.backfill(run.index, owns):
+        run.index.flush()
+    planned = run.index.plan(budget=REFRESH_BUDGET, owns=owns)
+    logger.info("{count} movies and shows are due for a refresh".format(count=planned))
 
-    for library in libraries:
-        pbar = tqdm(library.all(), postfix=["", ""])
+    for library in run.libraries:
+        # every shard keeps its own watermarks when the items of a library are split
+        watermark_name = library.title + (shard.suffix() if shard is not None else "")
+        start = time.perf_counter()
+        if INCREMENTAL and not force:
+            items, watermark = incremental.enumerate_library(library, run.index, watermark_name)
+        else:
+            # read a page at a time, so memory use doesn't grow with the size of the library
+            items, watermark = stream.stream_library(library), None
+        enumerate_seconds = time.perf_counter() - start
+        enumerated = 0
+        # after the first incremental run only new, changed and due items are enumerated, shows with new
+        # episodes among them, so these are all processed
+        changed_only = watermark is not None
+        latest = incremental.Latest()
+        run.errors = []
+        pbar = tqdm(latest.track(items), total=len(items), postfix=["", ""])
         pbar.set_description("Processing " + library.title)
         for plex_object in pbar:
+            enumerated += 1
             pbar.postfix[0] = plex_object.title
             pbar.postfix[1] = "Processing"
-            # first do a check if we specified a plex id
-            if plex_id is not None and str(plex_object.ratingKey) != plex_id:
+            # episodes go with their show, so no two shards update the same rows
+            if owns is not None and not owns(plex_object.ratingKey):
                 continue
-            # check if movie or show library
-            if plex_object.TYPE is "movie":
-                is_movie_library = True
-                if not force and not should_update_media(plex_object.TYPE, plex_object):
-                    continue
-            else:
-                is_movie_library = False
-                if not force and not should_update_media(plex_object.TYPE, plex_object):
-                    continue
-
-            # resolve plex object to right identifiers
-            imdb_id, tmdb_id, tvdb_id = resolve_ids(is_movie_library, plex_object, force, pbar)
-
-            # if no imdb_id is found for plex guid, reset all ratings
-            if not imdb_id:
-                logger.debug("Missing IMDB ID. Skipping media object '{pm.title}'.".format(pm=plex_object))
-                if not DRY_RUN:
-                    db.reset_rating(database, plex_object)
-                    db.set_locked_fields(database, plex_object)
-                failed = failed + 1
+            if not force and not changed_only and not should_update_media(run.index, plex_object.TYPE, plex_object):
                 continue
+            process_item(run, plex_object, force)
+        # a streamed library reads its pages while the items are processed
+        if isinstance(items, stream.LibraryStream):
+            enumerate_seconds += items.seconds
+        metrics.observe("enumerate_seconds", enumerate_seconds, library=library.title)
+        metrics.inc("items_enumerated", enumerated, library=library.title)
+        run.pipeline.join()
+        with metrics.timer("local_db_seconds", operation="flush"):
+            run.index.flush()
+            run.mappings.flush()
+        if INCREMENTAL and not force:
+            incremental.save_watermark(watermark_name, incremental.advance(watermark, [latest], run.errors))
+        if not DRY_RUN:
+            # don't wait for an idle server while there are libraries left to fetch
+            run.writes.flush(wait=False)
+    return finish_run(run, shard)
+
 
-            logger.debug("Getting ratings for imdb id '{imdb_id}'".format(imdb_id=imdb_id))
-            rating = None
-            imdb_object = None
-            # Check if we need to update this
-            if force or should_update_media(plex_object.TYPE, plex_object):
-                # first trying to get it from OMDB
-                if config.OMDB_API_KEY:
-                    imdb_object = omdb.get_imdb_rating_from_omdb(imdb_id, pbar)
-                    if imdb_object is not None:
-                        logger.debug("{im}\t{pm.title}\tOMDB".format(pm=plex_object, im=imdb_object["imdb_rating"]))
-                        rating = imdb_object["imdb_rating"]
-
-                # if no rating yet, try to get it directly from IMDB
-                if (imdb_object is None or rating is None) and imdb.title_exists(imdb_id):
-                    imdb_object = imdb.get_title_ratings(imdb_id)
-                    if imdb_object is not None and "rating" in imdb_object:
-                        logger.debug("{im}\t{pm.title}\tIMDB".format(pm=plex_object, im=imdb_object["rating"]))
-                        rating = imdb_object["rating"]
-
-                # reset in database if nothing could be fetched
-                if rating is None and not DRY_RUN:
-                    logger.warning("Media not found on IMDB. Skipping '{pm.title} ({imdb_id})'.".format(
-                        pm=plex_object, imdb_id=imdb_id))
-                    if not DRY_RUN:
-                        db.reset_rating(database, plex_object)
-                        db.set_locked_fields(database, plex_object)
-                    failed = failed + 1
-                    continue
-
-                if is_movie_library:
-                    # do update in local library for future reference
-                    db_movie = Movie.select().where(Movie.plex_id == plex_object.ratingKey)
-                    if db_movie.exists():
-                        db.update_db_rating(db_movie.get(), rating)
-                    else:
-                        Movie.create(
-                            title=plex_object.title,
-                            plex_id=plex_object.ratingKey,
-                            imdb_id=imdb_id,
-                            rating=rating,
-                            tmdb_id=tmdb_id,
-                            release_date=plex_object.originallyAvailableAt
-                        )
-                else:
-                    # do update in local library for future reference
-                    db_show = Show.select().where(Show.plex_id == plex_object.ratingKey)
-                    if db_show.exists():
-                        db.update_db_rating(db_show.get(), rating)
-                    else:
-                        Show.create(
-                            title=plex_object.title,
-                            plex_id=plex_object.ratingKey,
-                            imdb_id=imdb_id,
-                            rating=rating,
-                            release_date=plex_object.originallyAvailableAt,
-                            tvdb_id=tvdb_id
-                        )
-
-                if not DRY_RUN:
-                    # if not dry run, do a update in Plex' DB
-                    db.set_rating_and_imdb_image(database, plex_object, rating)
-                    db.set_locked_fields(database, plex_object)
-            # now try to fetch seasons
-            if not is_movie_library:
-                for season in plex_object.seasons():
-                    # don't do anything with specials
-                    if season.index is 0:
-                        logger.debug("Skipping specials")
-                        continue
-                    # check if enabled in settings
-                    if EPISODE_RATINGS:
-                        logger.debug("Getting episodes for {p.title} for season {season}".format(
-                            p=plex_object, season=season.index))
-                        imdb_episodes = None
-                        for episode in season.episodes():
-                            update_success = update_episode_rating(database, episode, imdb_episodes, imdb_id,
-                                                                   plex_object, season)
-                            if update_success:
-                                success = success + 1
-                            else:
-                                failed = failed + 1
+def main_items(plex_ids, force=True):
+    """
+    Update only the given movies and shows, looking them up by their Plex id instead of enumerating the
+    libraries. Takes any number of ids, they are looked up and updated a page at a time.
+    :param plex_ids: the Plex ids of movies and shows of the configured libraries
+    :param force: update even if the rating is not due yet
+    :return: pair of the number of updated and failed items, None if the Plex server was not found
+    """
+    # keep the order, but look up every item once
+    plex_ids = list(dict.fromkeys(valid_ids(plex_ids)))
+    if not plex_ids:
+        return 0, 0
+    run = start_run(targeted=True)
+    if run is None:
+        return
+    for start in range(0, len(plex_ids), config.ENUMERATE_PAGE_SIZE):
+        update_items(run, {plex_id: force for plex_id in plex_ids[start:start + config.ENUMERATE_PAGE_SIZE]})
+    return finish_run(run)
+
+
+def main_daemon(host=None, port=None):
+    """
+    Keep running and update the items Plex reports through its webhooks. The connections, the response
+    cache and the rows of the local DB loaded for earlier events stay loaded between events, so a new item
+    gets its rating within seconds.
+    :param host: the address to listen on, defaults to config.WEBHOOK_HOST
+    :param port: the port to listen on, defaults to config.WEBHOOK_PORT
+    :return: pair of the number of updated and failed items, None if the Plex server was not found
+    """
+    run = start_run(targeted=True)
+    if run is None:
+        return
+    events = webhook.EventQueue()
+    server = webhook.start_server(events, host, port)
+    logger.info("Listening for Plex webhooks at http://{0}:{1}/".format(*server.server_address))
+    # stop like on Ctrl+C when the service is stopped
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while True:
+            targets = events.get(timeout=config.SESSION_CHECK_INTERVAL)
+            if targets:
+                update_items(run, targets)
+                # the daemon keeps running, a later event for the same show needs its new episodes
+                run.seasons.clear()
+            elif not DRY_RUN and run.writer.pending:
+                # changes kept while somebody was watching
+                run.writes.flush(wait=False)
+    except KeyboardInterrupt:
+        logger.info("Stopping the webhook daemon")
+    finally:
+        server.shutdown()
+    return finish_run(run)
+
+
+def main_recompute():
+    """
+    Apply the rating policy to all ratings in the local DB at once and write the ratings that change to Plex,
+    without any request to the providers. Run it after changing RATING_DECIMALS or RATING_SHRINKAGE_VOTES.
+    :return: pair of the number of changed and failed items, None if the Plex server was not found
+    """
+    run = start_run()
+    if run is None:
+        return
+    for model in (Movie, Show, Episode):
+        records = run.index.records[model]
+        with metrics.timer("recompute_seconds", kind=model.__name__.lower()):
+            table = ratings.RatingTable.from_records(records.values())
+            changes = table.changes(run.policy.apply_table(model, table))
+        for plex_id, rating in changes:
+            record = records[plex_id]
+            # keep the fetched rating of rows stored before it was kept separately
+            if record.imdb_rating is None:
+                record.imdb_rating = record.rating
+            record.rating = rating
+            run.index.save(record)
             if not DRY_RUN:
-                while len(plex.sessions()) is not 0:
-                    logger.info("Plex Media Server in use... waiting 10 seconds before commiting changes")
-                    sleep(10)
-                conn_db.commit()
+                run.writer.set_rating(plex_id, rating)
+        logger.info("{changed} of {count} {kind} ratings changed".format(
+            changed=len(changes), count=len(table), kind=model.__name__.lower()))
+        run.success += len(changes)
+    with metrics.timer("local_db_seconds", operation="flush"):
+        run.index.flush()
+    return finish_run(run)
+
+
+def update_items(run, targets):
+    """
+    Update the given movies and shows, looking them up by their Plex id
+    :param run: the current run
+    :param targets: dict of Plex ids and whether to update the item even if its rating is not due
+    """
+    items = lookup_items(run, targets)
+    run.errors = []
+    metrics.inc("items_enumerated", len(items))
+    if len(items) < len(targets):
+        logger.warning("{count} of the items are not movies or shows of the configured libraries".format(
+            count=len(targets) - len(items)))
+    logger.info("Updating {count} items".format(count=len(items)))
+    with metrics.timer("local_db_seconds", operation="load"):
+        run.index.load_items(str(plex_object.ratingKey) for plex_object in items)
+    if not all(targets.values()):
+        run.index.plan()
+    for plex_object in items:
+        force = targets[str(plex_object.ratingKey)]
+        if force or should_update_media(run.index, plex_object.TYPE, plex_object):
+            process_item(run, plex_object, force)
+    run.pipeline.join()
+    with metrics.timer("local_db_seconds", operation="flush"):
+        run.index.flush()
+        run.mappings.flush()
     if not DRY_RUN:
-        database.close()
-    logger.info("Finished updating. {success} updated and {failed} failed".format(success=success, failed=failed))
+        run.writes.flush(wait=False)
 
 
-def update_episode_rating(database, episode, imdb_episodes, imdb_id, plex_object, season):
+def lookup_items(run, plex_ids):
     """
-    Update the episode rating if it is outdated
-    :param database: connection to the Plex DB
-    :param episode: the episode object from Plex
-    :param imdb_episodes: the IMDB episodes object containing the rating
-    :param imdb_id: the IMDB id from the parent show
-    :param plex_object: the parent plex object
-    :param season: the season from which this episode is beloning to
-    :return: True if updated, False if not
-    """
-    db_episode = Episode.select().where(Episode.plex_id == episode.ratingKey)
-    if not db_episode.exists():
-        if imdb_episodes is None:
-            imdb_episodes = imdb.get_season_from_imdb(imdb_id, season.index)
-        if update_imdb_episode_rating(database, episode,
-                                      imdb_episodes, plex_object, season):
-            logger.debug("Created episode '{e.title}' '{e.index}' "
-                          "with new ratings".format(e=episode))
-            return True
+    Look up movies and shows of the configured libraries by their Plex id, without enumerating the libraries
+    :param run: the current run
+    :param plex_ids: the Plex ids
+    :return: list of items, leaving out the ids of other libraries and of items that are gone
+    """
+    items = []
+    remaining = set(int(plex_id) for plex_id in plex_ids)
+    sections = [library for library in run.libraries if isinstance(library, plexdb.Section)]
+    for section in sections:
+        found = section.items(sorted(remaining))
+        remaining.difference_update(item.ratingKey for item in found)
+        items.extend(found)
+    # the Plex API looks up items of any library, every item is fetched once for all libraries
+    libraries = [library for library in run.libraries if not isinstance(library, plexdb.Section)]
+    if libraries and remaining:
+        for item in incremental.fetch_metadata(libraries[0], sorted(remaining)):
+            if any(incremental.in_library(library, item) for library in libraries):
+                items.append(item)
+    return items
+
+
+def process_item(run, plex_object, force=False):
+    """
+    Update the rating of a movie or show, and of the episodes of a show. The identifiers are resolved and
+    the ratings fetched on the provider pools while the caller continues with the next item.
+    :param run: the current run
+    :param plex_object: the plex object of the movie or show
+    :param force: look up the identifiers again instead of taking them from the local DB
+    """
+    is_movie_library = plex_object.TYPE == "movie"
+    handler = partial(handle_media_rating, run, plex_object, is_movie_library)
+    ids = resolve_local_ids(run.index, plex_object, force)
+    if ids is None and needs_id_lookup(run.mappings, is_movie_library, plex_object.guid):
+        run.pipeline.submit(handler, "tmdb", fetch_ids, run.mappings, is_movie_library, plex_object.guid)
+    else:
+        if ids is None:
+            ids = resolve_guid(run.mappings, is_movie_library, plex_object.guid)
+        run.pipeline.submit_stage(handler, select_rating_stage(ids))
+    run.pipeline.drain()
+
+
+def finish_run(run, shard=None):
+    """
+    Wait for the items in flight, write the remaining changes to the Plex DB and report on the run
+    :param run: the current run
+    :param shard: the shard of the run, None if the run was not split
+    :return: pair of the number of updated and failed items
+    """
+    run.pipeline.shutdown()
+    if not DRY_RUN:
+        run.writes.flush(timeout=config.WRITE_WAIT_MAX)
+        run.writes.stop()
+        run.writer.keep()
+        run.writer.database.close()
+    if run.plex_db is not None:
+        run.plex_db.close()
+    cache_stats = cache.stats()
+    cache.close_cache()
+    logger.info("Finished updating. {success} updated and {failed} failed".format(success=run.success,
+                                                                                    failed=run.failed))
+    if not DRY_RUN:
+        logger.info("Plex DB: {w.written} items written in {w.transactions} transactions, {w.unchanged} unchanged, "
+                    "{s.waited:.0f} seconds waited for playback to stop".format(w=run.writer, s=run.writes))
+        db_stats = run.writer.database.stats()
+        logger.info("Plex DB: {s[lock_wait]:.1f} seconds waited for locks, {s[retries]} retries, {s[failed]} failed "
+                    "transactions".format(s=db_stats))
+        for kind, stats in sorted(db_stats["statements"].items()):
+            logger.info("Plex DB {kind}: {s[count]} statements, {s[total]:.2f} seconds, {s[max]:.3f} seconds "
+                        "longest".format(kind=kind, s=stats))
+        if run.writer.pending:
+            logger.warning("{count} changes could not be written to the Plex DB, they are kept in the local DB and "
+                           "written by the next run".format(count=len(run.writer.pending)))
+    for provider, stats in sorted(limiter.stats().items()):
+        logger.info("{provider}: {s[requests]} requests, {s[retries]} retries, {s[rate_limited]} times rate limited, "
+                    "{s[throttled]:.1f} seconds throttled".format(provider=provider, s=stats))
+    logger.info("Season ratings: {s.requests} requests, {s.shared} answered by an earlier request".format(s=run.seasons))
+    for backend in getattr(run.episode_backend, "backends", [run.episode_backend]):
+        if backend.requests:
+            logger.info("{b.name} seasons: {b.requests} requests, {b.errors} errors, {b.latency:.2f} seconds "
+                        "average latency".format(b=backend))
+    for provider, stats in sorted(cache_stats.items()):
+        logger.info("{provider} cache: {s[hits]} hits, {s[misses]} misses, {s[revalidated]} revalidated".format(
+            provider=provider, s=stats))
+    for provider, stats in sorted(transport.stats().items()):
+        logger.info("{provider} connections: {s[requests]} requests over {s[connections]} {s[version]} "
+                    "connections".format(provider=provider, s=stats))
+    export_metrics(run, cache_stats, shard)
+    return run.success, run.failed
+
+
+def export_metrics(run, cache_stats, shard=None):
+    """
+    Add the statistics of the providers, the cache and the Plex DB to the metrics of the run and write them
+    :param run: the finished run
+    :param cache_stats: the statistics of the response cache
+    :param shard: the shard of the run, None if the run was not split
+    """
+    metrics.inc("items", run.success, result="updated")
+    metrics.inc("items", run.failed, result="failed")
+    for provider, stats in limiter.stats().items():
+        metrics.inc("provider_requests", stats["requests"], provider=provider)
+        metrics.inc("provider_retries", stats["retries"], provider=provider)
+        metrics.inc("provider_rate_limited", stats["rate_limited"], provider=provider)
+        metrics.gauge("provider_throttled_seconds", stats["throttled"], provider=provider)
+    for provider, stats in transport.stats().items():
+        metrics.inc("http_requests", stats["requests"], provider=provider)
+        metrics.inc("http_connections", stats["connections"], provider=provider)
+    for provider, stats in cache_stats.items():
+        for result in ("hits", "misses", "revalidated"):
+            metrics.inc("cache_requests", stats[result], provider=provider, result=result)
+        lookups = stats["hits"] + stats["misses"]
+        metrics.gauge("cache_hit_ratio", float(stats["hits"]) / lookups if lookups else 0.0, provider=provider)
+    metrics.inc("season_requests", run.seasons.requests)
+    metrics.inc("season_requests_shared", run.seasons.shared)
+    for backend in getattr(run.episode_backend, "backends", [run.episode_backend]):
+        metrics.inc("season_backend_requests", backend.requests, backend=backend.name)
+        metrics.inc("season_backend_errors", backend.errors, backend=backend.name)
+    if run.writer is not None:
+        db_stats = run.writer.database.stats()
+        metrics.gauge("plex_db_lock_wait_seconds", db_stats["lock_wait"])
+        metrics.inc("plex_db_retries", db_stats["retries"])
+        metrics.gauge("plex_db_pending_items", len(run.writer.pending))
+        metrics.gauge("session_checks", run.writes.checks)
+    labels = {"shard": "{0}/{1}".format(shard.index + 1, shard.count)} if shard is not None else {}
+    try:
+        metrics.export(shard_file(config.METRICS_FILE, shard), shard_file(config.PROMETHEUS_TEXTFILE, shard), labels)
+    except IOError as e:
+        logger.warning("Could not write the metrics: {error}".format(error=e))
+
+
+def shard_file(path, shard):
+    """
+    Get the name of a file written by every shard, so the shards don't overwrite each other's file
+    :param path: the name of the file, empty if it is not written
+    :param shard: the shard of the run, None if the run was not split
+    :return: the name of the file of the shard
+    """
+    if not path or shard is None:
+        return path
+    name, extension = os.path.splitext(path)
+    return "{name}-{index}-of-{count}{extension}".format(name=name, index=shard.index + 1, count=shard.count,
+                                                          extension=extension)
+
+
+def connect_plex(url, token):
+    """
+    Connect to the Plex server
+    :param url: the url of the Plex server
+    :param token: the token to authenticate with
+    :return: the Plex server
+    """
+    from plexapi.server import PlexServer
+    # the seasons of shows are listed by the plex workers, over a pool of kept-alive connections
+    return PlexServer(url, token, session=transport.mount(requests.Session(), "plex"))
+
+
+def main_sharded(processes, shard=None, by=BY_KEY):
+    """
+    Run the update split over a number of processes on this host. Every process fetches the ratings
+    of its own items and writes them in lock-guarded batches, waiting for the locks of the others.
+    :param processes: the number of processes
+    :param shard: the shard of this host when the run is also split over several hosts, None if not
+    :param by: how to split the work when there is no shard, BY_KEY or BY_LIBRARY
+    """
+    shard = shard or Shard(0, 1, by)
+    # build the offline index once, instead of racing to build it in every process
+    if dataset.is_enabled():
+        dataset.build_index()
+    results = run_processes(main, shard.split(processes))
+    finished = [result for result in results if result is not None]
+    logger.info("Finished {finished} of {count} shards. {success} updated and {failed} failed".format(
+        finished=len(finished), count=len(results), success=sum(result[0] for result in finished),
+        failed=sum(result[1] for result in finished)))
+
+
+def fetch_ids(mappings, is_movie, guid):
+    """
+    Pipeline stage resolving the identifiers of a new item from its Plex GUID
+    :return: the stage fetching the rating
+    """
+    return select_rating_stage(resolve_guid(mappings, is_movie, guid))
+
+
+def select_rating_stage(ids):
+    """
+    Select the first source to fetch the rating of an item from
+    :param ids: tuple of imdb_id, tmdb_id and tvdb_id
+    :return: the stage fetching the rating, or the result if it is already known
+    """
+    if not ids[0]:
+        return ids + (None, None, None)
+    # first trying to get it from the offline IMDb dataset
+    if dataset.is_enabled():
+        imdb_object = dataset.get_title_ratings(ids[0])
+        if imdb_object is not None:
+            return ids + (imdb_object["rating"], "DATASET", imdb_object["votes"])
+    # then trying to get it from OMDB
+    if config.OMDB_API_KEY:
+        return next_stage("omdb", fetch_omdb_rating, ids)
+    return next_stage("imdb", fetch_imdb_rating, ids)
+
+
+def fetch_omdb_rating(ids):
+    imdb_object = omdb.get_imdb_rating_from_omdb(ids[0])
+    if imdb_object is not None:
+        return ids + (imdb_object["imdb_rating"], "OMDB", util.parse_votes(imdb_object.get("imdb_votes")))
+    # if no rating yet, try to get it directly from IMDB
+    return next_stage("imdb", fetch_imdb_rating, ids)
+
+
+def fetch_imdb_rating(ids):
+    if imdb.title_exists(ids[0]):
+        imdb_object = imdb.get_title_ratings(ids[0])
+        if imdb_object is not None and "rating" in imdb_object:
+            return ids + (imdb_object["rating"], "IMDB", imdb_object.get("ratingCount"))
+    return ids + (None, None, None)
+
+
+def handle_media_rating(run, plex_object, is_movie_library, result, error):
+    """
+    Writer stage for a movie or show, storing the fetched rating
+    :param run: the current run
+    :param plex_object: the plex object of the movie or show
+    :param is_movie_library: whether the item is a movie
+    :param result: tuple of imdb_id, tmdb_id, tvdb_id, rating, the source and the number of votes of the rating
+    :param error: the exception if fetching failed
+    """
+    if error is not None:
+        run.failed = run.failed + 1
+        run.errors.append(plex_object)
+        return
+    imdb_id, tmdb_id, tvdb_id, rating, source, votes = result
+
+    # if no imdb_id is found for plex guid, reset all ratings
+    if not imdb_id:
+        logger.debug("Missing IMDB ID. Skipping media object '{pm.title}'.".format(pm=plex_object))
+        if not DRY_RUN:
+            run.writer.reset_rating(plex_object.ratingKey)
+            flush_when_full(run)
+        run.failed = run.failed + 1
+        return
+
+    # reset in database if nothing could be fetched
+    if rating is None and not DRY_RUN:
+        logger.warning("Media not found on IMDB. Skipping '{pm.title} ({imdb_id})'.".format(
+            pm=plex_object, imdb_id=imdb_id))
+        run.writer.reset_rating(plex_object.ratingKey)
+        flush_when_full(run)
+        run.failed = run.failed + 1
+        return
+    logger.debug("{im}\t{pm.title}\t{source}".format(pm=plex_object, im=rating, source=source))
+    imdb_rating = rating
+    rating = run.policy.apply(Movie if is_movie_library else Show, imdb_rating, votes)
+
+    if is_movie_library:
+        # do update in local library for future reference
+        db_movie = run.index.get(Movie, plex_object.ratingKey)
+        if db_movie is not None:
+            run.index.update_rating(db_movie, rating, run.scheduler.next_refresh(
+                db_movie.release_date, db_movie.rating, rating, votes), imdb_rating, votes)
         else:
-            return False
+            run.index.create(
+                Movie,
+                title=plex_object.title,
+                plex_id=plex_object.ratingKey,
+                imdb_id=imdb_id,
+                rating=rating,
+                imdb_rating=imdb_rating,
+                votes=votes,
+                tmdb_id=tmdb_id,
+                release_date=plex_object.originallyAvailableAt,
+                next_refresh=run.scheduler.next_refresh(plex_object.originallyAvailableAt, None, rating, votes)
+            )
     else:
-        # check if we need to update this item
-        need_update = False
-        if db_episode.get().rating is not episode.rating:
-            need_update = True
-        elif db_episode.get().last_update > datetime.now() - timedelta(days=-7):
-            need_update = True
-
-        if need_update:
-            if imdb_episodes is None:
-                imdb_episodes = imdb.get_season_from_imdb(imdb_id, season.index)
-            if update_imdb_episode_rating(database, episode,
-                                          imdb_episodes, plex_object,
-                                          season, db_episode):
-                logger.debug("Update episode '{e.title}' '{e.index}' "
-                             "with new ratings".format(e=episode))
-                return True
+        # do update in local library for future reference
+        db_show = run.index.get(Show, plex_object.ratingKey)
+        if db_show is not None:
+            run.index.update_rating(db_show, rating, run.scheduler.next_refresh(
+                db_show.release_date, db_show.rating, rating, votes), imdb_rating, votes)
+        else:
+            run.index.create(
+                Show,
+                title=plex_object.title,
+                plex_id=plex_object.ratingKey,
+                imdb_id=imdb_id,
+                rating=rating,
+                imdb_rating=imdb_rating,
+                votes=votes,
+                release_date=plex_object.originallyAvailableAt,
+                tvdb_id=tvdb_id,
+                next_refresh=run.scheduler.next_refresh(plex_object.originallyAvailableAt, None, rating, votes)
+            )
+
+    if not DRY_RUN:
+        # if not dry run, do a update in Plex' DB
+        run.writer.set_rating(plex_object.ratingKey, rating)
+        flush_when_full(run)
+    run.success = run.success + 1
+
+    # now try to fetch seasons, if enabled in settings
+    if not is_movie_library and EPISODE_RATINGS:
+        handler = partial(handle_seasons, run, plex_object, imdb_id)
+        if isinstance(plex_object, plexdb.Item):
+            run.pipeline.submit_stage(handler, plexdb.get_seasons(run.plex_db, plex_object.ratingKey))
+        else:
+            run.pipeline.submit(handler, "plex", fetch_seasons, plex_object)
+
+
+def fetch_seasons(plex_object):
+    """
+    Pipeline stage listing the seasons of a show with their episodes
+    :param plex_object: the plex object of the show
+    :return: list of season and episodes pairs
+    """
+    seasons = []
+    for season in plex_object.seasons():
+        # don't do anything with specials
+        if season.index == 0:
+            logger.debug("Skipping specials")
+            continue
+        logger.debug("Getting episodes for {p.title} for season {season}".format(
+            p=plex_object, season=season.index))
+        seasons.append((season, season.episodes()))
+    return seasons
+
+
+def handle_seasons(run, plex_object, imdb_id, result, error):
+    """
+    Writer stage for the seasons of a show, fetching ratings for seasons with outdated episodes
+    """
+    if error is not None:
+        logger.warning("Could not list the seasons of '{pm.title}': {error}".format(pm=plex_object, error=error))
+        run.failed = run.failed + 1
+        # the new episodes are fetched again on the next incremental run
+        run.errors.append(plex_object)
+        return
+    for season, episodes in result:
+        outdated = []
+        for episode in episodes:
+            need_update, db_episode = episode_needs_update(run.index, episode)
+            if need_update:
+                outdated.append((episode, db_episode))
+        if outdated:
+            run.pipeline.submit(partial(handle_season_ratings, run, plex_object, season, outdated),
+                                "seasons", run.seasons.get, imdb_id, season.index)
+
+
+def handle_season_ratings(run, plex_object, season, episodes, imdb_episodes, error):
+    """
+    Writer stage updating the outdated episodes of a season with the fetched ratings
+    :param run: the current run
+    :param plex_object: the parent plex object
+    :param season: the season from which the episodes are belonging to
+    :param episodes: list of episode and local db episode pairs
+    :param imdb_episodes: the IMDB episodes object containing the ratings
+    :param error: the exception if fetching failed
+    """
+    if error is not None:
+        run.failed = run.failed + len(episodes)
+        run.errors.append(plex_object)
+        return
+    if imdb_episodes is None:
+        imdb_episodes = {}
+    for episode, db_episode in episodes:
+        if update_imdb_episode_rating(run, episode, imdb_episodes, plex_object, season, db_episode):
+            if db_episode is None:
+                logger.debug("Created episode '{e.title}' '{e.index}' with new ratings".format(e=episode))
             else:
-                return False
-    return False
+                logger.debug("Update episode '{e.title}' '{e.index}' with new ratings".format(e=episode))
+            run.success = run.success + 1
+        else:
+            run.failed = run.failed + 1
+    if not DRY_RUN:
+        flush_when_full(run)
+
+
+def flush_when_full(run):
+    """
+    Write the pending changes to the Plex DB once a full batch has been collected, unless somebody
+    is watching. Then the changes are kept and fetching continues.
+    :param run: the current run
+    """
+    run.writes.flush_when_full()
+
+
+def episode_needs_update(index, episode):
+    """
+    Check whether the rating of an episode is outdated
+    :param index: the index of the local DB
+    :param episode: the episode object from Plex
+    :return: pair of whether to update and the local db episode, None if it is a new episode
+    """
+    db_episode = index.get(Episode, episode.ratingKey)
+    if db_episode is None:
+        return True, None
+    # check if we need to update this item
+    if db_episode.rating != episode.rating:
+        return True, db_episode
+    elif util.is_due(db_episode):
+        return True, db_episode
+    return False, db_episode
 
 
-def update_imdb_episode_rating(database, episode, imdb_episodes, plex_object, season, db_episode=None):
+def create_season_ratings(backend):
+    """
+    Create the episode ratings provider of a run. The offline IMDb dataset returns all seasons of
+    a show at once, seasons missing from it are fetched from the configured backend.
+    :param backend: the episode ratings backend
+    :return: the season ratings provider
+    """
+    if dataset.is_enabled():
+        return SeasonRatings(backend.get_season, dataset.get_show)
+    return SeasonRatings(backend.get_season)
+
+
+def update_imdb_episode_rating(run, episode, imdb_episodes, plex_object, season, db_episode=None):
     """
     Update episode rating from IMDB
-    :param database: connection to the database
+    :param run: the current run
     :param episode: the episode object from plex
     :param imdb_episodes: the episode ratings from imdb
     :param plex_object: the plex object from the parent show
@@ -252,19 +766,20 @@ def update_imdb_episode_rating(database, episode, imdb_episodes, plex_object, se
     if episode.index in imdb_episodes:
         if imdb_episodes[episode.index] == 'N/A':
             if not DRY_RUN:
-                db.reset_rating(database, episode)
-                db.set_locked_fields(database, episode)
+                run.writer.reset_rating(episode.ratingKey)
             logger.debug("Episode '{e.title}' '{e.index}' has no rating available".format(
                 e=episode))
             return False
         else:
+            imdb_rating = imdb_episodes[episode.index]["rating"]
+            votes = imdb_episodes[episode.index].get("votes")
+            rating = run.policy.apply(Episode, imdb_rating, votes)
             if not DRY_RUN:
-                db.set_rating_and_imdb_image(database, episode,
-                                             imdb_episodes[episode.index]["rating"])
-                db.set_locked_fields(database, episode)
+                run.writer.set_rating(episode.ratingKey, rating)
             # create episode in database
             if db_episode is None:
-                Episode.create(
+                run.index.create(
+                    Episode,
                     parent_plex_id=plex_object.ratingKey,
                     plex_id=episode.ratingKey,
                     imdb_id=imdb_episodes[episode.index]["imdb_id"],
@@ -272,29 +787,35 @@ def update_imdb_episode_rating(database, episode, imdb_episodes, plex_object, se
                     season=season.index,
                     episode=episode.index,
                     release_date=episode.originallyAvailableAt,
-                    rating=imdb_episodes[episode.index]["rating"]
+                    rating=rating,
+                    imdb_rating=imdb_rating,
+                    votes=votes,
+                    next_refresh=run.scheduler.next_refresh(episode.originallyAvailableAt, None, rating)
                 )
             else:
-                db.update_db_rating(db_episode.get(), imdb_episodes[episode.index]["rating"])
+                run.index.update_rating(db_episode, rating, run.scheduler.next_refresh(
+                    db_episode.release_date, db_episode.rating, rating), imdb_rating, votes)
             return True
     else:
         if not DRY_RUN:
-            db.reset_rating(database, episode)
-            db.set_locked_fields(database, episode)
+            run.writer.reset_rating(episode.ratingKey)
         logger.debug("Episode '{e.title}' '{e.index}' not found. Cannot update".format(
             e=episode))
         if db_episode is None:
-            Episode.create(
+            run.index.create(
+                Episode,
                 parent_plex_id=plex_object.ratingKey,
                 plex_id=episode.ratingKey,
                 title=episode.title,
                 season=season.index,
                 episode=episode.index,
-                release_date=episode.originallyAvailableAt
+                release_date=episode.originallyAvailableAt,
+                next_refresh=run.scheduler.next_refresh(episode.originallyAvailableAt, None, None)
             )
         else:
             if episode.index in imdb_episodes:
-                db.update_db_rating(db_episode.get(), imdb_episodes[episode.index]["rating"])
+                run.index.update_rating(db_episode, imdb_episodes[episode.index]["rating"], run.scheduler.next_refresh(
+                    db_episode.release_date, db_episode.rating, imdb_episodes[episode.index]["rating"]))
             else:
                 logger.debug("Episode '{e.title}' '{e.index}' not found. Cannot update".format(
                     e=episode))
@@ -302,77 +823,160 @@ def update_imdb_episode_rating(database, episode, imdb_episodes, plex_object, se
     return False
 
 
-def resolve_ids(is_movie, plex_object, force, pbar=None):
+def resolve_local_ids(index, plex_object, force):
     """
-    Method to resolve ID from a Plex GUID
-    :param is_movie_library: whether given GUID is a movie
-    :param plex_object: the plex object containing the GUID
+    Resolve the identifiers via the local DB if they were fetched earlier
+    :param index: the index of the local DB
+    :param plex_object: the plex object
     :param force: if forced update we want to resolve it again
-    :param pbar: the progress bar object
-    :return:
-    """
-    tmdb_id = None
-    tvdb_id = None
-    # first try to resolve via Plex ID if fetched earlier
-    if plex_object.TYPE is "movie" and not force:
-        db_movie = Movie.select().where(Movie.plex_id == plex_object.ratingKey)
-        if db_movie.exists():
-            imdb_id = db_movie.get().imdb_id
-            tmdb_id = db_movie.get().tmdb_id
+    :return: tuple of imdb_id, tmdb_id and tvdb_id, None if not known yet
+    """
+    if force:
+        return None
+    if plex_object.TYPE == "movie":
+        db_movie = index.get(Movie, plex_object.ratingKey)
+        if db_movie is not None:
             logger.debug("Resolved via existing db entry")
-            return imdb_id, tmdb_id, tvdb_id
-    elif not force:
-        db_show = Show.select().where(Show.plex_id == plex_object.ratingKey)
-        if db_show.exists():
-            imdb_id = db_show.get().imdb_id
-            tmdb_id = db_show.get().tmdb_id
-            tvdb_id = db_show.get().tvdb_id
+            return db_movie.imdb_id, db_movie.tmdb_id, None
+    else:
+        db_show = index.get(Show, plex_object.ratingKey)
+        if db_show is not None:
             logger.debug("Resolved via existing db entry")
-            return imdb_id, tmdb_id, tvdb_id
-    # if not yet resolved it's a new item
-    if 'imdb://' in plex_object.guid:
-        imdb_id = plex_object.guid.split('imdb://')[1].split('?')[0]
-    elif 'themoviedb://' in plex_object.guid:
-        tmdb_id = plex_object.guid.split('themoviedb://')[1].split('?')[0]
-        imdb_id = tmdb.get_imdb_id_from_tmdb(tmdb_id, is_movie, pbar)
-    elif 'thetvdb://' in plex_object.guid:
-        tvdb_id = plex_object.guid.split('thetvdb://')[1].split('?')[0]
-        imdb_id = tmdb.get_imdb_id_from_tmdb_by_tvdb(tvdb_id, pbar)
+            return db_show.imdb_id, db_show.tmdb_id, db_show.tvdb_id
+    return None
+
+
+def parse_guid(is_movie, guid):
+    """
+    Get the identifiers contained in a Plex GUID
+    :param is_movie: whether given GUID is a movie
+    :param guid: the Plex GUID
+    :return: tuple of imdb_id, tmdb_id and tvdb_id, and the id mapping source if the IMDB id is not in it
+    """
+    if 'imdb://' in guid:
+        return guid.split('imdb://')[1].split('?')[0], None, None, None
+    elif 'themoviedb://' in guid:
+        return None, guid.split('themoviedb://')[1].split('?')[0], None, TMDB_MOVIE if is_movie else TMDB_SHOW
+    elif 'thetvdb://' in guid:
+        return None, None, guid.split('thetvdb://')[1].split('?')[0], TVDB
+    return None, None, None, None
+
+
+def resolve_guid(mappings, is_movie, guid):
+    """
+    Resolve the identifiers of a new item from its Plex GUID, looking up the IMDB id via the known
+    id mappings, or via TMDb if it is not known yet
+    :param mappings: the known id mappings
+    :param is_movie: whether given GUID is a movie
+    :param guid: the Plex GUID
+    :return: tuple of imdb_id, tmdb_id and tvdb_id
+    """
+    imdb_id, tmdb_id, tvdb_id, source = parse_guid(is_movie, guid)
+    if source is None:
+        return imdb_id, tmdb_id, tvdb_id
+    external_id = tvdb_id if source == TVDB else tmdb_id
+    mapping = mappings.get(source, external_id)
+    if mapping is not None:
+        logger.debug("Resolved via id mapping {source} {id}".format(source=source, id=external_id))
+        return mapping[0], mapping[1] or tmdb_id, tvdb_id
+    if source == TVDB:
+        imdb_id, tmdb_id = tmdb.get_ids_from_tmdb_by_tvdb(tvdb_id)
     else:
-        imdb_id = None
+        imdb_id = tmdb.get_imdb_id_from_tmdb(tmdb_id, is_movie)
+    if imdb_id:
+        mappings.add(source, external_id, imdb_id, tmdb_id)
     return imdb_id, tmdb_id, tvdb_id
 
 
-def should_update_media(type, plex_object):
+def needs_id_lookup(mappings, is_movie, guid):
+    """
+    Whether resolving a Plex GUID requires a request to TMDb
+    :param mappings: the known id mappings
+    :param is_movie: whether given GUID is a movie
+    :param guid: the Plex GUID
+    :return: True if the IMDB id has to be looked up, False if not
+    """
+    imdb_id, tmdb_id, tvdb_id, source = parse_guid(is_movie, guid)
+    if source is None:
+        return False
+    return mappings.get(source, tvdb_id if source == TVDB else tmdb_id) is None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Update the ratings in Plex with the ratings of IMDB")
+    parser.add_argument("plex_ids", nargs="*", metavar="plex_id",
+                        help="only update the movies and shows with these plex ids")
+    parser.add_argument("--ids-file", help="only update the movies and shows with the plex ids in this file, "
+                                           "one per line. - reads them from stdin")
+    parser.add_argument("--recompute", action="store_true",
+                        help="apply the rating policy to all stored ratings, without fetching them again")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and update the items Plex reports through its webhooks")
+    parser.add_argument("--shard", help="only process shard i of N, as i/N counting from 1, to split the run "
+                                        "over several hosts")
+    parser.add_argument("--shard-by", choices=[BY_KEY, BY_LIBRARY], default=BY_KEY,
+                        help="split the items of all libraries by their plex id, or hand out whole libraries")
+    parser.add_argument("--processes", type=int, default=1, help="split the run over this number of processes")
+    return parser.parse_args(argv)
+
+
+def read_ids(path):
+    """
+    Read Plex ids, one per line
+    :param path: the file to read, - for stdin, None to read nothing
+    :return: list of the ids
+    """
+    if not path:
+        return []
+    if path == "-":
+        return [line.strip() for line in sys.stdin if line.strip()]
+    with open(path) as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def valid_ids(plex_ids):
+    """
+    Leave out the ids that are not Plex ids, like a typo on the command line or a header line in the ids file
+    :param plex_ids: the given ids
+    :return: list of the Plex ids as text
+    """
+    valid = []
+    for plex_id in plex_ids:
+        plex_id = str(plex_id).strip()
+        if plex_id.isdigit():
+            valid.append(plex_id)
+        else:
+            logger.warning("Skipping '{plex_id}', it is not a Plex id".format(plex_id=plex_id))
+    return valid
+
+
+def should_update_media(index, type, plex_object):
     """
     Whether given plex media object rating should be updated
+    :param index: the index of the local DB
     :param type: the type of media
     :param plex_object: the plex object containing rating and ratingKey
     :return: True if should be updated, False if not
     """
-    if type is "movie":
-        db_movie = Movie.select().where(Movie.plex_id == plex_object.ratingKey)
-        if db_movie.exists():
-            if util.check_media_needs_update(db_movie, plex_object):
+    if type == "movie":
+        db_movie = index.get(Movie, plex_object.ratingKey)
+        if db_movie is not None:
+            if util.check_media_needs_update(db_movie, plex_object,
+                                             due=index.is_planned(Movie, plex_object.ratingKey)):
                 return True
         else:
             return True
-    elif type is "show":
-        # getting show and episodes from show
-        db_show = Show.select().where(Show.plex_id == plex_object.ratingKey)
-        db_episodes = Episode.select().where(Episode.parent_plex_id == plex_object.ratingKey)
-        if db_show.exists():
-            if util.check_media_needs_update(db_show, plex_object):
+    elif type == "show":
+        # the show is planned when the show itself or one of its episodes is due
+        db_show = index.get(Show, plex_object.ratingKey)
+        if db_show is not None:
+            if util.check_media_needs_update(db_show, plex_object, due=index.is_planned(Show, plex_object.ratingKey)):
                 return True
-            # if show doesn't need update, maybe a single episode need one
-            for episode in db_episodes:
-                if util.check_media_needs_update(episode, plex_object, check_rating=False):
-                    return True
         else:
             return True
-    elif type is "episode":
-        db_episode = Episode.select().where(Episode.plex_id == plex_object.ratingKey)
-        if db_episode.exists():
+    elif type == "episode":
+        db_episode = index.get(Episode, plex_object.ratingKey)
+        if db_episode is not None:
             if util.check_media_needs_update(db_episode, plex_object):
                 return True
         else:
@@ -386,9 +990,17 @@ if __name__ == "__main__":
     logger.addHandler(logging.FileHandler("plex-imdb-updater.log"))
     logger.addHandler(logging.StreamHandler(sys.stdout))
     create_tables()
+    args = parse_args()
+    shard = parse_shard(args.shard, args.shard_by) if args.shard else None
     # you can run the script for one movie/show when giving the plex id
-    if len(sys.argv) > 1:
-        logger.info("Getting rating for single item")
-        main(sys.argv[1], force=True)
+    if args.plex_ids or args.ids_file:
+        logger.info("Getting ratings for the given items")
+        main_items(args.plex_ids + read_ids(args.ids_file))
+    elif args.recompute:
+        main_recompute()
+    elif args.daemon:
+        main_daemon()
+    elif args.processes > 1:
+        main_sharded(args.processes, shard, args.shard_by)
     else:
-        main()
+        main(shard=shard)
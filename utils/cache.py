@@ -0,0 +1,222 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from utils import config, transport
+
+# query parameters that are left out of the cache key
+SECRET_PARAMS = ("api_key", "apikey")
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+store = None
+logger = logging.getLogger("plex-imdb-updater")
+
+
+class ResponseCache(object):
+    """
+    Persistent cache of HTTP responses, keyed by provider and request. Entries expire after the TTL
+    of their kind, expired entries with an ETag or Last-Modified are revalidated with a conditional
+    request. The least recently used entries are evicted when the cache grows over its maximum size.
+    """
+
+    def __init__(self, path, ttls, max_size):
+        """
+        :param path: the SQLite file to store the responses in
+        :param ttls: dict of kind of request and its time to live as timedelta
+        :param max_size: the maximum size of all cached bodies in bytes
+        """
+        self.ttls = ttls
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=config.LOCK_TIMEOUT, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, provider TEXT, status INTEGER, "
+                          "headers TEXT, body BLOB, expires REAL, accessed REAL, size INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        # statistics per provider
+        self.counters = defaultdict(lambda: {"hits": 0, "misses": 0, "revalidated": 0})
+
+    def lookup(self, provider, key):
+        """
+        Get a cached response
+        :return: tuple of response and whether it is still fresh, None if not cached
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT status, headers, body, expires FROM responses WHERE key = ?",
+                                    [key]).fetchone()
+            if row is None:
+                self.counters[provider]["misses"] += 1
+                return None
+            now = time.time()
+            fresh = row[3] > now
+            if fresh:
+                self.counters[provider]["hits"] += 1
+                self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", [now, key])
+                self.conn.commit()
+        return to_response(row[0], json.loads(row[1]), row[2]), fresh
+
+    def save(self, provider, key, kind, response):
+        """
+        Store a successful response
+        """
+        headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        now = time.time()
+        expires = now + self.ttls[kind].total_seconds()
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM responses WHERE key = ?", [key]).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              [key, provider, response.status_code, json.dumps(headers), response.content,
+                               expires, now, len(response.content)])
+            self.size += len(response.content)
+            if self.size > self.max_size:
+                self._evict()
+            self.conn.commit()
+
+    def expired(self, provider):
+        """
+        Count an expired entry the provider did not confirm as a miss
+        """
+        with self.lock:
+            self.counters[provider]["misses"] += 1
+
+    def revalidated(self, provider, key, kind):
+        """
+        Extend the lifetime of an entry after the provider told us it did not change
+        """
+        now = time.time()
+        with self.lock:
+            self.counters[provider]["revalidated"] += 1
+            self.conn.execute("UPDATE responses SET expires = ?, accessed = ? WHERE key = ?",
+                              [now + self.ttls[kind].total_seconds(), now, key])
+            self.conn.commit()
+
+    def _evict(self):
+        # evict the least recently used entries until there is some room again
+        target = self.max_size * 0.9
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.size <= target:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        logger.debug("Evicted {count} responses from the cache".format(count=len(evicted)))
+
+    def stats(self):
+        with self.lock:
+            return {provider: dict(counters) for provider, counters in self.counters.items()}
+
+    def close(self):
+        self.conn.close()
+
+
+def to_response(status, headers, body):
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    response.encoding = "utf-8"
+    return response
+
+
+def open_cache(path=None, ratings_ttl=None):
+    """
+    Open the response cache used by all provider sessions
+    :param path: the SQLite file to store the responses in, defaults to config.CACHE_FILE
+    :param ratings_ttl: the time to live of rating requests, defaults to config.CACHE_TTL
+    """
+    global store
+    path = path or config.CACHE_FILE
+    if not path:
+        return
+    ttls = dict(config.CACHE_TTL)
+    if ratings_ttl is not None:
+        ttls["ratings"] = ratings_ttl
+    store = ResponseCache(path, ttls, config.CACHE_MAX_SIZE)
+
+
+def close_cache():
+    global store
+    if store is not None:
+        store.close()
+        store = None
+
+
+def stats():
+    """
+    Hit and miss counters of the response cache
+    :return: dict of provider and its counters
+    """
+    if store is None:
+        return {}
+    return store.stats()
+
+
+class CachedSession(requests.Session):
+    """
+    Requests session answering GET requests from the response cache when possible
+    """
+
+    def __init__(self, provider, kind, cacheable=None):
+        """
+        :param provider: the name of the provider
+        :param kind: the kind of requests, or function(url, params) returning the kind of a request,
+                     requests of kind None are not cached
+        :param cacheable: function(response) telling whether a successful response is worth keeping, None
+                          to keep all of them
+        """
+        super(CachedSession, self).__init__()
+        self.provider = provider
+        self.kind = kind
+        self.cacheable = cacheable
+        transport.mount(self, provider)
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        if store is None or method.upper() != "GET":
+            return super(CachedSession, self).request(method, url, params=params, headers=headers, **kwargs)
+        kind = self.kind(url, params) if callable(self.kind) else self.kind
+        if kind is None:
+            return super(CachedSession, self).request(method, url, params=params, headers=headers, **kwargs)
+        key = cache_key(self.provider, url, params)
+        cached = store.lookup(self.provider, key)
+        if cached is not None and cached[1]:
+            return cached[0]
+
+        headers = dict(headers or {})
+        if cached is not None:
+            # ask the provider whether our expired copy is still valid
+            if "ETag" in cached[0].headers:
+                headers["If-None-Match"] = cached[0].headers["ETag"]
+            if "Last-Modified" in cached[0].headers:
+                headers["If-Modified-Since"] = cached[0].headers["Last-Modified"]
+        response = super(CachedSession, self).request(method, url, params=params, headers=headers, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            store.revalidated(self.provider, key, kind)
+            return cached[0]
+        if cached is not None:
+            store.expired(self.provider)
+        if response.status_code == 200 and (self.cacheable is None or self.cacheable(response)):
+            store.save(self.provider, key, kind, response)
+        return response
+
+
+def cache_key(provider, url, params):
+    """
+    Build the cache key of a request, leaving out the API keys
+    """
+    if isinstance(params, dict):
+        params = sorted((name, value) for name, value in params.items() if name not in SECRET_PARAMS)
+        if params:
+            url = "{url}?{query}".format(url=url, query=urlencode(params))
+    return "{provider}:{url}".format(provider=provider, url=url)
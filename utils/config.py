@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 # API Keys
 # Optional: The Movie Database details ###
 # To enable fetching TVDB and TMDB items ###
@@ -5,4 +7,106 @@ TMDB_API_KEY = ''
 # Optional: The Open Movie Database details ###
 # Enter your OMDIB API key.
 # Scraping IMDb can be very slow process. This speeds up the process by getting the IMDB rating directly from OMDB
-OMDB_API_KEY = ''
\ No newline at end of file
+OMDB_API_KEY = ''
+# Optional: Offline IMDb dataset ###
+# Directory containing title.ratings.tsv.gz and title.episode.tsv.gz from https://datasets.imdbws.com/
+# When set, ratings are looked up in a local index instead of calling OMDB or IMDB for every item
+IMDB_DATASET_DIR = ''
+IMDB_DATASET_INDEX = 'imdb-dataset.sqlite'
+# ID mappings ###
+# Manual overrides of the IMDB id of TVDB ids, lines of tvdb_id=imdb_id. These take priority over any lookup
+ID_OVERRIDES_FILE = 'tvdb-imdb.txt'
+# Optional CSV or TSV export with imdb_id, tvdb_id, tmdb_id and type columns, imported before every run
+ID_MAPPINGS_IMPORT = ''
+# Concurrency ###
+# Number of parallel workers per provider. Plex is used to list seasons and episodes, seasons fetches
+# episode ratings from the source set with EPISODE_RATINGS_SOURCE
+CONCURRENCY = {
+    "tmdb": 4,
+    "omdb": 4,
+    "imdb": 4,
+    "plex": 2,
+    "seasons": 4,
+}
+# Libraries are read in pages of this many movies or shows, so memory use doesn't grow with the library
+ENUMERATE_PAGE_SIZE = 500
+# API endpoints, can be pointed to a local server for testing
+TMDB_API_URL = 'https://api.themoviedb.org/3'
+OMDB_API_URL = 'http://www.omdbapi.com'
+# HTTP ###
+# Connect and read timeout in seconds of every request to TMDb, OMDB and IMDB
+HTTP_TIMEOUT = (5, 10)
+# Multiplex the requests to every provider over a single HTTP/2 connection. Needs httpx: pip install httpx[http2]
+HTTP2 = False
+# Local DB ###
+# SQLite settings of db.sqlite. In WAL mode readers don't block the writer, so the shards of a sharded run can
+# load the local DB while another one flushes. WAL doesn't work on network file systems, use "delete" there
+LOCAL_DB_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",  # safe with WAL, only the last transactions may be lost on a power failure
+    "cache_size": -64 * 1024,  # KiB
+    "temp_store": "memory",
+}
+# Rate limits ###
+# Requests per second and burst size per provider
+RATE_LIMITS = {
+    "tmdb": (3, 30),
+    "omdb": (3, 30),
+    "imdb": (10, 10),
+}
+# Failed requests and 429 responses are retried with a jittered exponential backoff
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0  # seconds
+RETRY_BACKOFF_MAX = 60.0  # seconds
+# Plex DB writes ###
+# Number of items written to the Plex DB in a single transaction
+WRITE_BATCH_SIZE = 500
+# Seconds to wait for a write lock on the Plex DB, the local DB or the cache held by another process,
+# like the other shards of a sharded run
+LOCK_TIMEOUT = 30
+# The Plex server keeps the library DB locked often. A write waits up to PLEX_DB_BUSY_TIMEOUT seconds for the
+# lock and is tried again up to PLEX_DB_RETRIES times after a short jittered backoff. Changes that still could
+# not be written are kept and written with the next batch
+PLEX_DB_BUSY_TIMEOUT = 5
+PLEX_DB_RETRIES = 3
+PLEX_DB_BACKOFF = 0.5  # seconds
+PLEX_DB_BACKOFF_MAX = 5.0  # seconds
+# Changes are only written while nobody is watching, playback is checked every this many seconds.
+# Until then fetching continues and the changes are kept in memory
+SESSION_CHECK_INTERVAL = 10
+# Optional maintenance window, like ("03:00", "06:00"). When set, changes are only written inside the
+# window, whether or not somebody is watching
+MAINTENANCE_WINDOW = None
+# At the end of a run, wait at most this many seconds for the server to be idle or the window to open. The changes
+# still not written are kept in the local DB and written by the next run
+WRITE_WAIT_MAX = 15 * 60
+# Rating policy ###
+# How the fetched IMDb ratings are turned into the ratings shown in Plex. After changing these, run the updater
+# with --recompute to apply them to all stored ratings at once, without any request to the providers.
+# Round the ratings to this many decimals, half up. None keeps them as fetched
+RATING_DECIMALS = None
+# Shrink the ratings of titles with few votes toward the average rating of all movies, shows or episodes, as if
+# the average had this many votes of its own. 0 keeps the ratings as fetched
+RATING_SHRINKAGE_VOTES = 0
+# Response cache ###
+# Responses of OMDB, TMDB and IMDB are kept in a local cache, so a re-run hardly does any requests.
+# Leave CACHE_FILE empty to disable the cache
+CACHE_FILE = 'http-cache.sqlite'
+CACHE_MAX_SIZE = 100 * 1024 * 1024  # bytes
+# Time to live per kind of request. ID mappings rarely change, ratings follow THRESHOLD_SHORT
+CACHE_TTL = {
+    "ids": timedelta(days=90),
+    "ratings": timedelta(days=1),
+}
+# Metrics ###
+# Timings and counters of every run are written to METRICS_FILE as JSON. Set PROMETHEUS_TEXTFILE to a file in the
+# directory of the textfile collector of the node exporter to export them to Prometheus as well
+METRICS_FILE = 'metrics.json'
+PROMETHEUS_TEXTFILE = ''
+# Webhook daemon ###
+# With --daemon the updater keeps running and updates the items Plex reports to its webhook at
+# http://WEBHOOK_HOST:WEBHOOK_PORT/. Events coming in within WEBHOOK_DELAY seconds of each other, like
+# those of a library scan, are handled together
+WEBHOOK_HOST = '127.0.0.1'
+WEBHOOK_PORT = 32600
+WEBHOOK_DELAY = 2.0  # seconds
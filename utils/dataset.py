@@ -0,0 +1,196 @@
+import gzip
+import logging
+import os
+import sqlite3
+import threading
+
+from utils import config
+
+RATINGS_FILE = "title.ratings.tsv.gz"
+EPISODES_FILE = "title.episode.tsv.gz"
+CHUNK_SIZE = 50000
+RATINGS_TABLE = "CREATE TABLE IF NOT EXISTS ratings (tconst INTEGER PRIMARY KEY, rating REAL, votes INTEGER) " \
+                "WITHOUT ROWID"
+EPISODES_TABLE = "CREATE TABLE IF NOT EXISTS episodes (tconst INTEGER PRIMARY KEY, parent INTEGER, " \
+                 "season INTEGER, episode INTEGER) WITHOUT ROWID"
+
+connection = None
+connection_lock = threading.Lock()
+logger = logging.getLogger("plex-imdb-updater")
+
+
+def is_enabled():
+    """
+    Whether the offline IMDb dataset is configured
+    :return: True if a dataset directory is set, False if not
+    """
+    return bool(config.IMDB_DATASET_DIR)
+
+
+def tconst_to_int(imdb_id):
+    """
+    Pack an IMDB id like 'tt0074053' into an integer
+    :param imdb_id: the IMDB id to pack
+    :return: the numeric part of the id, or None if it is not a valid title id
+    """
+    if not imdb_id or not imdb_id.startswith("tt") or not imdb_id[2:].isdigit():
+        return None
+    return int(imdb_id[2:])
+
+
+def int_to_tconst(value):
+    """
+    Unpack an integer back into an IMDB id
+    :param value: the packed IMDB id
+    :return: the IMDB id including the tt prefix
+    """
+    if value is None:
+        return None
+    return "tt{0:07d}".format(value)
+
+
+def build_index(dataset_dir=None, index_file=None, force=False):
+    """
+    Build or refresh the local index from the IMDb dataset dumps. Each dump is only
+    imported again when the file on disk is newer than the one the index was built from.
+    :param dataset_dir: directory containing the title.ratings and title.episode dumps
+    :param index_file: the SQLite file in which to store the index
+    :param force: rebuild the index even if the dumps did not change
+    :return: True if anything was (re)imported, False if not
+    """
+    global connection
+    dataset_dir = dataset_dir or config.IMDB_DATASET_DIR
+    index_file = index_file or config.IMDB_DATASET_INDEX
+
+    conn = sqlite3.connect(index_file)
+    conn.execute("CREATE TABLE IF NOT EXISTS dump_state (name TEXT PRIMARY KEY, mtime REAL)")
+    # a missing dump leaves its table empty, so its lookups find nothing instead of failing
+    conn.execute(RATINGS_TABLE)
+    conn.execute(EPISODES_TABLE)
+    conn.commit()
+    updated = False
+    for name, importer in ((RATINGS_FILE, _import_ratings), (EPISODES_FILE, _import_episodes)):
+        path = os.path.join(dataset_dir, name)
+        if not os.path.exists(path):
+            logger.warning("IMDb dataset file '{path}' not found".format(path=path))
+            continue
+        mtime = os.path.getmtime(path)
+        row = conn.execute("SELECT mtime FROM dump_state WHERE name = ?", [name]).fetchone()
+        if not force and row is not None and row[0] >= mtime:
+            continue
+        logger.info("Importing IMDb dataset file '{path}'...".format(path=path))
+        with conn:
+            importer(conn, path)
+            conn.execute("INSERT OR REPLACE INTO dump_state (name, mtime) VALUES (?, ?)", [name, mtime])
+        updated = True
+    if updated:
+        conn.execute("VACUUM")
+    conn.close()
+
+    # make sure lookups see the freshly built index
+    with connection_lock:
+        if connection is not None:
+            connection.close()
+            connection = None
+    return updated
+
+
+def _read_dump(path):
+    """
+    Stream the rows of a gzipped IMDb TSV dump, skipping the header
+    :param path: the path of the dump
+    :return: generator of column lists
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as dump:
+        next(dump, None)
+        for line in dump:
+            yield line.rstrip("\n").split("\t")
+
+
+def _import_ratings(conn, path):
+    conn.execute("DROP TABLE IF EXISTS ratings")
+    conn.execute(RATINGS_TABLE)
+    rows = ((tconst_to_int(r[0]), float(r[1]), int(r[2])) for r in _read_dump(path))
+    _insert_chunked(conn, "INSERT OR REPLACE INTO ratings VALUES (?, ?, ?)", rows)
+
+
+def _import_episodes(conn, path):
+    conn.execute("DROP TABLE IF EXISTS episodes")
+    conn.execute(EPISODES_TABLE)
+    # episodes without season or episode number can never be matched to Plex
+    rows = ((tconst_to_int(r[0]), tconst_to_int(r[1]), int(r[2]), int(r[3]))
+            for r in _read_dump(path) if r[2] != "\\N" and r[3] != "\\N")
+    _insert_chunked(conn, "INSERT OR REPLACE INTO episodes VALUES (?, ?, ?, ?)", rows)
+    conn.execute("CREATE INDEX episodes_parent_season ON episodes (parent, season)")
+
+
+def _insert_chunked(conn, query, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            conn.executemany(query, chunk)
+            chunk = []
+    if chunk:
+        conn.executemany(query, chunk)
+
+
+def _query(query, args):
+    global connection
+    with connection_lock:
+        if connection is None:
+            connection = sqlite3.connect(config.IMDB_DATASET_INDEX, check_same_thread=False)
+        return connection.execute(query, args).fetchall()
+
+
+def get_title_ratings(imdb_id):
+    """
+    Getting the rating of a title from the local index
+    :param imdb_id: the imdb_id of the title
+    :return: dict with rating and votes, None if the title has no rating
+    """
+    rows = _query("SELECT rating, votes FROM ratings WHERE tconst = ?", [tconst_to_int(imdb_id)])
+    if not rows:
+        return None
+    return {"rating": rows[0][0], "votes": rows[0][1]}
+
+
+def get_season(imdb_id, season):
+    """
+    Getting season ratings from the local index, in the same shape as imdb.get_season_from_imdb with the number
+    of votes as well
+    :param imdb_id: the imdb_id of the show
+    :param season: which season of the show to fetch ratings for
+    :return: a pair, episode number/rating. 'N/A' for episodes without rating
+    """
+    rows = _query("SELECT e.episode, e.tconst, r.rating, r.votes FROM episodes e "
+                  "LEFT JOIN ratings r ON r.tconst = e.tconst "
+                  "WHERE e.parent = ? AND e.season = ?", [tconst_to_int(imdb_id), season])
+    if not rows:
+        return None
+    episodes = {}
+    for episode, tconst, rating, votes in rows:
+        if rating is None:
+            episodes[episode] = 'N/A'
+        else:
+            episodes[episode] = {"rating": rating, "imdb_id": int_to_tconst(tconst), "votes": votes}
+    return episodes
+
+
+def get_show(imdb_id):
+    """
+    Getting the ratings of all seasons of a show from the local index in a single query
+    :param imdb_id: the imdb_id of the show
+    :return: dict of season number and its episodes, in the shape of get_season
+    """
+    rows = _query("SELECT e.season, e.episode, e.tconst, r.rating, r.votes FROM episodes e "
+                  "LEFT JOIN ratings r ON r.tconst = e.tconst "
+                  "WHERE e.parent = ?", [tconst_to_int(imdb_id)])
+    seasons = {}
+    for season, episode, tconst, rating, votes in rows:
+        if rating is None:
+            seasons.setdefault(season, {})[episode] = 'N/A'
+        else:
+            seasons.setdefault(season, {})[episode] = {"rating": rating, "imdb_id": int_to_tconst(tconst),
+                                                       "votes": votes}
+    return seasons
@@ -1,106 +1,219 @@
 import logging
-import sqlite3, re
-from datetime import datetime
-from sqlite3 import Error
-from time import sleep
+import random
+import sqlite3
+import time
+from collections import defaultdict
+
+from utils import config
 
 logger = logging.getLogger("plex-imdb-updater")
 
 
-def create_connection(db_file):
-    """ create a database connection to a SQLite database """
-    conn = None
-    try:
-        conn = sqlite3.connect(db_file)
-    except Error as e:
-        logger.error(e)
-    finally:
-        if conn:
-            conn.close()
+IMDB_RATING_IMAGE = "at%3AratingImage=imdb%3A%2F%2Fimage%2Erating"
+RATING_IMAGE_KEYS = ("at%3AratingImage", "at%3AaudienceRatingImage")
+RATING_FIELD = "5"
 
 
-def set_rating_and_imdb_image(db, plex_object, rating):
+def imdb_extra_data(extra_data):
     """
-    Set the rating and the use of IMDB rating image in extra_data
-    :param db: the database in which to change the values
-    :param plex_object: the plex object for which to set rating image
-    :param rating: the rating which to set
-    :return:
+    Compute the extra_data of an item showing the IMDB rating image, replacing any other rating images
+    :param extra_data: the current extra_data, may be None
+    :return: the new extra_data
     """
-    # method to set rating image to IMDB
-    db_execute(db, "UPDATE metadata_items SET rating = ? WHERE id = ?", [rating, plex_object.ratingKey])
-
-    extra_data = db_execute(db, "SELECT extra_data FROM metadata_items WHERE id = ?", [plex_object.ratingKey]).fetchone()[0]
-    if extra_data:
-        extra_data = re.sub(r"at%3AratingImage=.+?&|at%3AaudienceRatingImage=.+?&", '', extra_data)
+    fields = [field for field in (extra_data or "").split("&")
+              if field and field.split("=", 1)[0] not in RATING_IMAGE_KEYS]
+    return "&".join([IMDB_RATING_IMAGE] + fields)
 
-        db_execute(db, "UPDATE metadata_items SET extra_data = ? WHERE id = ?",
-                    [extra_data, plex_object.ratingKey])
 
-    # set rating image to IMDB
-    db_execute(db, "UPDATE metadata_items SET extra_data = ? || extra_data WHERE id = ?",
-                ['at%3AratingImage=imdb%3A%2F%2Fimage%2Erating&', plex_object.ratingKey])
-    # remove trailing ampersands, since this will cause trouble in the front-end
-    db_execute(db, "UPDATE metadata_items SET extra_data = trim(extra_data, '&') WHERE id = ?", [plex_object.ratingKey])
+def locked_user_fields(user_fields):
+    """
+    Compute the user_fields of an item with the rating field locked
+    :param user_fields: the current user_fields, may be None
+    :return: the new user_fields
+    """
+    fields = [field for field in (user_fields or "").split("&") if field]
+    for index, field in enumerate(fields):
+        key, _, value = field.partition("=")
+        if key == "lockedFields":
+            locked = [locked_field for locked_field in value.split("|") if locked_field]
+            if RATING_FIELD not in locked:
+                fields[index] = "lockedFields=" + "|".join(locked + [RATING_FIELD])
+            return "&".join(fields)
+    return "&".join(fields + ["lockedFields=" + RATING_FIELD])
+
+
+def is_locked(error):
+    """
+    Whether an error means another connection holds a lock, so retrying later may succeed
+    """
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
 
 
-def set_locked_fields(db, plex_object):
+def backoff(attempt):
     """
-    Lock the fields for a specific Plex object so automatic metadata updater cannot override rating
-    :param db: the database in which to change the values
-    :param plex_object: the plex object for which to lock rating field
-    :return:
+    Short jittered exponential backoff between attempts to take a lock
+    :param attempt: the number of the retry, starting at 1
+    :return: the number of seconds to wait
     """
-    user_fields = db_execute(db, "SELECT user_fields FROM metadata_items WHERE id = ? AND user_fields NOT LIKE ?", [plex_object.ratingKey, '%lockedFields=%5%']).fetchone()
-    # if set, we need to update the locked fields
-    if user_fields is not None:
-        logger.debug("Locking rating field for {p.title}".format(p=plex_object))
-        fields = user_fields[0].split(",")
-
-        for field in fields:
-            if "lockedFields" in field:
-                # remove lockedFields value temporary
-                user_fields = re.sub(r"lockedFields=.+?", '', user_fields[0])
-                db_execute(db, "UPDATE metadata_items SET user_fields = ? WHERE id = ?",
-                            [user_fields, plex_object.ratingKey])
-                # append the rating field to locked fields
-                locked_fields = field + "|5"
-                db_execute(db, "UPDATE metadata_items SET user_fields = ? || user_fields WHERE id = ?",
-                            [locked_fields, plex_object.ratingKey])
-
-
-def update_db_rating(db_media, rating):
+    return random.uniform(0, min(config.PLEX_DB_BACKOFF_MAX, config.PLEX_DB_BACKOFF * 2 ** (attempt - 1)))
+
+
+class WriteResult(object):
     """
-    Update rating in the database including setting last update timestamp
-    :param db_media: the BaseMediaModel
-    :param rating: the rating to set for this
-    :return:
+    The outcome of a write or read transaction. A failed write leaves the database unchanged, so the
+    caller can queue the changes again.
     """
-    db_media.rating = rating
-    db_media.last_update = datetime.now()
-    db_media.save()
 
+    def __init__(self, value=None, error=None, attempts=1):
+        self.value = value
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def ok(self):
+        return self.error is None
 
-def reset_rating(db, plex_object):
+
+class PlexDatabase(object):
     """
-    Method to reset the ratings for a plex object
-    :param db: the database in which to change the values
-    :param plex_object: the plex object for which to reset the rating
-    :return:
+    Connection to the Plex DB for writing. The Plex server holds locks on the library DB all the time,
+    so every statement waits up to the busy timeout, and a write transaction that still finds the
+    database locked is rolled back and tried again a limited number of times after a short jittered
+    backoff. Keeps the latency of every kind of statement and the time spent waiting for locks.
     """
-    db_execute(db, "UPDATE metadata_items SET rating = null WHERE id = ?", [plex_object.ratingKey])
-
-
-def db_execute(db, query, args):
-    try:
-        return db.execute(query, args)
-    except sqlite3.OperationalError as e:
-        logger.error("Database Error: {}".format(e))
-        sleep(10)
-        db_execute(db, query, args)
-    except sqlite3.DatabaseError as e:
-        logger.error("Database Error: {}".format(e))
-        sleep(10)
-        db_execute(db, query, args)
-
-    return None
+
+    def __init__(self, path, busy_timeout=None, retries=None):
+        """
+        :param path: the path of the Plex DB
+        :param busy_timeout: seconds a statement waits for a lock, defaults to config.PLEX_DB_BUSY_TIMEOUT
+        :param retries: the number of times a locked transaction is tried again, defaults to config.PLEX_DB_RETRIES
+        """
+        self.busy_timeout = config.PLEX_DB_BUSY_TIMEOUT if busy_timeout is None else busy_timeout
+        self.retries = config.PLEX_DB_RETRIES if retries is None else retries
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA busy_timeout = {0:d}".format(int(self.busy_timeout * 1000)))
+        # in WAL mode the readers of the Plex server don't block our writes, in rollback journal mode
+        # every commit has to wait until they are done and blocks them while writing
+        self.journal_mode = self.connection.execute("PRAGMA journal_mode").fetchone()[0].lower()
+        # statistics, per kind of statement the count, total and longest time in seconds
+        self.statements = defaultdict(lambda: [0, 0.0, 0.0])
+        self.lock_wait = 0.0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def wal(self):
+        return self.journal_mode == "wal"
+
+    def execute(self, cursor, query, args=()):
+        """
+        Execute a statement and record its latency
+        :return: the cursor
+        """
+        start = time.perf_counter()
+        try:
+            return cursor.execute(query, args)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    def executemany(self, cursor, query, rows):
+        start = time.perf_counter()
+        try:
+            return cursor.executemany(query, rows)
+        finally:
+            self._record(query, time.perf_counter() - start)
+
+    def _record(self, query, elapsed):
+        counters = self.statements[query.split(None, 1)[0].upper()]
+        counters[0] += 1
+        counters[1] += elapsed
+        counters[2] = max(counters[2], elapsed)
+
+    def write(self, function):
+        """
+        Run a function in a write transaction, trying again while the database is locked
+        :param function: function(cursor) doing the writes, it may be called more than once
+        :return: the write result, with the return value of the function if it succeeded
+        """
+        # takes the write lock right away, waiting up to the busy timeout
+        return self._transaction(function, "BEGIN IMMEDIATE")
+
+    def read(self, function):
+        """
+        Run a function in a read transaction, which doesn't take the write lock, trying again while the
+        database is locked
+        :param function: function(cursor) doing the reads, it may be called more than once
+        :return: the result, with the return value of the function if it succeeded
+        """
+        return self._transaction(function, "BEGIN")
+
+    def _transaction(self, function, begin):
+        attempt = 0
+        while True:
+            attempt += 1
+            cursor = self.connection.cursor()
+            start = time.perf_counter()
+            try:
+                self.execute(cursor, begin)
+                self.lock_wait += time.perf_counter() - start
+                value = function(cursor)
+                self._commit(cursor)
+                return WriteResult(value, attempts=attempt)
+            except sqlite3.OperationalError as e:
+                if self.connection.in_transaction:
+                    cursor.execute("ROLLBACK")
+                if not is_locked(e):
+                    raise
+                self.lock_wait += time.perf_counter() - start
+                if attempt > self.retries:
+                    self.failed += 1
+                    logger.warning("Plex DB still locked after {attempts} attempts: {error}".format(
+                        attempts=attempt, error=e))
+                    return WriteResult(error=e, attempts=attempt)
+                self.retried += 1
+                delay = backoff(attempt)
+                self.lock_wait += delay
+                time.sleep(delay)
+            except Exception:
+                if self.connection.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+            finally:
+                cursor.close()
+
+    def _commit(self, cursor):
+        # in rollback journal mode the commit waits for the readers to release their shared locks. We
+        # already hold the write lock, so the commit alone is tried again instead of redoing the writes
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                self.execute(cursor, "COMMIT")
+                return
+            except sqlite3.OperationalError as e:
+                self.lock_wait += time.perf_counter() - start
+                attempt += 1
+                if self.wal or not is_locked(e) or attempt > self.retries:
+                    raise
+                self.retried += 1
+                delay = backoff(attempt)
+                self.lock_wait += delay
+                time.sleep(delay)
+
+    def stats(self):
+        """
+        Statement latencies and lock waits
+        :return: dict of statistics
+        """
+        return {
+            "journal_mode": self.journal_mode,
+            "statements": {kind: {"count": counters[0], "total": counters[1], "max": counters[2]}
+                           for kind, counters in self.statements.items()},
+            "lock_wait": self.lock_wait,
+            "retries": self.retried,
+            "failed": self.failed,
+        }
+
+    def close(self):
+        self.connection.close()
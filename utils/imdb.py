@@ -1,9 +1,36 @@
 import logging
 
-from imdbpie import Imdb
+import requests
+
+from utils import cache, limiter
 
 imdb = None
 logger = logging.getLogger("plex-imdb-updater")
+# errors to try again, imdbpie's own are added when the client is created
+retry_on = (requests.RequestException,)
+
+
+def request_kind(url, params):
+    # title pages are only requested to check whether a title exists, not worth caching
+    if url.startswith("https://www.imdb.com/title/"):
+        return None
+    return "ratings"
+
+
+def get_imdb():
+    """
+    Get the IMDB client, created on first use. imdbpie takes long to import, so it is only loaded
+    when IMDB is actually used.
+    :return: the IMDB client
+    """
+    global imdb, retry_on
+    if imdb is None:
+        from imdbpie import Imdb
+        from imdbpie.exceptions import ImdbAPIError
+        # imdbpie raises ImdbAPIError for any non-successful response, including rate limiting
+        retry_on = (requests.RequestException, ImdbAPIError)
+        imdb = Imdb(session=cache.CachedSession("imdb", request_kind))
+    return imdb
 
 
 def get_season_from_imdb(imdb_id, season):
@@ -11,12 +38,9 @@ def get_season_from_imdb(imdb_id, season):
     Getting season ratings from IMDB, rating each episodes individually
     :param imdb_id: the imdb_id of the show
     :param season: which season of the show to fetch ratings for
-    :return: a pair, episode number/rating
+    :return: a pair, episode number/rating and IMDB id. 'N/A' for episodes without rating
     """
-    global imdb
-    if imdb is None:
-        imdb = Imdb()
-    season = imdb.get_title_episodes_detailed(imdb_id, season=season)
+    season = limiter.call("imdb", get_imdb().get_title_episodes_detailed, imdb_id, season=season, retry_on=retry_on)
 
     # checking if there really is a rating and rating is not N/A
     if season is not None and "episodes" in season:
@@ -26,23 +50,18 @@ def get_season_from_imdb(imdb_id, season):
                 imdb_id = episode["id"].replace('/', '').replace('title', '')
             else:
                 imdb_id = None
-            episodes[episode["episodeNumber"]] = {"rating": episode["rating"], "imdb_id": imdb_id}
+            if episode.get("rating") is None:
+                episodes[episode["episodeNumber"]] = 'N/A'
+            else:
+                episodes[episode["episodeNumber"]] = {"rating": episode["rating"], "imdb_id": imdb_id}
         return episodes
     else:
         return None
 
 
 def title_exists(imdb_id):
-    global imdb
-    if imdb is None:
-        imdb = Imdb()
-
-    return imdb.title_exists(imdb_id)
+    return limiter.call("imdb", get_imdb().title_exists, imdb_id, retry_on=retry_on)
 
 
 def get_title_ratings(imdb_id):
-    global imdb
-    if imdb is None:
-        imdb=Imdb()
-
-    return imdb.get_title_ratings(imdb_id)
+    return limiter.call("imdb", get_imdb().get_title_ratings, imdb_id, retry_on=retry_on)
@@ -0,0 +1,164 @@
+import logging
+from datetime import datetime, timedelta
+
+from models import LibraryWatermark, Movie, Show
+from utils import plexdb, stream
+
+logger = logging.getLogger("plex-imdb-updater")
+# ids per request when fetching items by id, keeping the url short
+METADATA_CHUNK_SIZE = 100
+
+
+def get_watermark(library_name):
+    """
+    Get the latest added and updated time seen in a library on the previous run
+    :param library_name: the name of the library
+    :return: pair of added and updated time, None if the library was never enumerated
+    """
+    watermark = LibraryWatermark.get_or_none(LibraryWatermark.library == library_name)
+    if watermark is None:
+        return None
+    return watermark.added_at, watermark.updated_at
+
+
+def save_watermark(library_name, watermark):
+    """
+    Store the latest added and updated time seen in a library
+    :param library_name: the name of the library
+    :param watermark: pair of added and updated time
+    """
+    LibraryWatermark.replace(library=library_name, added_at=watermark[0], updated_at=watermark[1],
+                             last_run=datetime.now()).execute()
+
+
+def advance(watermark, items, failed):
+    """
+    Compute the watermark after processing the given items. Items that failed, for example because
+    a provider could not be reached, hold back the watermark so they are enumerated again.
+    :param watermark: pair of added and updated time of the previous run, None if there is none
+    :param items: the enumerated items
+    :param failed: the items that failed
+    :return: pair of added and updated time
+    """
+    new_watermark = []
+    for position, attribute in enumerate(("addedAt", "updatedAt")):
+        previous = watermark[position] if watermark is not None else datetime.fromtimestamp(0)
+        seen = [getattr(item, attribute) for item in items if getattr(item, attribute) is not None]
+        value = max(seen + [previous])
+        held_back = [getattr(item, attribute) for item in failed if getattr(item, attribute) is not None]
+        if held_back:
+            value = max(min(held_back + [value]) - timedelta(seconds=1), previous)
+        new_watermark.append(value)
+    return tuple(new_watermark)
+
+
+class Latest(object):
+    """
+    The latest added and updated time of the items passing by, so the watermark can be advanced
+    without keeping the items. Passed to advance in place of the items.
+    """
+
+    def __init__(self):
+        self.addedAt = None
+        self.updatedAt = None
+
+    def track(self, items):
+        """
+        Pass the items through, keeping the latest times
+        :param items: iterable of items
+        :return: generator of the same items
+        """
+        for item in items:
+            if item.addedAt is not None and (self.addedAt is None or item.addedAt > self.addedAt):
+                self.addedAt = item.addedAt
+            if item.updatedAt is not None and (self.updatedAt is None or item.updatedAt > self.updatedAt):
+                self.updatedAt = item.updatedAt
+            yield item
+
+
+def changed_items(library, watermark):
+    """
+    Get the movies or shows added or updated since the watermark, including shows with new episodes
+    :param library: the library section, from the Plex API or the Plex DB
+    :param watermark: pair of added and updated time
+    :return: list of items
+    """
+    if isinstance(library, plexdb.Section):
+        return library.changed(*watermark)
+
+    key = "/library/sections/{key}/all".format(key=library.key)
+    # Plex filters on greater than, one second earlier includes items with the exact same time
+    items = library.fetchItems("{key}?addedAt>>={time}".format(key=key, time=plexdb.to_timestamp(watermark[0]) - 1))
+    items += library.fetchItems("{key}?updatedAt>>={time}".format(key=key,
+                                                                  time=plexdb.to_timestamp(watermark[1]) - 1))
+    items = list({str(item.ratingKey): item for item in items}.values())
+    if library.type == "show":
+        episodes = library.fetchItems("{key}?type=4&addedAt>>={time}".format(
+            key=key, time=plexdb.to_timestamp(watermark[0]) - 1))
+        seen = {str(item.ratingKey) for item in items}
+        shows = {str(episode.grandparentRatingKey) for episode in episodes} - seen
+        items += fetch_items(library, shows)
+    return items
+
+
+def fetch_items(library, plex_ids):
+    """
+    Get the movies or shows of a library with the given ids
+    :param library: the library section, from the Plex API or the Plex DB
+    :param plex_ids: the ids of the items
+    :return: list of items, leaving out ids that are not in this library
+    """
+    if isinstance(library, plexdb.Section):
+        return library.items(plex_ids)
+    return [item for item in fetch_metadata(library, plex_ids) if in_library(library, item)]
+
+
+def fetch_metadata(library, plex_ids):
+    """
+    Get items of the Plex server by id through the Plex API, many ids per request
+    :param library: a library section of the server
+    :param plex_ids: the ids of the items
+    :return: list of items of any library and type, leaving out ids that don't exist
+    """
+    from plexapi.exceptions import NotFound
+    items = []
+    plex_ids = [str(int(plex_id)) for plex_id in plex_ids]
+    for start in range(0, len(plex_ids), METADATA_CHUNK_SIZE):
+        try:
+            chunk = plex_ids[start:start + METADATA_CHUNK_SIZE]
+            items.extend(library.fetchItems("/library/metadata/" + ",".join(chunk)))
+        except NotFound:
+            # none of the ids of the chunk exist
+            continue
+    return items
+
+
+def in_library(library, item):
+    """
+    Whether an item fetched by id is a movie or show of the given library, not an episode or an item of another library
+    """
+    return str(item.librarySectionID) == str(library.key) and item.TYPE == library.type
+
+
+def enumerate_library(library, index, watermark_name=None):
+    """
+    Get the items of a library to process in incremental mode: the items added or updated since the
+    previous run, and the items planned to be refreshed in this run
+    :param library: the library section, from the Plex API or the Plex DB
+    :param index: the index of the local DB
+    :param watermark_name: the name the watermark is stored under, defaults to the name of the library
+    :return: pair of the items and the watermark of the previous run
+    """
+    watermark = get_watermark(watermark_name or library.title)
+    if watermark is None:
+        logger.info("No previous run of the '{library}' library, enumerating all items".format(library=library.title))
+        return stream.stream_library(library), None
+
+    items = changed_items(library, watermark)
+    seen = {str(item.ratingKey) for item in items}
+    due = [plex_id for plex_id in index.planned_ids(Movie if library.type == "movie" else Show)
+           if str(plex_id) not in seen]
+    due_items = fetch_items(library, due)
+    logger.info("Found {changed} new or changed and {due} due items in the '{library}' library".format(
+        changed=len(items), due=len(due_items), library=library.title))
+    return items + due_items, watermark
@@ -0,0 +1,448 @@
+import csv
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+from operator import itemgetter
+
+from peewee import chunked
+
+from models import database, Movie, Show, Episode, IdMapping, TconstField, EpochField
+from utils.dataset import tconst_to_int
+from utils.ratings import to_float
+
+# keep the number of SQL variables below the limit of older SQLite versions
+MAX_VARIABLES = 999
+# sources of the id mappings
+TVDB = "tvdb"
+TMDB_MOVIE = "tmdb_movie"
+TMDB_SHOW = "tmdb_show"
+logger = logging.getLogger("plex-imdb-updater")
+
+
+def as_rating(value):
+    """
+    A rating as the local DB stores it. OMDB returns ratings as text, kept as is they would never equal
+    the rating in Plex
+    :param value: the rating, as text or number
+    :return: the rating as float, None if it is missing or not a number
+    """
+    rating = to_float(value)
+    return None if rating != rating else rating
+
+
+class Record(object):
+    """
+    Lightweight in-memory copy of a row of the local DB
+    """
+    __slots__ = ()
+    model = None
+    fields = ()
+
+    def row(self):
+        return tuple(getattr(self, field) for field in self.fields)
+
+
+class PackedValue(object):
+    """
+    Field of a record holding an IMDB id or a date as the local DB packs it, converted when it is first read.
+    Most records of a run are only checked for being due, converting every value while loading took longer
+    than reading the rows.
+    """
+
+    def __init__(self, column, slot):
+        self.column = column
+        self.slot = slot
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        value = self.slot.__get__(record, owner)
+        if isinstance(value, self.column.stored_types):
+            value = self.column.python_value(value)
+            self.slot.__set__(record, value)
+        return value
+
+    def __set__(self, record, value):
+        self.slot.__set__(record, value)
+
+
+def record_init(slots):
+    """
+    Create the __init__ of a record class, assigning every value to its slot directly like the classes of
+    namedtuple do. Loading the local DB creates a record per row, a loop over the fields took most of the time.
+    :param slots: the names of the slots, in the order of the values
+    :return: the __init__ function
+    """
+    source = "def __init__(self, {arguments}):\n{assignments}".format(
+        arguments=", ".join("{0}=None".format(slot) for slot in slots),
+        assignments="".join("    self.{0} = {0}\n".format(slot) for slot in slots))
+    namespace = {}
+    exec(source, namespace)
+    return namespace["__init__"]
+
+
+def record_type(model):
+    """
+    Create a record class holding the fields of a model
+    :param model: the peewee model
+    :return: the record class
+    """
+    fields = tuple(model._meta.sorted_field_names)
+    packed = [field for field in fields if isinstance(model._meta.fields[field], (TconstField, EpochField))]
+    slots = tuple("_" + field if field in packed else field for field in fields)
+    record_class = type(model.__name__ + "Record", (Record,),
+                        {"__slots__": slots, "model": model, "fields": fields, "__init__": record_init(slots)})
+    for field in packed:
+        setattr(record_class, field, PackedValue(model._meta.fields[field], record_class.__dict__["_" + field]))
+    return record_class
+
+
+RECORD_TYPES = {model: record_type(model) for model in (Movie, Show, Episode)}
+
+
+class LocalIndex(object):
+    """
+    All movies, shows and episodes of the local DB, loaded once per run. Every freshness check and
+    ID resolution is answered from memory, changes are written back in bulk by flush. Runs updating
+    only a few items load just those items and their episodes instead.
+    """
+
+    def __init__(self):
+        self.records = {model: {} for model in RECORD_TYPES}
+        self.episodes_by_show = defaultdict(list)
+        self.dirty = {model: {} for model in RECORD_TYPES}
+        # movies and shows selected to be refreshed in this run, as dicts of plex id and due time, most overdue first
+        self.planned = {}
+        # plex ids of the movies and shows loaded by load_items, None once all rows are loaded
+        self.loaded = set()
+
+    def load(self):
+        """
+        Load all rows of the local DB
+        :return: the index itself
+        """
+        for model in RECORD_TYPES:
+            self._load_rows(model.select())
+        self.loaded = None
+        logger.debug("Loaded {movies} movies, {shows} shows and {episodes} episodes from the local DB".format(
+            movies=len(self.records[Movie]), shows=len(self.records[Show]), episodes=len(self.records[Episode])))
+        return self
+
+    def load_items(self, plex_ids):
+        """
+        Load only the given movies and shows and the episodes of the shows. Items loaded before are
+        skipped, so their changes are kept, and an index with all rows loaded is left as it is.
+        :param plex_ids: the plex ids of the movies and shows
+        :return: the number of newly loaded movies and shows
+        """
+        if self.loaded is None:
+            return 0
+        plex_ids = [plex_id for plex_id in dict.fromkeys(int(plex_id) for plex_id in plex_ids)
+                    if plex_id not in self.loaded]
+        count = len(self.records[Movie]) + len(self.records[Show])
+        for chunk in chunked(plex_ids, MAX_VARIABLES):
+            self._load_rows(Movie.select().where(Movie.plex_id.in_(chunk)))
+            self._load_rows(Show.select().where(Show.plex_id.in_(chunk)))
+            self._load_rows(Episode.select().where(Episode.parent_plex_id.in_(chunk)))
+        self.loaded.update(plex_ids)
+        return len(self.records[Movie]) + len(self.records[Show]) - count
+
+    def _load_rows(self, query):
+        model = query.model
+        record_class = RECORD_TYPES[model]
+        columns = [model._meta.fields[field] for field in record_class.fields]
+        # the values are kept as they come out of SQLite, the records convert the packed IMDB ids and dates
+        records = [record_class(*values) for values in database.execute(query.select(*columns))]
+        self.records[model].update((record.plex_id, record) for record in records)
+        if model is Episode:
+            for record in records:
+                self.episodes_by_show[record.parent_plex_id].append(record)
+
+    def _add(self, record):
+        self.records[record.model][record.plex_id] = record
+        if record.model is Episode:
+            self.episodes_by_show[record.parent_plex_id].append(record)
+
+    def get(self, model, plex_id):
+        """
+        Get the record of an item
+        :param model: the model of the item
+        :param plex_id: the plex id of the item
+        :return: the record, None if the item is not in the local DB
+        """
+        return self.records[model].get(int(plex_id))
+
+    def show_episodes(self, plex_id):
+        """
+        Get the records of all episodes of a show
+        :param plex_id: the plex id of the show
+        :return: list of episode records
+        """
+        return self.episodes_by_show.get(int(plex_id), [])
+
+    def due(self, now=None, budget=None, owns=None):
+        """
+        Get the movies and shows of which the rating is due for a refresh, most overdue first. A show
+        is due as soon as the show itself or one of its episodes is due.
+        :param now: the current time, defaults to now
+        :param budget: the maximum number of items, None for no limit
+        :param owns: function(plex_id) selecting the items of this shard, None for all items
+        :return: list of due time, model and plex id tuples
+        """
+        now = now or datetime.now()
+        due = [(record.next_refresh or record.last_update, Movie, plex_id)
+               for plex_id, record in self.records[Movie].items()]
+        for plex_id, record in self.records[Show].items():
+            due_time = record.next_refresh or record.last_update
+            for episode in self.episodes_by_show.get(plex_id, []):
+                due_time = min(due_time, episode.next_refresh or episode.last_update)
+            due.append((due_time, Show, plex_id))
+        due = [item for item in due if item[0] <= now and (owns is None or owns(item[2]))]
+        if budget:
+            return heapq.nsmallest(budget, due, key=itemgetter(0, 2))
+        return sorted(due, key=itemgetter(0, 2))
+
+    def plan(self, now=None, budget=None, owns=None):
+        """
+        Select the movies and shows to refresh in this run
+        :param now: the current time, defaults to now
+        :param budget: the maximum number of items, None for no limit
+        :param owns: function(plex_id) selecting the items of this shard, None for all items
+        :return: the number of selected items
+        """
+        due = self.due(now, budget, owns)
+        self.planned = {Movie: {}, Show: {}}
+        for due_time, model, plex_id in due:
+            self.planned[model][plex_id] = due_time
+        return len(due)
+
+    def is_planned(self, model, plex_id):
+        """
+        Whether an item is selected to be refreshed in this run
+        :param model: the model of the item, Movie or Show
+        :param plex_id: the plex id of the item
+        :return: True if it is selected, False if not
+        """
+        return int(plex_id) in self.planned.get(model, ())
+
+    def planned_ids(self, model):
+        """
+        Get the items selected to be refreshed in this run
+        :param model: the model of the items, Movie or Show
+        :return: list of plex ids, most overdue first
+        """
+        return list(self.planned.get(model, ()))
+
+    def unscheduled(self, owns=None):
+        """
+        Get the records without a next refresh time, stored before the refreshes were scheduled
+        :param owns: function(plex_id) selecting the movies and shows of this shard, None for all records.
+                     Episodes go with their show.
+        :return: list of records
+        """
+        return [record for model, records in self.records.items() for record in records.values()
+                if record.next_refresh is None and
+                (owns is None or owns(record.parent_plex_id if model is Episode else record.plex_id))]
+
+    def create(self, model, **values):
+        """
+        Create a new record, stored in the local DB on the next flush
+        :param model: the model of the item
+        :param values: the field values, missing fields get their default value
+        :return: the record
+        """
+        record_class = RECORD_TYPES[model]
+        row = []
+        for field in record_class.fields:
+            if field in values:
+                row.append(values[field])
+            else:
+                default = model._meta.fields[field].default
+                row.append(default() if callable(default) else default)
+        record = record_class(*row)
+        record.plex_id = int(record.plex_id)
+        record.rating = as_rating(record.rating)
+        record.imdb_rating = as_rating(record.imdb_rating)
+        if model is Episode:
+            record.parent_plex_id = int(record.parent_plex_id)
+        existing = self.records[model].get(record.plex_id)
+        if existing is not None and model is Episode:
+            self.episodes_by_show[existing.parent_plex_id].remove(existing)
+        self._add(record)
+        self.save(record)
+        return record
+
+    def update_rating(self, record, rating, next_refresh=None, imdb_rating=None, votes=None):
+        """
+        Update the rating of a record including setting last update timestamp
+        :param record: the record
+        :param rating: the rating to set for this
+        :param next_refresh: the time of the next refresh
+        :param imdb_rating: the IMDB rating as fetched, defaults to the rating
+        :param votes: the number of votes of the IMDB rating, None if not known
+        """
+        record.rating = as_rating(rating)
+        record.imdb_rating = record.rating if imdb_rating is None else as_rating(imdb_rating)
+        record.votes = votes
+        record.last_update = datetime.now()
+        record.next_refresh = next_refresh
+        self.save(record)
+
+    def save(self, record):
+        """
+        Mark a record as changed, stored in the local DB on the next flush
+        :param record: the changed record
+        """
+        self.dirty[record.model][record.plex_id] = record
+
+    def flush(self):
+        """
+        Write all changed records to the local DB
+        :return: the number of written records
+        """
+        written = 0
+        with database.atomic():
+            for model, records in self.dirty.items():
+                if not records:
+                    continue
+                fields = [model._meta.fields[field] for field in RECORD_TYPES[model].fields]
+                for chunk in chunked([record.row() for record in records.values()], MAX_VARIABLES // len(fields)):
+                    model.insert_many(chunk, fields=fields).on_conflict_replace().execute()
+                written += len(records)
+        self.dirty = {model: {} for model in RECORD_TYPES}
+        if written:
+            logger.debug("Written {count} items to the local DB".format(count=written))
+        return written
+
+
+class IdMappings(object):
+    """
+    TVDB and TMDb ids mapped to IMDB ids, loaded once per run. Consulted before looking up an id via
+    TMDb and filled by every successful lookup. Lookups run on the worker threads, so changes are
+    guarded by a lock and written back by flush from the main thread.
+    """
+
+    def __init__(self):
+        # source and external id, and a tuple of imdb_id, tmdb_id and manual
+        self.mappings = {}
+        self.dirty = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Load all mappings of the local DB
+        :return: the mappings itself
+        """
+        query = IdMapping.select(IdMapping.source, IdMapping.external_id, IdMapping.imdb_id, IdMapping.tmdb_id,
+                                 IdMapping.manual)
+        for source, external_id, imdb_id, tmdb_id, manual in query.tuples().iterator():
+            self.mappings[(source, external_id)] = (imdb_id, tmdb_id, manual)
+        logger.debug("Loaded {count} id mappings from the local DB".format(count=len(self.mappings)))
+        return self
+
+    def get(self, source, external_id):
+        """
+        Get the IMDB id of a TVDB or TMDb id
+        :param source: the source of the id, TVDB, TMDB_MOVIE or TMDB_SHOW
+        :param external_id: the id
+        :return: tuple of imdb_id and tmdb_id, None if not known
+        """
+        mapping = self.mappings.get((source, str(external_id)))
+        if mapping is None:
+            return None
+        return mapping[0], mapping[1]
+
+    def add(self, source, external_id, imdb_id, tmdb_id=None, manual=False):
+        """
+        Remember the IMDB id of a TVDB or TMDb id, stored in the local DB on the next flush.
+        Manual overrides are only replaced by other manual overrides.
+        :param source: the source of the id, TVDB, TMDB_MOVIE or TMDB_SHOW
+        :param external_id: the id
+        :param imdb_id: the IMDB id it maps to
+        :param tmdb_id: the TMDb id it maps to, if known
+        :param manual: whether this is a manual override
+        :return: True if the mapping changed, False if not
+        """
+        if tconst_to_int(imdb_id) is None:
+            # the local DB only stores IMDB title ids
+            logger.debug("Not mapping {source} id {id} to {imdb_id}, it is not an IMDB title id".format(
+                source=source, id=external_id, imdb_id=imdb_id))
+            return False
+        key = (source, str(external_id))
+        mapping = (imdb_id, int(tmdb_id) if tmdb_id else None, manual)
+        with self.lock:
+            existing = self.mappings.get(key)
+            if existing == mapping or (existing is not None and existing[2] and not manual):
+                return False
+            self.mappings[key] = mapping
+            self.dirty[key] = mapping
+        return True
+
+    def load_overrides(self, path):
+        """
+        Load the manual overrides, lines of tvdb_id=imdb_id
+        :param path: the overrides file
+        :return: the number of overrides
+        """
+        count = 0
+        try:
+            with open(path) as overrides:
+                for line in overrides:
+                    tvdb_id, _, imdb_id = line.partition("=")
+                    if tvdb_id.strip() and imdb_id.strip():
+                        if tconst_to_int(imdb_id.strip()) is None:
+                            logger.warning("Skipping the override of {tvdb_id}, {imdb_id} is not an IMDB title id"
+                                           .format(tvdb_id=tvdb_id.strip(), imdb_id=imdb_id.strip()))
+                            continue
+                        self.add(TVDB, tvdb_id.strip(), imdb_id.strip(), manual=True)
+                        count += 1
+        except IOError:
+            logger.debug("No overrides found at {path}".format(path=path))
+        return count
+
+    def seed(self, path):
+        """
+        Import mappings in bulk from a CSV or TSV export, with an imdb_id column and a tvdb_id and/or
+        tmdb_id column. The optional type column tells whether a tmdb_id is a movie or a show, rows
+        with a tvdb_id default to show and other rows to movie.
+        :param path: the CSV file, or TSV file if it ends with .tsv
+        :return: the number of changed mappings
+        """
+        changed = 0
+        with open(path, newline="") as export:
+            reader = csv.DictReader(export, delimiter="\t" if path.endswith(".tsv") else ",")
+            for row in reader:
+                imdb_id = (row.get("imdb_id") or "").strip()
+                tvdb_id = (row.get("tvdb_id") or "").strip()
+                tmdb_id = (row.get("tmdb_id") or "").strip()
+                if not imdb_id.startswith("tt"):
+                    continue
+                if tvdb_id:
+                    changed += self.add(TVDB, tvdb_id, imdb_id, tmdb_id)
+                if tmdb_id:
+                    media_type = (row.get("type") or ("show" if tvdb_id else "movie")).strip()
+                    changed += self.add(TMDB_MOVIE if media_type == "movie" else TMDB_SHOW, tmdb_id, imdb_id, tmdb_id)
+        logger.info("Imported {count} id mappings from {path}".format(count=changed, path=path))
+        return changed
+
+    def flush(self):
+        """
+        Write all changed mappings to the local DB
+        :return: the number of written mappings
+        """
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = {}
+        if not dirty:
+            return 0
+        now = datetime.now()
+        rows = [key + mapping + (now,) for key, mapping in dirty.items()]
+        fields = [IdMapping.source, IdMapping.external_id, IdMapping.imdb_id, IdMapping.tmdb_id, IdMapping.manual,
+                  IdMapping.last_update]
+        with database.atomic():
+            for chunk in chunked(rows, MAX_VARIABLES // len(fields)):
+                IdMapping.insert_many(chunk, fields=fields).on_conflict_replace().execute()
+        logger.debug("Written {count} id mappings to the local DB".format(count=len(rows)))
+        return len(rows)
@@ -0,0 +1,197 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from utils import config, metrics
+
+limiters = {}
+limiters_lock = threading.Lock()
+# the part of the provider rate limits this process may use, when the work is split over several
+share = 1.0
+logger = logging.getLogger("plex-imdb-updater")
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter. Tokens are refilled continuously at the configured rate, up to
+    the burst size, so requests are only delayed when the provider's quota is actually used up.
+    Safe to share between threads and asyncio tasks, the lock is never held while waiting.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param rate: the number of requests per second
+        :param burst: the number of requests that may be done at once
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+        # statistics
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.throttled = 0.0
+
+    def _reserve(self):
+        """
+        Take a token if available
+        :return: the number of seconds to wait before trying again, 0 if a token was taken
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.requests += 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def _add_throttled(self, seconds):
+        with self.lock:
+            self.throttled += seconds
+
+    def acquire(self):
+        """
+        Wait until a request may be done
+        """
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            self._add_throttled(wait)
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        Wait until a request may be done, without blocking the event loop
+        """
+        import asyncio
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            self._add_throttled(wait)
+            await asyncio.sleep(wait)
+
+    def block(self, seconds):
+        """
+        Block all requests for a while, after the provider told us we're going too fast
+        :param seconds: the number of seconds to block
+        """
+        with self.lock:
+            self.rate_limited += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+def get_limiter(provider):
+    """
+    Get the rate limiter of a provider, created on first use from config.RATE_LIMITS
+    :param provider: the name of the provider
+    :return: the token bucket of the provider
+    """
+    with limiters_lock:
+        if provider not in limiters:
+            rate, burst = config.RATE_LIMITS.get(provider, (10, 10))
+            limiters[provider] = TokenBucket(rate * share, max(1, burst * share))
+        return limiters[provider]
+
+
+def set_share(part):
+    """
+    Limit this process to a part of the provider rate limits, so the processes of a sharded run
+    together stay within the limits
+    :param part: the part of the rate limits, 1 for all of it
+    """
+    global share
+    with limiters_lock:
+        share = float(part)
+        limiters.clear()
+
+
+def backoff(attempt):
+    """
+    Jittered exponential backoff
+    :param attempt: the number of the retry, starting at 1
+    :return: the number of seconds to wait
+    """
+    return random.uniform(0, min(config.RETRY_BACKOFF_MAX, config.RETRY_BACKOFF * 2 ** (attempt - 1)))
+
+
+def retry_after(response):
+    """
+    Get the delay a provider asked for in a 429 response
+    :param response: the response, may be None
+    :return: the delay in seconds, None if the response is not a 429
+    """
+    if response is None or getattr(response, "status_code", None) != 429:
+        return None
+    try:
+        return max(0.0, float(response.headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return backoff(1)
+
+
+def call(provider, fn, *args, retry_on=(requests.RequestException,), **kwargs):
+    """
+    Call a function doing a request to a provider, within the rate limit of that provider.
+    429 responses and errors are retried with backoff, up to config.MAX_RETRIES times
+    :param provider: the name of the provider
+    :param fn: the function doing the request
+    :param retry_on: the exceptions on which to retry
+    :return: the result of the function. Raises the last error if all attempts failed
+    """
+    bucket = get_limiter(provider)
+    attempt = 0
+    while True:
+        bucket.acquire()
+        error = None
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            metrics.observe("request_seconds", time.perf_counter() - start, provider=provider)
+            delay = retry_after(result)
+            if delay is None:
+                return result
+        except retry_on as e:
+            metrics.observe("request_seconds", time.perf_counter() - start, provider=provider)
+            metrics.inc("request_errors", provider=provider)
+            error = e
+            delay = retry_after(getattr(e, "response", None))
+
+        attempt += 1
+        if attempt > config.MAX_RETRIES:
+            if error is not None:
+                raise error
+            return result
+        with bucket.lock:
+            bucket.retries += 1
+        if delay is not None:
+            logger.debug("Rate limited by {provider}, waiting {delay:.1f} seconds".format(
+                provider=provider, delay=delay))
+            bucket.block(delay)
+        else:
+            delay = backoff(attempt)
+            logger.debug("Error calling {provider}: {error}. Trying again in {delay:.1f} seconds".format(
+                provider=provider, error=error, delay=delay))
+            time.sleep(delay)
+
+
+def stats():
+    """
+    Statistics of all rate limiters
+    :return: dict of provider and its counters
+    """
+    with limiters_lock:
+        return {provider: {"requests": bucket.requests, "retries": bucket.retries,
+                           "rate_limited": bucket.rate_limited, "throttled": bucket.throttled}
+                for provider, bucket in limiters.items()}
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+
+# upper bounds of the histogram buckets in seconds, from a cached response to a rate limit wait
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_PREFIX = "plex_imdb_updater_"
+
+
+class Histogram(object):
+    """
+    Distribution of observed durations over fixed buckets, cheap enough to update for every request
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in
+        :param q: the quantile, between 0 and 1
+        :return: the estimated value, None if nothing was observed
+        """
+        if not self.count:
+            return None
+        cumulative = 0
+        for position, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= q * self.count:
+                return BUCKETS[position] if position < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+        }
+
+
+class Metrics(object):
+    """
+    Counters, gauges and latency histograms of a run, keyed by name and labels. Updated from the
+    worker threads and the writer, so every update takes a short lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = datetime.now()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the duration of a block of code
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def summary(self):
+        """
+        Machine readable summary of the run
+        :return: dict of the run times and lists of counters, gauges and timers with their labels
+        """
+        with self.lock:
+            return {
+                "started": self.started.isoformat(),
+                "finished": datetime.now().isoformat(),
+                "duration": (datetime.now() - self.started).total_seconds(),
+                "counters": [dict(name=name, labels=dict(labels), value=value)
+                             for (name, labels), value in sorted(self.counters.items())],
+                "gauges": [dict(name=name, labels=dict(labels), value=value)
+                           for (name, labels), value in sorted(self.gauges.items())],
+                "timers": [dict(name=name, labels=dict(labels), **histogram.summary())
+                           for (name, labels), histogram in sorted(self.histograms.items())],
+            }
+
+    def prometheus(self, labels=None):
+        """
+        Format the metrics for the textfile collector of the Prometheus node exporter
+        :param labels: dict of labels added to every metric, like the shard of the run
+        :return: the metrics in the Prometheus text format
+        """
+        extra = tuple(sorted((labels or {}).items()))
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append("# TYPE {prefix}{name} {kind}".format(prefix=PROMETHEUS_PREFIX, name=name, kind=kind))
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name + "_total", "counter")
+                lines.append(format_sample(name + "_total", labels + extra, value))
+            for (name, labels), value in sorted(self.gauges.items()):
+                declare(name, "gauge")
+                lines.append(format_sample(name, labels + extra, value))
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                declare(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(format_sample(name + "_bucket", labels + extra + (("le", str(bound)),), cumulative))
+                lines.append(format_sample(name + "_sum", labels + extra, histogram.sum))
+                lines.append(format_sample(name + "_count", labels + extra, histogram.count))
+            declare("last_run_timestamp_seconds", "gauge")
+            lines.append(format_sample("last_run_timestamp_seconds", extra, time.time()))
+        return "\n".join(lines) + "\n"
+
+
+def format_sample(name, labels, value):
+    if labels:
+        label_text = ",".join('{0}="{1}"'.format(key, str(label).replace("\\", "\\\\").replace('"', '\\"'))
+                              for key, label in labels)
+        return "{prefix}{name}{{{labels}}} {value}".format(prefix=PROMETHEUS_PREFIX, name=name, labels=label_text,
+                                                           value=value)
+    return "{prefix}{name} {value}".format(prefix=PROMETHEUS_PREFIX, name=name, value=value)
+
+
+registry = Metrics()
+
+
+def reset():
+    """
+    Start collecting the metrics of a new run
+    """
+    global registry
+    registry = Metrics()
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def gauge(name, value, **labels):
+    registry.gauge(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    registry.observe(name, seconds, **labels)
+
+
+def timer(name, **labels):
+    return registry.timer(name, **labels)
+
+
+def write_file(path, text):
+    # the node exporter may read the file at any time, so replace it in one go
+    temporary = path + ".tmp"
+    with open(temporary, "w") as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+
+def export(json_file=None, prometheus_file=None, labels=None):
+    """
+    Write the metrics of the run
+    :param json_file: the file to write the JSON summary to, None to skip it
+    :param prometheus_file: the file to write the Prometheus metrics to, None to skip it
+    :param labels: dict of labels added to every metric
+    :return: the summary
+    """
+    summary = registry.summary()
+    summary["labels"] = labels or {}
+    if json_file:
+        write_file(json_file, json.dumps(summary, indent=2))
+    if prometheus_file:
+        write_file(prometheus_file, registry.prometheus(labels))
+    return summary
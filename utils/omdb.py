@@ -1,42 +1,41 @@
 import logging
-import time
 
-import omdb
+import requests
 
-from utils import config
+from utils import cache, config, limiter
 
-OMDB_REQUEST_COUNT = 0  # DO NOT CHANGE
+client = None
 logger = logging.getLogger("plex-imdb-updater")
 
 
-def get_imdb_rating_from_omdb(imdb_id, pbar):
+def get_client():
+    """
+    Get the OMDB client, created on first use with the configured API key and endpoint
+    :return: the OMDB client
+    """
+    global client
+    if client is None:
+        import omdb
+        client = omdb.OMDBClient(apikey=config.OMDB_API_KEY)
+        client.url = config.OMDB_API_URL
+        client.session = cache.CachedSession("omdb", "ratings")
+    return client
+
+
+def get_imdb_rating_from_omdb(imdb_id):
     """
     Getting IMDB rating for imdb_id from OMDB
     :param imdb_id: the imdb_id of the rating
     :return: the whole object from OMDB including the rating
     """
-    global OMDB_REQUEST_COUNT
-
     if not config.OMDB_API_KEY:
         return None
-    else:
-        omdb.set_default("apikey", config.OMDB_API_KEY)
-
-    # Wait 10 seconds for the TMDb rate limit
-    if OMDB_REQUEST_COUNT >= 30:
-        pbar.postfix[1] = "Waiting 10 seconds OMDb rate limit"
-        time.sleep(10)
-        OMDB_REQUEST_COUNT = 0
 
     try:
-        media = omdb.imdbid(imdb_id, timeout=5)
-    except:
-        logger.debug("Error getting rating from OMDB. Trying again in few seconds")
-        time.sleep(10)
-        OMDB_REQUEST_COUNT = 0
-        return get_imdb_rating_from_omdb(imdb_id)
-
-    OMDB_REQUEST_COUNT += 1
+        media = limiter.call("omdb", get_client().imdbid, imdb_id)
+    except requests.RequestException as e:
+        logger.debug("Error getting rating from OMDB: {}".format(e))
+        return None
 
     # checking if there really is a rating and rating is not N/A
     if media is not None and 'imdb_rating' in media and media["imdb_rating"] != str('N/A'):
@@ -45,41 +44,34 @@ def get_imdb_rating_from_omdb(imdb_id, pbar):
         return None
 
 
-def get_season_from_omdb(imdb_id, season, pbar):
+def get_season_from_omdb(imdb_id, season):
     """
     Getting specific season for IMDB id, including the ratings for each episode
     :param imdb_id: the IMDB item for which the items should be fetched
     :param season: the season for which to fetch episodes
-    :return: a pair episode/rating
+    :return: a pair, episode number/rating and IMDB id. 'N/A' for episodes without rating
     """
-    global OMDB_REQUEST_COUNT
-
     if not config.OMDB_API_KEY:
         return None
-    else:
-        omdb.set_default("apikey", config.OMDB_API_KEY)
-
-    # Wait 10 seconds for the TMDb rate limit
-    if OMDB_REQUEST_COUNT >= 30:
-        pbar.postfix[1] = "Waiting 10 seconds OMDb rate limit"
-        time.sleep(10)
-        OMDB_REQUEST_COUNT = 0
 
     try:
-        season = omdb.imdbid(imdb_id, season=season)
-    except:
-        logger.debug("Error getting rating from OMDB. Trying again in few seconds")
-        time.sleep(10)
-        OMDB_REQUEST_COUNT = 0
-        return get_season_from_omdb(imdb_id, season)
-
-    OMDB_REQUEST_COUNT += 1
+        season = limiter.call("omdb", get_client().imdbid, imdb_id, season=season)
+    except requests.RequestException as e:
+        logger.debug("Error getting season from OMDB: {}".format(e))
+        return None
 
     # checking if there really is a rating and rating is not N/A
     if season is not None and "episodes" in season:
         episodes = {}
         for episode in season["episodes"]:
-            episodes[episode["episode"]] = episode["imdb_rating"]
+            try:
+                number = int(episode["episode"])
+            except (KeyError, ValueError):
+                continue
+            if episode.get("imdb_rating", "N/A") == "N/A":
+                episodes[number] = 'N/A'
+            else:
+                episodes[number] = {"rating": float(episode["imdb_rating"]), "imdb_id": episode.get("imdb_id")}
         return episodes
     else:
         return None
@@ -0,0 +1,138 @@
+import logging
+import queue
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import config, metrics
+
+logger = logging.getLogger("plex-imdb-updater")
+
+# returned by a stage to hand the job over to the next stage on another provider pool
+Next = namedtuple("Next", ["provider", "fn", "args"])
+
+
+def next_stage(provider, fn, *args):
+    """
+    Continue a job on the pool of another provider
+    :param provider: the provider pool on which to run the next stage
+    :param fn: the function to run
+    :param args: the arguments for the function
+    :return: the next stage, to be returned by the current stage
+    """
+    return Next(provider, fn, args)
+
+
+def timed_stage(stage):
+    """
+    Run a stage, recording its duration on the pool of its provider
+    """
+    start = time.perf_counter()
+    try:
+        return stage.fn(*stage.args)
+    finally:
+        metrics.observe("stage_seconds", time.perf_counter() - start, stage=stage.provider)
+
+
+class Pipeline(object):
+    """
+    Staged fetch pipeline. Every provider gets its own bounded pool of workers, so a rate limit
+    wait or a slow response on one provider never blocks the others. Finished jobs are handed back
+    to a single writer (the thread calling submit/drain), which owns all database connections.
+    """
+
+    def __init__(self, concurrency=None, max_pending=None):
+        """
+        :param concurrency: dict of provider name and number of workers
+        :param max_pending: maximum number of jobs in flight before submit waits for the writer
+        """
+        if concurrency is None:
+            concurrency = config.CONCURRENCY
+        self.executors = {}
+        for provider, workers in concurrency.items():
+            self.executors[provider] = ThreadPoolExecutor(max_workers=max(1, workers),
+                                                          thread_name_prefix=provider)
+        self.max_pending = max_pending or 4 * sum(concurrency.values())
+        self.pending = 0
+        self.draining = False
+        self.results = queue.Queue()
+
+    def submit(self, handler, provider, fn, *args):
+        """
+        Run a job on the pool of a provider. The handler is called from the writer with the
+        result of the last stage of the job, or with the exception raised by any stage
+        :param handler: function(result, error) called in the writer thread
+        :param provider: the provider pool on which to run the first stage
+        :param fn: the function of the first stage
+        :param args: the arguments for the function
+        """
+        # keep the amount of work in flight bounded, the writer catches up in the meantime.
+        # jobs submitted from a handler are follow-ups of finished work and never wait
+        self.submit_stage(handler, Next(provider, fn, args))
+
+    def submit_stage(self, handler, stage):
+        """
+        Run a job starting at the given stage
+        :param handler: function(result, error) called in the writer thread
+        :param stage: the first stage, or the result directly if there is nothing to fetch
+        """
+        while self.pending >= self.max_pending and not self.draining:
+            self.drain(block=True)
+        self.pending += 1
+        if isinstance(stage, Next):
+            self._run(handler, stage)
+        else:
+            self.results.put((handler, stage, None))
+
+    def _run(self, handler, stage):
+        if stage.provider not in self.executors:
+            self.results.put((handler, None, KeyError("Unknown provider '{}'".format(stage.provider))))
+            return
+        future = self.executors[stage.provider].submit(timed_stage, stage)
+        future.add_done_callback(lambda f: self._done(handler, f))
+
+    def _done(self, handler, future):
+        error = future.exception()
+        if error is not None:
+            self.results.put((handler, None, error))
+            return
+        result = future.result()
+        if isinstance(result, Next):
+            self._run(handler, result)
+        else:
+            self.results.put((handler, result, None))
+
+    def drain(self, block=False):
+        """
+        Call the handlers of finished jobs in the current thread
+        :param block: wait for at least one job to finish if none are ready
+        :return: the number of handled jobs
+        """
+        handled = 0
+        while self.pending > 0:
+            try:
+                handler, result, error = self.results.get(block=block and handled == 0)
+            except queue.Empty:
+                break
+            self.pending -= 1
+            handled += 1
+            if error is not None:
+                logger.error("Error in pipeline job: {}".format(error))
+            self.draining = True
+            try:
+                handler(result, error)
+            finally:
+                self.draining = False
+        return handled
+
+    def join(self):
+        """
+        Wait for all jobs in flight and handle their results
+        """
+        while self.pending > 0:
+            self.drain(block=True)
+
+    def shutdown(self):
+        self.join()
+        for executor in self.executors.values():
+            executor.shutdown()
@@ -0,0 +1,181 @@
+import logging
+import sqlite3
+from collections import namedtuple
+from datetime import datetime
+from urllib.request import pathname2url
+
+logger = logging.getLogger("plex-imdb-updater")
+
+# metadata_type and section_type values used by Plex
+MOVIE = 1
+SHOW = 2
+SEASON = 3
+EPISODE = 4
+TYPES = {MOVIE: "movie", SHOW: "show", SEASON: "season", EPISODE: "episode"}
+
+# lightweight stand-in for the plexapi objects, with the attributes the updater reads
+Item = namedtuple("Item", ["TYPE", "ratingKey", "title", "guid", "rating", "index",
+                           "originallyAvailableAt", "addedAt", "updatedAt"])
+# keep the number of SQL variables below the limit of older SQLite versions
+MAX_VARIABLES = 500
+ITEM_COLUMNS = 'metadata_type, id, title, guid, rating, "index", originally_available_at, added_at, updated_at'
+
+
+def connect(path):
+    """
+    Open the Plex DB read-only, for enumerating the libraries
+    :param path: the path of the Plex DB
+    :return: the connection, None if it could not be opened
+    """
+    try:
+        conn = sqlite3.connect("file:{path}?mode=ro".format(path=pathname2url(path)), uri=True)
+        conn.execute("SELECT 1 FROM metadata_items LIMIT 1")
+        return conn
+    except sqlite3.Error as e:
+        logger.warning("Could not read the Plex DB, falling back to the Plex API: {}".format(e))
+        return None
+
+
+def to_datetime(value):
+    """
+    Convert a date from the Plex DB, stored either as a timestamp or as text
+    :param value: the value from the Plex DB
+    :return: the datetime, None if not set
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def to_timestamp(value):
+    """
+    Convert a datetime to the timestamp stored in the Plex DB
+    """
+    return int(value.timestamp())
+
+
+def to_item(row):
+    return Item(TYPES.get(row[0]), row[1], row[2], row[3], row[4], row[5],
+                to_datetime(row[6]), to_datetime(row[7]), to_datetime(row[8]))
+
+
+class Section(object):
+    """
+    Library section read from the Plex DB, a stand-in for plexapi's LibrarySection
+    """
+
+    def __init__(self, conn, key, title, section_type):
+        self.conn = conn
+        self.key = key
+        self.title = title
+        self.type = TYPES.get(section_type)
+        self.section_type = section_type
+
+    def all(self):
+        """
+        Get all movies or shows of this section
+        :return: list of items
+        """
+        rows = self.conn.execute("SELECT {columns} FROM metadata_items WHERE library_section_id = ? "
+                                 "AND metadata_type = ? ORDER BY id".format(columns=ITEM_COLUMNS),
+                                 [self.key, self.section_type])
+        return [to_item(row) for row in rows]
+
+    def count(self):
+        """
+        Count the movies or shows of this section
+        :return: the number of items
+        """
+        return self.conn.execute("SELECT COUNT(*) FROM metadata_items WHERE library_section_id = ? AND metadata_type = ?",
+                                 [self.key, self.section_type]).fetchone()[0]
+
+    def page(self, after=0, size=MAX_VARIABLES):
+        """
+        Get a page of the movies or shows of this section, ordered by id. Paging by the last id instead
+        of an offset keeps every page a short index range scan, however far into the section.
+        :param after: the id of the last item of the previous page, 0 for the first page
+        :param size: the maximum number of items
+        :return: list of items
+        """
+        rows = self.conn.execute("SELECT {columns} FROM metadata_items WHERE library_section_id = ? "
+                                 "AND metadata_type = ? AND id > ? ORDER BY id LIMIT ?".format(columns=ITEM_COLUMNS),
+                                 [self.key, self.section_type, after, size])
+        return [to_item(row) for row in rows]
+
+    def changed(self, added_at, updated_at):
+        """
+        Get the movies or shows added or updated since the given times, including shows with new episodes
+        :param added_at: the latest added time seen before
+        :param updated_at: the latest updated time seen before
+        :return: list of items
+        """
+        query = ("SELECT {columns} FROM metadata_items WHERE library_section_id = ? AND metadata_type = ? "
+                 "AND (added_at >= ? OR updated_at >= ?").format(columns=ITEM_COLUMNS)
+        params = [self.key, self.section_type, to_timestamp(added_at), to_timestamp(updated_at)]
+        if self.section_type == SHOW:
+            query += (" OR id IN (SELECT s.parent_id FROM metadata_items e JOIN metadata_items s ON s.id = e.parent_id "
+                      "WHERE e.library_section_id = ? AND e.metadata_type = ? AND e.added_at >= ?)")
+            params += [self.key, EPISODE, to_timestamp(added_at)]
+        rows = self.conn.execute(query + ") ORDER BY id", params)
+        return [to_item(row) for row in rows]
+
+    def items(self, plex_ids):
+        """
+        Get the movies or shows of this section with the given ids
+        :param plex_ids: the ids of the items
+        :return: list of items, leaving out ids that are not in this section
+        """
+        items = []
+        plex_ids = list(plex_ids)
+        for start in range(0, len(plex_ids), MAX_VARIABLES):
+            chunk = plex_ids[start:start + MAX_VARIABLES]
+            rows = self.conn.execute("SELECT {columns} FROM metadata_items WHERE library_section_id = ? "
+                                     "AND metadata_type = ? AND id IN ({ids})".format(
+                                         columns=ITEM_COLUMNS, ids=",".join("?" * len(chunk))),
+                                     [self.key, self.section_type] + chunk)
+            items.extend(to_item(row) for row in rows)
+        return items
+
+
+def get_section(conn, name):
+    """
+    Get a movie or show library section by name
+    :param conn: the read-only connection to the Plex DB
+    :param name: the name of the library
+    :return: the section, None if there is no movie or show library with this name
+    """
+    row = conn.execute("SELECT id, name, section_type FROM library_sections WHERE name = ? AND section_type IN (?, ?)",
+                       [name, MOVIE, SHOW]).fetchone()
+    if row is None:
+        return None
+    return Section(conn, *row)
+
+
+def get_seasons(conn, show_id):
+    """
+    Get the seasons of a show with their episodes, skipping specials
+    :param conn: the read-only connection to the Plex DB
+    :param show_id: the id of the show
+    :return: list of season and episodes pairs
+    """
+    rows = conn.execute("SELECT {season_columns}, {episode_columns} FROM metadata_items s "
+                        "JOIN metadata_items e ON e.parent_id = s.id AND e.metadata_type = ? "
+                        "WHERE s.parent_id = ? AND s.metadata_type = ? AND s.\"index\" > 0 "
+                        "ORDER BY s.\"index\", e.\"index\"".format(
+                            season_columns=", ".join("s." + column.strip() for column in ITEM_COLUMNS.split(",")),
+                            episode_columns=", ".join("e." + column.strip() for column in ITEM_COLUMNS.split(","))),
+                        [EPISODE, show_id, SEASON])
+    seasons = []
+    for row in rows:
+        season = to_item(row[:9])
+        if not seasons or seasons[-1][0].ratingKey != season.ratingKey:
+            seasons.append((season, []))
+        seasons[-1][1].append(to_item(row[9:]))
+    return seasons
@@ -0,0 +1,280 @@
+import logging
+import math
+from array import array
+from itertools import repeat
+
+from peewee import fn
+
+from models import Movie, Show, Episode
+from utils import config
+
+NAN = float("nan")
+logger = logging.getLogger("plex-imdb-updater")
+
+
+def get_numpy():
+    """
+    :return: the numpy module, None if it is not installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def to_float(value):
+    """
+    :return: the value as float, NaN if it is missing or not a number, like the N/A of OMDB
+    """
+    try:
+        return float(value) if value is not None else NAN
+    except ValueError:
+        return NAN
+
+
+def round_half_up(value, decimals):
+    """
+    Round a rating half up, 7.25 becomes 7.3. Done the same way by the columns, so a rating rounds to the
+    same value whether it is fetched or recomputed.
+    """
+    factor = 10.0 ** decimals
+    return math.floor(value * factor + 0.5) / factor
+
+
+class RatingTable(object):
+    """
+    The stored ratings of all movies, shows or episodes as columns: the plex ids, the IMDB ratings as fetched,
+    their number of votes and the ratings in Plex. A rating policy is applied to whole columns at once, with
+    numpy when it is installed and otherwise with typed arrays of the standard library. Missing ratings and
+    numbers of votes are NaN.
+    """
+
+    def __init__(self, plex_ids, imdb_ratings, votes, ratings, np=None):
+        """
+        :param plex_ids: the plex ids
+        :param imdb_ratings: the IMDB ratings as fetched
+        :param votes: the numbers of votes of the IMDB ratings
+        :param ratings: the ratings in Plex
+        :param np: the numpy module, None to use arrays
+        """
+        self.np = np
+        if np is not None:
+            self.plex_ids = np.asarray(plex_ids, dtype=np.int64)
+            self.imdb_ratings = np.asarray(imdb_ratings, dtype=np.float64)
+            self.votes = np.asarray(votes, dtype=np.float64)
+            self.ratings = np.asarray(ratings, dtype=np.float64)
+        else:
+            self.plex_ids = array("q", plex_ids)
+            self.imdb_ratings = array("d", imdb_ratings)
+            self.votes = array("d", votes)
+            self.ratings = array("d", ratings)
+
+    @classmethod
+    def from_records(cls, records, use_numpy=True):
+        """
+        Build the table of records of the local index
+        :param records: the records, of a single model
+        :param use_numpy: whether to use numpy if it is installed
+        :return: the table
+        """
+        records = list(records)
+        # rows stored before the fetched rating was kept separately hold it in the rating
+        return cls([record.plex_id for record in records],
+                   [to_float(record.rating if record.imdb_rating is None else record.imdb_rating)
+                    for record in records],
+                   [to_float(record.votes) for record in records],
+                   [to_float(record.rating) for record in records],
+                   get_numpy() if use_numpy else None)
+
+    def __len__(self):
+        return len(self.plex_ids)
+
+    def prior(self):
+        """
+        The average rating weighted by the number of votes, the rating the shrinkage moves titles with few votes to
+        :return: the average rating, NaN if no rating has votes
+        """
+        if self.np is not None:
+            np = self.np
+            counts = ~(np.isnan(self.imdb_ratings) | np.isnan(self.votes))
+            total = float(np.dot(self.imdb_ratings[counts], self.votes[counts]))
+            weight = float(self.votes[counts].sum())
+        else:
+            total = weight = 0.0
+            for rating, votes in zip(self.imdb_ratings, self.votes):
+                if rating == rating and votes == votes:
+                    total += rating * votes
+                    weight += votes
+        return total / weight if weight > 0 else NAN
+
+    def blend(self, columns):
+        """
+        Mean of rating columns weighted by their number of votes, like the ratings of several sources, or a
+        rating and the prior. Pairs with a missing rating or number of votes don't count.
+        :param columns: list of pairs of ratings and votes, each a column or a single number
+        :return: the column of blended ratings, NaN where no pair counts
+        """
+        np = self.np
+        if np is not None:
+            total = np.zeros(len(self))
+            weight = np.zeros(len(self))
+            for ratings, votes in columns:
+                ratings = np.broadcast_to(np.asarray(ratings, dtype=np.float64), total.shape)
+                votes = np.broadcast_to(np.asarray(votes, dtype=np.float64), total.shape)
+                counts = ~(np.isnan(ratings) | np.isnan(votes))
+                total += np.where(counts, ratings * votes, 0.0)
+                weight += np.where(counts, votes, 0.0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where(weight > 0, total / weight, NAN)
+        # every pair as rating and votes tuples, single numbers are repeated for every row
+        pairs = [zip(*[column if isinstance(column, array) else repeat(column, len(self)) for column in pair])
+                 for pair in columns]
+        blended = array("d", bytes(8 * len(self)))
+        for position, row in enumerate(zip(*pairs)):
+            total = weight = 0.0
+            for rating, votes in row:
+                if rating == rating and votes == votes:
+                    total += rating * votes
+                    weight += votes
+            blended[position] = total / weight if weight > 0 else NAN
+        return blended
+
+    def shrink(self, min_votes, prior):
+        """
+        Bayesian average of every rating and the prior, (votes * rating + min_votes * prior) / (votes + min_votes).
+        Ratings with many votes stay where they are, ratings with few votes move toward the prior. Ratings of
+        which the number of votes is not known are kept.
+        :param min_votes: the number of votes the prior counts for
+        :param prior: the average rating
+        :return: the column of shrunk ratings
+        """
+        if math.isnan(prior):
+            return self.imdb_ratings
+        if self.np is not None:
+            blended = self.blend([(self.imdb_ratings, self.votes), (prior, min_votes)])
+            keep = self.np.isnan(self.imdb_ratings) | self.np.isnan(self.votes)
+            return self.np.where(keep, self.imdb_ratings, blended)
+        # the terms of blend in one pass, a pass per operation is slower without numpy
+        weighted_prior = prior * min_votes
+        return array("d", [(rating * votes + weighted_prior) / (votes + min_votes)
+                           if rating == rating and votes == votes else rating
+                           for rating, votes in zip(self.imdb_ratings, self.votes)])
+
+    def round(self, ratings, decimals):
+        """
+        Round a column of ratings half up
+        :param ratings: the column
+        :param decimals: the number of decimals
+        :return: the column of rounded ratings
+        """
+        factor = 10.0 ** decimals
+        if self.np is not None:
+            return self.np.floor(ratings * factor + 0.5) / factor
+        floor = math.floor
+        return array("d", [floor(rating * factor + 0.5) / factor if rating == rating else NAN for rating in ratings])
+
+    def changes(self, ratings):
+        """
+        Get the ratings that differ from the ratings in Plex. Titles without a rating are left alone.
+        :param ratings: the column of new ratings
+        :return: list of plex id and new rating pairs
+        """
+        if self.np is not None:
+            np = self.np
+            changed = np.flatnonzero(~np.isnan(ratings) & (ratings != self.ratings))
+            return list(zip(self.plex_ids[changed].tolist(), ratings[changed].tolist()))
+        return [(plex_id, rating) for plex_id, rating, current in zip(self.plex_ids, ratings, self.ratings)
+                if rating == rating and rating != current]
+
+
+class RatingPolicy(object):
+    """
+    How the fetched IMDB ratings are turned into the ratings shown in Plex: optionally shrunk toward the
+    average rating of their kind when they have few votes, then optionally rounded. Applied to every fetched
+    rating by the run, and to whole tables by a recompute, both giving the same result.
+    """
+
+    def __init__(self, decimals=None, shrinkage_votes=0, priors=None):
+        """
+        :param decimals: the number of decimals to round to, None to not round
+        :param shrinkage_votes: the number of votes the average rating counts for, 0 to not shrink
+        :param priors: dict of model and the average rating of its titles, needed to shrink
+        """
+        self.decimals = decimals
+        self.shrinkage_votes = shrinkage_votes
+        self.priors = priors or {}
+
+    def is_identity(self):
+        """
+        Whether the ratings are shown as fetched
+        """
+        return self.decimals is None and not self.shrinkage_votes
+
+    def apply(self, model, rating, votes=None):
+        """
+        Apply the policy to a single fetched rating
+        :param model: the model of the title
+        :param rating: the IMDB rating, as text or number
+        :param votes: the number of votes of the rating, None if not known
+        :return: the rating to show in Plex
+        """
+        if self.is_identity() or rating is None:
+            return rating
+        rating = to_float(rating)
+        if math.isnan(rating):
+            return None
+        prior = self.priors.get(model, NAN)
+        if self.shrinkage_votes and votes is not None and not math.isnan(prior):
+            # the same terms in the same order as RatingTable.blend
+            rating = (rating * votes + prior * self.shrinkage_votes) / (votes + self.shrinkage_votes)
+        if self.decimals is not None:
+            rating = round_half_up(rating, self.decimals)
+        return rating
+
+    def apply_table(self, model, table):
+        """
+        Apply the policy to all ratings of a table at once
+        :param model: the model of the titles in the table
+        :param table: the rating table
+        :return: the column of ratings to show in Plex
+        """
+        ratings = table.imdb_ratings
+        if self.shrinkage_votes:
+            ratings = table.shrink(self.shrinkage_votes, self.priors.get(model, NAN))
+        if self.decimals is not None:
+            ratings = table.round(ratings, self.decimals)
+        return ratings
+
+
+def stored_prior(model):
+    """
+    The average rating of the movies, shows or episodes in the local DB weighted by their number of votes, like
+    RatingTable.prior, without loading the rows
+    :param model: the model of the titles
+    :return: the average rating, NaN if no rating has votes
+    """
+    rating = fn.COALESCE(model.imdb_rating, model.rating)
+    total, weight = model.select(fn.SUM(rating * model.votes), fn.SUM(model.votes)) \
+        .where(rating.is_null(False) & model.votes.is_null(False)).tuples().get()
+    return total / weight if weight else NAN
+
+
+def create_policy(index):
+    """
+    Create the rating policy of the settings, with the average ratings of the movies, shows and episodes of
+    the local index to shrink toward
+    :param index: the local index
+    :return: the rating policy
+    """
+    priors = {}
+    if config.RATING_SHRINKAGE_VOTES:
+        for model in (Movie, Show, Episode):
+            if index.loaded is None:
+                priors[model] = RatingTable.from_records(index.records[model].values()).prior()
+            else:
+                # only a few items are loaded, the average is taken over all of them in the local DB
+                priors[model] = stored_prior(model)
+        logger.debug("Average ratings: {movies:.2f} for movies, {shows:.2f} for shows and {episodes:.2f} for "
+                     "episodes".format(movies=priors[Movie], shows=priors[Show], episodes=priors[Episode]))
+    return RatingPolicy(config.RATING_DECIMALS, config.RATING_SHRINKAGE_VOTES, priors)
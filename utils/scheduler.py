@@ -0,0 +1,99 @@
+import random
+from datetime import datetime, timedelta
+
+# releases younger than this are refreshed with the short threshold
+NEW_RELEASE_AGE = timedelta(days=14)
+# from then on the interval grows to the normal threshold over the first year
+ESTABLISHED_AGE = timedelta(days=365)
+# and to twice the normal threshold for titles of ten years and older
+OLD_RELEASE_AGE = timedelta(days=3650)
+# a change of this much on the previous refresh halves the interval, no change at all stretches it
+VOLATILE_CHANGE = 0.3
+VOLATILE_FACTOR = 0.5
+STABLE_FACTOR = 1.5
+# ratings based on few votes still move a lot
+FEW_VOTES = 1000
+FEW_VOTES_FACTOR = 0.75
+# spread refreshes of items imported together over a range of days
+JITTER = 0.1
+
+
+class RefreshScheduler(object):
+    """
+    Computes when the rating of a movie, show or episode should be refreshed next. New releases are
+    refreshed often and old titles rarely, ratings that moved on the previous refresh or are based on
+    few votes sooner. Every interval is jittered, so items imported together don't expire together.
+    """
+
+    def __init__(self, short, normal, maximum=None, rng=None):
+        """
+        :param short: the shortest interval, used for new releases
+        :param normal: the interval of established titles
+        :param maximum: the longest interval, defaults to four times the normal interval
+        :param rng: the random generator for the jitter
+        """
+        self.short = short
+        self.normal = normal
+        self.maximum = maximum or normal * 4
+        self.rng = rng or random.Random()
+
+    def interval(self, release_date, change=None, votes=None, now=None):
+        """
+        Compute the interval until the next refresh
+        :param release_date: the release date of the item, None if not known
+        :param change: how much the rating changed on this refresh, None if it is the first one
+        :param votes: the number of votes of the rating, None if not known
+        :param now: the current time, defaults to now
+        :return: the interval as timedelta
+        """
+        now = now or datetime.now()
+        age = now - release_date if release_date is not None else ESTABLISHED_AGE
+        if age < NEW_RELEASE_AGE:
+            interval = self.short
+        elif age < ESTABLISHED_AGE:
+            interval = self.short + (self.normal - self.short) * ((age - NEW_RELEASE_AGE) /
+                                                                  (ESTABLISHED_AGE - NEW_RELEASE_AGE))
+        else:
+            interval = self.normal * (1 + min(1.0, (age - ESTABLISHED_AGE) / (OLD_RELEASE_AGE - ESTABLISHED_AGE)))
+
+        if change is not None:
+            if abs(change) >= VOLATILE_CHANGE:
+                interval *= VOLATILE_FACTOR
+            elif change == 0:
+                interval *= STABLE_FACTOR
+        if votes is not None and votes < FEW_VOTES:
+            interval *= FEW_VOTES_FACTOR
+
+        interval *= self.rng.uniform(1 - JITTER, 1 + JITTER)
+        return max(self.short, min(self.maximum, interval))
+
+    def next_refresh(self, release_date, old_rating, new_rating, votes=None, now=None):
+        """
+        Compute the time of the next refresh after refreshing a rating
+        :param release_date: the release date of the item, None if not known
+        :param old_rating: the rating before this refresh, None if there was none
+        :param new_rating: the refreshed rating
+        :param votes: the number of votes of the rating, None if not known
+        :param now: the current time, defaults to now
+        :return: the time of the next refresh
+        """
+        now = now or datetime.now()
+        change = None
+        if old_rating is not None and new_rating is not None:
+            change = float(new_rating) - float(old_rating)
+        return now + self.interval(release_date, change, votes, now)
+
+    def backfill(self, index, owns=None):
+        """
+        Schedule the records of an existing local DB that have no next refresh time yet, starting from
+        their last update. Spreads the refreshes of items that were imported together.
+        :param index: the index of the local DB
+        :param owns: function(plex_id) selecting the items of this shard, None for all items
+        :return: the number of scheduled records
+        """
+        count = 0
+        for record in index.unscheduled(owns):
+            record.next_refresh = record.last_update + self.interval(record.release_date, now=record.last_update)
+            index.save(record)
+            count += 1
+        return count
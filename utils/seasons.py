@@ -0,0 +1,222 @@
+import abc
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from utils import config, dataset, imdb, omdb
+
+# every backend is tried this many times before the fastest one is preferred
+MIN_SAMPLES = 3
+# weight of the latest request in the moving average of the latency
+LATENCY_WEIGHT = 0.2
+# seconds added to the expected cost of a backend for every failed request, weighted by its failure rate
+FAILURE_COST = 1.0
+logger = logging.getLogger("plex-imdb-updater")
+
+
+class SeasonRatings(object):
+    """
+    Episode ratings per season, fetched at most once per run. Concurrent requests for the same season
+    wait for the request already in flight. Sources that can return all seasons of a show at once are
+    asked for the whole show on the first request.
+    """
+
+    def __init__(self, fetch_season, fetch_show=None):
+        """
+        :param fetch_season: function(imdb_id, season) returning the episode ratings of a season
+        :param fetch_show: function(imdb_id) returning a dict of season number and its episode ratings
+        """
+        self.fetch_season = fetch_season
+        self.fetch_show = fetch_show
+        self.lock = threading.Lock()
+        # key and the future of its result, keys are (imdb_id, season) or (imdb_id, None) for a show
+        self.results = {}
+        self.requests = 0
+        self.shared = 0
+
+    def get(self, imdb_id, season):
+        """
+        Get the episode ratings of a season
+        :param imdb_id: the IMDB id of the show
+        :param season: the season number
+        :return: a pair, episode number/rating, None if not found
+        """
+        if self.fetch_show is not None:
+            try:
+                show = self._memoize((imdb_id, None), self.fetch_show, imdb_id)
+            except Exception as e:
+                # the season alone may still be found
+                logger.debug("Error getting show {imdb_id}: {error}".format(imdb_id=imdb_id, error=e))
+                show = None
+            if show and season in show:
+                return show[season]
+        return self._memoize((imdb_id, season), self.fetch_season, imdb_id, season)
+
+    def clear(self):
+        """
+        Forget the fetched seasons, so they are fetched again with the episodes added since
+        """
+        with self.lock:
+            self.results.clear()
+
+    def _memoize(self, key, fetch, *args):
+        with self.lock:
+            future = self.results.get(key)
+            owner = future is None
+            if owner:
+                future = self.results[key] = Future()
+                self.requests += 1
+            else:
+                self.shared += 1
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(fetch(*args))
+        except Exception as e:
+            future.set_exception(e)
+            # don't keep failures, a later request can try again
+            with self.lock:
+                del self.results[key]
+        return future.result()
+
+
+class Backend(abc.ABC):
+    """
+    Source of episode ratings. Every backend returns the episodes of a season as a dict of episode
+    number and a dict with the rating and IMDB id, or 'N/A' for episodes without a rating. The
+    latency of every request is kept, and the errors: requests that raised or found nothing.
+    """
+    name = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.latency = None
+
+    def available(self):
+        return True
+
+    @abc.abstractmethod
+    def fetch_season(self, imdb_id, season):
+        """
+        Fetch the episode ratings of a season
+        :param imdb_id: the IMDB id of the show
+        :param season: the season number
+        :return: a pair, episode number/rating, None if not found
+        """
+
+    def get_season(self, imdb_id, season):
+        """
+        Get the episode ratings of a season, measuring the latency
+        :param imdb_id: the IMDB id of the show
+        :param season: the season number
+        :return: a pair, episode number/rating, None if not found
+        """
+        start = time.monotonic()
+        try:
+            result = self.fetch_season(imdb_id, season)
+        except Exception:
+            self._measure(time.monotonic() - start, error=True)
+            raise
+        self._measure(time.monotonic() - start, error=not result)
+        return result
+
+    def _measure(self, elapsed, error):
+        with self.lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency += LATENCY_WEIGHT * (elapsed - self.latency)
+
+    def score(self):
+        """
+        Expected cost of a request, lower is better. Backends without enough requests yet score
+        best, so every backend gets measured.
+        """
+        with self.lock:
+            if self.requests < MIN_SAMPLES:
+                return -1.0
+            return self.latency + FAILURE_COST * self.errors / self.requests
+
+
+class ImdbBackend(Backend):
+    name = "imdb"
+
+    def fetch_season(self, imdb_id, season):
+        return imdb.get_season_from_imdb(imdb_id, season)
+
+
+class OmdbBackend(Backend):
+    name = "omdb"
+
+    def available(self):
+        return bool(config.OMDB_API_KEY)
+
+    def fetch_season(self, imdb_id, season):
+        return omdb.get_season_from_omdb(imdb_id, season)
+
+
+class DatasetBackend(Backend):
+    name = "dataset"
+
+    def available(self):
+        return dataset.is_enabled()
+
+    def fetch_season(self, imdb_id, season):
+        return dataset.get_season(imdb_id, season)
+
+
+class FastestBackend(Backend):
+    """
+    Tries the available backends from fastest to slowest, based on the measured latency and error
+    rate, until one of them has the season. A slow or failing backend is soon only used as fallback.
+    """
+    name = "fastest"
+
+    def __init__(self, backends):
+        super(FastestBackend, self).__init__()
+        self.backends = backends
+
+    def available(self):
+        return any(backend.available() for backend in self.backends)
+
+    def fetch_season(self, imdb_id, season):
+        error = None
+        for backend in sorted((backend for backend in self.backends if backend.available()),
+                              key=lambda backend: backend.score()):
+            try:
+                episodes = backend.get_season(imdb_id, season)
+            except Exception as e:
+                logger.debug("Error getting season from {backend}: {error}".format(backend=backend.name, error=e))
+                error = e
+                continue
+            if episodes:
+                return episodes
+        if error is not None:
+            raise error
+        return None
+
+
+BACKENDS = {backend.name: backend for backend in (ImdbBackend, OmdbBackend, DatasetBackend)}
+
+
+def create_backend(name):
+    """
+    Create the episode ratings backend by name
+    :param name: imdb, omdb, dataset or fastest
+    :return: the backend
+    """
+    if name == FastestBackend.name:
+        return FastestBackend([backend() for backend in BACKENDS.values()])
+    if name not in BACKENDS:
+        logger.warning("Unknown episode ratings source '{name}', using IMDB".format(name=name))
+        name = ImdbBackend.name
+    backend = BACKENDS[name]()
+    if not backend.available():
+        logger.warning("Episode ratings source '{name}' is not configured".format(name=name))
+    return backend
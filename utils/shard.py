@@ -0,0 +1,93 @@
+import logging
+from collections import namedtuple
+
+# split the items of all libraries by their Plex id, or hand out whole libraries
+BY_KEY = "key"
+BY_LIBRARY = "library"
+
+logger = logging.getLogger("plex-imdb-updater")
+
+
+class Shard(namedtuple("Shard", ["index", "count", "by"])):
+    """
+    The part of the work done by one process. Items are split by their Plex id, episodes always go
+    with their show, so the shards never write the same rows of the Plex DB or the local DB.
+    """
+
+    def owns_item(self, plex_id):
+        """
+        Whether a movie or show belongs to this shard
+        :param plex_id: the plex id of the movie or show
+        :return: True if this shard processes it, False if not
+        """
+        if self.by != BY_KEY:
+            return True
+        return int(plex_id) % self.count == self.index
+
+    def owns_library(self, position):
+        """
+        Whether a library belongs to this shard
+        :param position: the position of the library in the configured library names
+        :return: True if this shard processes it, False if not
+        """
+        if self.by != BY_LIBRARY:
+            return True
+        return position % self.count == self.index
+
+    def split(self, processes):
+        """
+        Split this shard further over a number of processes. Together the sub-shards own exactly
+        the items of this shard.
+        :param processes: the number of processes
+        :return: list of shards
+        """
+        return [Shard(self.index + self.count * process, self.count * processes, self.by)
+                for process in range(processes)]
+
+    def suffix(self):
+        """
+        The suffix of the names of the per-library state of this shard, like the incremental watermarks
+        """
+        if self.by != BY_KEY:
+            return ""
+        return " [{index}/{count}]".format(index=self.index + 1, count=self.count)
+
+    def __str__(self):
+        return "{index}/{count} by {by}".format(index=self.index + 1, count=self.count, by=self.by)
+
+
+def parse_shard(spec, by=BY_KEY):
+    """
+    Parse a shard given on the command line
+    :param spec: the shard as i/N, counting from 1
+    :param by: how to split the work, BY_KEY or BY_LIBRARY
+    :return: the shard
+    """
+    try:
+        index, count = [int(part) for part in spec.split("/")]
+    except ValueError:
+        raise ValueError("Invalid shard '{spec}', expected i/N".format(spec=spec))
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError("Invalid shard '{spec}', expected 1 <= i <= N".format(spec=spec))
+    return Shard(index - 1, count, by)
+
+
+def run_processes(target, shards, *args):
+    """
+    Run every shard in its own process and wait until all of them are done
+    :param target: the function running a shard, called as target(*args, shard=shard)
+    :param shards: the shards to run
+    :return: list of the results of the shards, None for a shard that failed
+    """
+    # multiprocessing is only imported by sharded runs
+    from concurrent.futures import ProcessPoolExecutor
+    results = []
+    with ProcessPoolExecutor(len(shards)) as pool:
+        futures = [pool.submit(target, *args, shard=shard) for shard in shards]
+        for shard, future in zip(shards, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error("Shard {shard} failed: {error}".format(shard=shard, error=e))
+                results.append(None)
+    return results
@@ -0,0 +1,103 @@
+import logging
+import time
+
+from utils import config, plexdb
+
+logger = logging.getLogger("plex-imdb-updater")
+
+
+class LibraryStream(object):
+    """
+    The movies or shows of a library, read a page at a time while they are processed. Only the
+    current page is kept in memory, so memory use stays flat however big the library is. The length
+    is counted up front with a cheap query, for the progress bar.
+
+    The Plex DB is paged by id, the Plex API by offset as it has no filter on the id. Items added to
+    or removed from a library while the API is paged through shift the later pages, so an item may be
+    skipped or handed out twice until the next run. Enumerate from the Plex DB to avoid that.
+    """
+
+    def __init__(self, library, page_size=None):
+        """
+        :param library: the library section, from the Plex API or the Plex DB
+        :param page_size: the number of items per page, defaults to config.ENUMERATE_PAGE_SIZE
+        """
+        self.library = library
+        self.page_size = page_size or config.ENUMERATE_PAGE_SIZE
+        self.title = library.title
+        self.total = count_items(library)
+        self.pages = 0
+        # seconds spent reading the pages, which happens while the items are processed
+        self.seconds = 0.0
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        if isinstance(self.library, plexdb.Section):
+            return self._iter_database()
+        return self._iter_api()
+
+    def _iter_database(self):
+        last = 0
+        while True:
+            start = time.perf_counter()
+            page = self.library.page(last, self.page_size)
+            self.seconds += time.perf_counter() - start
+            self.pages += 1
+            if not page:
+                return
+            last = page[-1].ratingKey
+            size = len(page)
+            for item in release(page):
+                yield item
+            if size < self.page_size:
+                return
+
+    def _iter_api(self):
+        offset = 0
+        while True:
+            start = time.perf_counter()
+            page = self.library.fetchItems("/library/sections/{key}/all?X-Plex-Container-Start={start}"
+                                           "&X-Plex-Container-Size={size}".format(key=self.library.key, start=offset,
+                                                                                  size=self.page_size))
+            self.seconds += time.perf_counter() - start
+            self.pages += 1
+            size = len(page)
+            offset += size
+            for item in release(page):
+                yield item
+            if size < self.page_size:
+                return
+
+
+def release(page):
+    """
+    Hand over the items of a page one by one, dropping the page's reference to every item handed over
+    """
+    page.reverse()
+    while page:
+        yield page.pop()
+
+
+def count_items(library):
+    """
+    Count the movies or shows of a library without fetching them
+    :param library: the library section, from the Plex API or the Plex DB
+    :return: the number of items
+    """
+    if isinstance(library, plexdb.Section):
+        return library.count()
+    data = library._server.query("/library/sections/{key}/all?X-Plex-Container-Start=0"
+                                 "&X-Plex-Container-Size=0".format(key=library.key))
+    return int(data.attrib.get("totalSize", data.attrib.get("size", 0)))
+
+
+def stream_library(library, page_size=None):
+    """
+    Read the movies or shows of a library a page at a time
+    :param library: the library section, from the Plex API or the Plex DB
+    :param page_size: the number of items per page, defaults to config.ENUMERATE_PAGE_SIZE
+    :return: the items, as iterable with a length
+    """
+    return LibraryStream(library, page_size)
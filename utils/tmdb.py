@@ -1,101 +1,106 @@
 import json
 import logging
-import time
 
-from utils import config
+from utils import cache, config, limiter
 
 import requests
 
-TMDB_REQUEST_COUNT = 0  # DO NOT CHANGE
+session = None
 logger = logging.getLogger("plex-imdb-updater")
 
-# Setup overrides, manually specify a imdb id for tvdb ids
-tvdb_overrides = {}
-with open("tvdb-imdb.txt") as overrides:
-    for line in overrides:
-        tvdb, imdb = line.partition("=")[::2]
-        tvdb_overrides[tvdb.strip()] = str(imdb)
 
+def get_session():
+    """
+    Get the session for TMDB, all its endpoints map ids so the responses are cached for long
+    :return: the session
+    """
+    global session
+    if session is None:
+        session = cache.CachedSession("tmdb", "ids", has_mapping)
+    return session
+
+
+def has_mapping(response):
+    """
+    Whether a response maps the id. TMDb maps new titles some time after they are added, a response
+    without a mapping is asked again instead of being cached for as long as the ids
+    :param response: the successful response of TMDb
+    :return: True if it contains an IMDB id or find results, False if not
+    """
+    try:
+        media = response.json()
+    except ValueError:
+        return False
+    if "imdb_id" in media:
+        return bool(media["imdb_id"])
+    return any(media.get(results) for results in ("movie_results", "tv_results"))
+
+
+def request(url, params):
+    """
+    Do a request to TMDb within the rate limit
+    :param url: the url to request
+    :param params: the query parameters
+    :return: the response, None if TMDb could not be reached
+    """
+    try:
+        return limiter.call("tmdb", get_session().get, url, params=params)
+    except requests.RequestException as e:
+        logger.debug("Error requesting TMDB: {}".format(e))
+        return None
 
-def get_imdb_id_from_tmdb(tmdb_id, is_movie=True, pbar=None):
-    global TMDB_REQUEST_COUNT
 
+def get_imdb_id_from_tmdb(tmdb_id, is_movie=True):
     if not config.TMDB_API_KEY:
         return None
 
-    # Wait 10 seconds for the TMDb rate limit
-    if TMDB_REQUEST_COUNT >= 30:
-        if pbar is None:
-            logger.info("Waiting for 10 seconds to not hit TMDb rate limit")
-        else:
-            pbar.postfix[1] = "Waiting 10 seconds TMDb rate limit"
-        time.sleep(10)
-        TMDB_REQUEST_COUNT = 0
-
     params = {"api_key": config.TMDB_API_KEY}
     logger.debug("Fetching IMDB id from TMDB {tmdb_id}".format(tmdb_id=tmdb_id))
     if is_movie:
-        url = "https://api.themoviedb.org/3/movie/{tmdb_id}".format(tmdb_id=tmdb_id)
+        url = "{api}/movie/{tmdb_id}".format(api=config.TMDB_API_URL, tmdb_id=tmdb_id)
     else:
-        url = "https://api.themoviedb.org/3/tv/{tmdb_id}/external_ids".format(tmdb_id=tmdb_id)
-
-    r = requests.get(url, params=params)
+        url = "{api}/tv/{tmdb_id}/external_ids".format(api=config.TMDB_API_URL, tmdb_id=tmdb_id)
 
-    TMDB_REQUEST_COUNT += 1
-
-    if r.status_code == 200:
+    r = request(url, params)
+    if r is not None and r.status_code == 200:
         media = json.loads(r.text)
         return media['imdb_id']
     else:
         return None
 
 
-def get_imdb_id_from_tmdb_by_tvdb(tvdb_id, pbar=None):
-    global TMDB_REQUEST_COUNT
-
-    if tvdb_id in tvdb_overrides:
-        logger.debug("Got an override for {tvdb_id}".format(tvdb_id=tvdb_id))
-        return tvdb_overrides[tvdb_id].rstrip()
-
+def get_ids_from_tmdb_by_tvdb(tvdb_id):
+    """
+    Find the IMDB id of a show by its TVDB id, via the TMDb id of the show
+    :param tvdb_id: the TVDB id of the show
+    :return: tuple of imdb_id and tmdb_id, None for ids that could not be found
+    """
     if not config.TMDB_API_KEY:
-        return None
-
-    # Wait 10 seconds for the TMDb rate limit
-    if TMDB_REQUEST_COUNT >= 30:
-        if pbar is None:
-            logger.info("Waiting for 10 seconds to not hit TMDb rate limit")
-        else:
-            pbar.postfix[1] = "Waiting 10 seconds TMDb rate limit"
-        time.sleep(10)
-        TMDB_REQUEST_COUNT = 0
+        return None, None
 
     params = {"api_key": config.TMDB_API_KEY}
 
-    url = "https://api.themoviedb.org/3/find/{tvdb_id}?external_source=tvdb_id".format(tvdb_id=tvdb_id)
+    url = "{api}/find/{tvdb_id}?external_source=tvdb_id".format(api=config.TMDB_API_URL, tvdb_id=tvdb_id)
     logger.debug("Fetching from TMDB with tvdb {tvdb_id}".format(tvdb_id=tvdb_id))
-    r = requests.get(url, params=params)
-
-    TMDB_REQUEST_COUNT += 1
-    if r.status_code == 200:
+    r = request(url, params)
+    if r is not None and r.status_code == 200:
         media_object = json.loads(r.text)
 
         # check if we did find TV results from TMDB
         if len(media_object["tv_results"]) == 0:
             logger.debug("Found no tv results based on tvdb id")
-            return None
+            return None, None
 
         # if we have found a TMDB id, we know need to get the IMDB id
-        url = "https://api.themoviedb.org/3/tv/{tv_id}/external_ids".format(tv_id=media_object["tv_results"][0]["id"])
-        logger.debug("Fetching external IMDB id from TMDB {tv_id}".format(tv_id=media_object["tv_results"][0]["id"]))
-        r = requests.get(url, params=params)
-
-        if r.status_code == 200:
+        tv_id = media_object["tv_results"][0]["id"]
+        url = "{api}/tv/{tv_id}/external_ids".format(api=config.TMDB_API_URL, tv_id=tv_id)
+        logger.debug("Fetching external IMDB id from TMDB {tv_id}".format(tv_id=tv_id))
+        r = request(url, params)
+        if r is not None and r.status_code == 200:
             media_object = json.loads(r.text)
-            if media_object['imdb_id'] is not None and media_object['imdb_id'] is not "":
-                return media_object['imdb_id']
-            else:
-                return None
-        return None
+            if media_object['imdb_id']:
+                return media_object['imdb_id'], tv_id
+        return None, tv_id
     else:
         logger.debug("Did not find by tvdb")
-        return None
+        return None, None
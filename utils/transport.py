@@ -0,0 +1,144 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from utils import config
+
+# connection pools per provider, shared by every session of the provider
+adapters = {}
+adapters_lock = threading.Lock()
+logger = logging.getLogger("plex-imdb-updater")
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    Keep-alive connection pool of a provider, sized to the workers using it, so concurrent requests
+    reuse open connections instead of doing a new handshake. Requests without a timeout get the
+    default one.
+    """
+
+    def __init__(self, size):
+        super(PooledAdapter, self).__init__(pool_maxsize=size, pool_block=False)
+        self.http_version = "HTTP/1.1"
+
+    def send(self, request, timeout=None, **kwargs):
+        return super(PooledAdapter, self).send(request, timeout=timeout or config.HTTP_TIMEOUT, **kwargs)
+
+    def stats(self):
+        """
+        :return: dict of the number of requests, of new connections and the HTTP version
+        """
+        requests_sent = connections = 0
+        for key in list(self.poolmanager.pools.keys()):
+            pool = self.poolmanager.pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+        return {"requests": requests_sent, "connections": connections, "version": self.http_version}
+
+
+class HTTP2Adapter(BaseAdapter):
+    """
+    Sends the requests of a provider with httpx over HTTP/2, multiplexing the concurrent requests
+    over a single connection. Needs the optional httpx and h2 packages.
+    """
+
+    def __init__(self, size):
+        super(HTTP2Adapter, self).__init__()
+        import httpx
+        self.httpx = httpx
+        self.client = httpx.Client(http2=True, limits=httpx.Limits(max_connections=size,
+                                                                   max_keepalive_connections=size))
+        self.http_version = "HTTP/2"
+        self.requests = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        httpx = self.httpx
+        timeout = timeout or config.HTTP_TIMEOUT
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        try:
+            response = self.client.request(request.method, request.url, headers=dict(request.headers),
+                                           content=request.body, timeout=httpx.Timeout(read, connect=connect))
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(e, request=request)
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(e, request=request)
+        with self.lock:
+            self.requests += 1
+            # the network stream is the connection the request was sent over
+            self.connections.add(response.extensions.get("network_stream"))
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.reason = response.reason_phrase
+        result.headers = CaseInsensitiveDict(response.headers.items())
+        result._content = response.content
+        result.encoding = response.encoding
+        result.url = str(response.url)
+        result.elapsed = response.elapsed
+        result.request = request
+        result.connection = self
+        return result
+
+    def close(self):
+        self.client.close()
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "connections": len(self.connections), "version": self.http_version}
+
+
+def pool_size(provider):
+    # the workers of the provider, and the season workers that may fetch from it as well
+    return config.CONCURRENCY.get(provider, 1) + config.CONCURRENCY.get("seasons", 0)
+
+
+def create_adapter(provider):
+    size = pool_size(provider)
+    if config.HTTP2:
+        try:
+            return HTTP2Adapter(size)
+        except ImportError:
+            logger.warning("HTTP2 needs httpx with HTTP/2 support: pip install httpx[http2]. Using HTTP/1.1")
+            config.HTTP2 = False
+    return PooledAdapter(size)
+
+
+def get_adapter(provider):
+    """
+    Get the connection pool of a provider, created on first use
+    :param provider: the name of the provider
+    :return: the transport adapter
+    """
+    with adapters_lock:
+        adapter = adapters.get(provider)
+        if adapter is None:
+            adapter = adapters[provider] = create_adapter(provider)
+        return adapter
+
+
+def mount(session, provider):
+    """
+    Send the requests of a session over the shared connection pool of its provider
+    :param session: the requests session
+    :param provider: the name of the provider
+    :return: the session
+    """
+    adapter = get_adapter(provider)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def stats():
+    """
+    Get the connection reuse statistics of the providers
+    :return: dict of provider and dict of the number of requests, of new connections and the HTTP version
+    """
+    with adapters_lock:
+        return {provider: adapter.stats() for provider, adapter in adapters.items()}
+
@@ -1,9 +1,6 @@
 import logging
 from datetime import datetime, timedelta
 
-from update_imdb_ratings import THRESHOLD_SHORT, THRESHOLD_NORMAL
-
-
 logger = logging.getLogger("plex-imdb-updater")
 
 
@@ -20,28 +17,45 @@ def is_short_treshold(release_date):
         return False
 
 
-def check_media_needs_update(db_media_object, plex_object, check_rating=True):
+def is_due(db_media, now=None):
     """
-    Check whether a media needs to be updated based on last update time and rating
-    :param db_media_object: the local DB object
+    Whether the rating of a media is due for a refresh according to its schedule
+    :param db_media: the local DB record
+    :param now: the current time, defaults to now
+    :return: True if the refresh is due, False if not
+    """
+    due_time = db_media.next_refresh or db_media.last_update
+    return due_time <= (now or datetime.now())
+
+
+def check_media_needs_update(db_media, plex_object, check_rating=True, due=None):
+    """
+    Check whether a media needs to be updated based on its refresh schedule and rating
+    :param db_media: the local DB record
     :param plex_object: the plex DB object
     :param check_rating: whether to check for rating. Default is True
+    :param due: whether the refresh is due, defaults to checking the schedule of the media
     :return: True if update is required, False if not
     """
-    if is_short_treshold(db_media_object.get().release_date):
-        if db_media_object.get().last_update < datetime.now() - THRESHOLD_SHORT:
-            logger.debug("Update {title} because last update short threshold".format(title=db_media_object.get().title))
-            return True
-        # if exists in local DB but not in Plex DB, it's not properly updated or updated from the outside
-        elif check_rating and db_media_object.get().rating != plex_object.rating:
-            logger.debug("Update {title} because rating doesn't match Plex".format(title=db_media_object.get().title))
-            return True
-    else:
-        if db_media_object.get().last_update < datetime.now() - THRESHOLD_NORMAL:
-            logger.debug("Update {title} because last update long threshold".format(title=db_media_object.get().title))
-            return True
-        # if exists in local DB but not in Plex DB, it's not properly updated or updated from the outside
-        elif check_rating and db_media_object.get().rating != plex_object.rating:
-            logger.debug("Update {title} because rating doesn't match Plex".format(title=db_media_object.get().title))
-            return True
+    if due is None:
+        due = is_due(db_media)
+    if due:
+        logger.debug("Update {title} because its refresh is due".format(title=db_media.title))
+        return True
+    # if exists in local DB but not in Plex DB, it's not properly updated or updated from the outside
+    elif check_rating and db_media.rating != plex_object.rating:
+        logger.debug("Update {title} because rating doesn't match Plex".format(title=db_media.title))
+        return True
     return False
+
+
+def parse_votes(votes):
+    """
+    Parse a number of votes as formatted by OMDB
+    :param votes: the number of votes, like 1,234
+    :return: the number of votes, None if not available
+    """
+    try:
+        return int(str(votes).replace(",", ""))
+    except ValueError:
+        return None
@@ -0,0 +1,156 @@
+import email
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import config, metrics
+
+logger = logging.getLogger("plex-imdb-updater")
+
+# the events handled, and whether their item is updated even if its rating is not due yet
+EVENTS = {
+    "library.new": True,
+    "media.scrobble": False,
+}
+# a burst of events is handed out after at most this many times the delay, even if it goes on
+MAX_DELAYS = 10
+
+
+class EventQueue(object):
+    """
+    The Plex ids of the items to update, collected from the webhook events. A library scan reports
+    many items in a quick burst, they are handed out together once the events stop for a moment.
+    """
+
+    def __init__(self, delay=None):
+        """
+        :param delay: seconds without events before a burst is handed out, defaults to config.WEBHOOK_DELAY
+        """
+        self.delay = config.WEBHOOK_DELAY if delay is None else delay
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.first_event = None
+        self.last_event = None
+
+    def put(self, plex_id, force):
+        """
+        Add an item to update
+        :param plex_id: the Plex id of the movie or show
+        :param force: whether to update it even if its rating is not due yet
+        """
+        with self.condition:
+            if not self.pending:
+                self.first_event = time.monotonic()
+            # an item reported again stays forced
+            self.pending[plex_id] = self.pending.get(plex_id, False) or force
+            self.last_event = time.monotonic()
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Wait for a burst of events to end
+        :param timeout: the maximum number of seconds to wait for the first event, None to wait forever
+        :return: dict of the Plex ids and whether to update them even if their rating is not due, empty on a timeout
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.condition:
+            while not self.pending:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return {}
+                self.condition.wait(remaining)
+            while True:
+                now = time.monotonic()
+                remaining = min(self.last_event + self.delay, self.first_event + self.delay * MAX_DELAYS) - now
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            pending, self.pending = self.pending, {}
+            return pending
+
+
+def parse_event(body, content_type):
+    """
+    Read a Plex webhook event. Plex posts it as a multipart form with the JSON in the payload field,
+    plain JSON bodies are accepted as well.
+    :param body: the request body
+    :param content_type: the Content-Type header of the request
+    :return: dict of the event, None if it could not be read
+    """
+    if content_type.startswith("multipart/"):
+        message = email.message_from_bytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+        for part in message.walk():
+            if part.get_param("name", header="content-disposition") == "payload":
+                body = part.get_payload(decode=True)
+                break
+        else:
+            return None
+    try:
+        event = json.loads(body.decode("utf-8"))
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) else None
+
+
+def get_target(event):
+    """
+    Get the movie or show to update for an event. Seasons and episodes are updated with their show.
+    :param event: dict of the event
+    :return: pair of the Plex id and whether to update it even if its rating is not due, None to ignore the event
+    """
+    if event.get("event") not in EVENTS:
+        return None
+    metadata = event.get("Metadata") or {}
+    media_type = metadata.get("type")
+    if media_type == "episode":
+        plex_id = metadata.get("grandparentRatingKey")
+    elif media_type == "season":
+        plex_id = metadata.get("parentRatingKey")
+    elif media_type in ("movie", "show"):
+        plex_id = metadata.get("ratingKey")
+    else:
+        return None
+    if not plex_id:
+        return None
+    return str(plex_id), EVENTS[event["event"]]
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        event = parse_event(self.rfile.read(length), self.headers.get("Content-Type", ""))
+        if event is None:
+            self.respond(400)
+            return
+        target = get_target(event)
+        metrics.inc("webhook_events", event=event.get("event", ""), handled=str(target is not None).lower())
+        if target is not None:
+            logger.debug("Webhook: {event} for item {plex_id}".format(event=event["event"], plex_id=target[0]))
+            self.server.events.put(*target)
+        self.respond(200)
+
+    def respond(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug("Webhook: " + format % args)
+
+
+def start_server(events, host=None, port=None):
+    """
+    Listen for Plex webhook events in a background thread
+    :param events: the queue to add the items to update to
+    :param host: the address to listen on, defaults to config.WEBHOOK_HOST
+    :param port: the port to listen on, defaults to config.WEBHOOK_PORT. 0 picks a free port
+    :return: the server, call shutdown() to stop it
+    """
+    server = ThreadingHTTPServer((host or config.WEBHOOK_HOST, config.WEBHOOK_PORT if port is None else port),
+                                 WebhookHandler)
+    server.daemon_threads = True
+    server.events = events
+    threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+    return server
@@ -0,0 +1,316 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from functools import partial
+
+from models import database as local_database, PendingWrite
+from utils import config, db, metrics
+
+# keep the number of SQL variables below the limit of older SQLite versions
+SELECT_CHUNK_SIZE = 500
+logger = logging.getLogger("plex-imdb-updater")
+
+
+class BatchWriter(object):
+    """
+    Collects rating changes for the Plex DB in memory and writes them in batches. The final rating,
+    extra_data and user_fields are computed in Python and compared with the current ones, so every
+    batch is a SELECT and a single executemany of the rows that actually change, in one short
+    transaction. Most refreshes change nothing, a batch without changes doesn't take the write lock
+    at all. Batches that could not be written because the Plex DB stayed locked are kept for a
+    later flush, and in the local DB for the next run when the run ends before they are written.
+    """
+
+    def __init__(self, database, batch_size=None):
+        """
+        :param database: the Plex DB
+        :param batch_size: number of items written per transaction
+        """
+        self.database = database
+        self.batch_size = batch_size or config.WRITE_BATCH_SIZE
+        # plex id and rating, None to reset the rating
+        self.pending = {}
+        # plex ids of the changes taken over from the local DB
+        self.restored = set()
+        # after a failed batch, don't block the run by trying again for every new change
+        self.retry_after = 0.0
+        self.written = 0
+        self.unchanged = 0
+        self.transactions = 0
+        self.failed = 0
+
+    def set_rating(self, plex_id, rating):
+        """
+        Set the rating with the IMDB rating image and lock the rating field
+        :param plex_id: the id of the item in the Plex DB
+        :param rating: the rating to set
+        """
+        self.pending[int(plex_id)] = rating
+
+    def reset_rating(self, plex_id):
+        """
+        Reset the rating and lock the rating field
+        :param plex_id: the id of the item in the Plex DB
+        """
+        self.pending[int(plex_id)] = None
+
+    def restore(self):
+        """
+        Take over the changes a previous run could not write, kept in the local DB
+        :return: the number of restored changes
+        """
+        for plex_id, rating in PendingWrite.select(PendingWrite.plex_id, PendingWrite.rating).tuples():
+            self.pending.setdefault(plex_id, rating)
+            self.restored.add(plex_id)
+        return len(self.restored)
+
+    def keep(self):
+        """
+        Keep the changes that are still pending in the local DB, the next run restores and writes them
+        :return: the number of kept changes
+        """
+        with local_database.atomic():
+            restored = list(self.restored)
+            for start in range(0, len(restored), SELECT_CHUNK_SIZE):
+                PendingWrite.delete().where(PendingWrite.plex_id.in_(restored[start:start + SELECT_CHUNK_SIZE])) \
+                    .execute()
+            rows = list(self.pending.items())
+            for start in range(0, len(rows), SELECT_CHUNK_SIZE // 2):
+                PendingWrite.replace_many(rows[start:start + SELECT_CHUNK_SIZE // 2],
+                                          fields=[PendingWrite.plex_id, PendingWrite.rating]).execute()
+        self.restored = set(self.pending)
+        return len(self.pending)
+
+    def is_full(self):
+        """
+        Whether a full batch is waiting to be written, and the last failed batch is long enough ago
+        """
+        return len(self.pending) >= self.batch_size and time.monotonic() >= self.retry_after
+
+    def flush(self):
+        """
+        Write all pending changes, one transaction per batch. Stops at the first batch that could not be
+        written, that batch and the rest are kept.
+        :return: the number of written items
+        """
+        plex_ids = list(self.pending)
+        written = 0
+        for start in range(0, len(plex_ids), self.batch_size):
+            batch = plex_ids[start:start + self.batch_size]
+            # compare with the current state first, without the write lock. The write compares again, the
+            # Plex server may change the rows in between
+            with metrics.timer("plex_db_read_seconds"):
+                result = self.database.read(partial(self._changes, batch))
+            if result.ok:
+                changed = set(update[3] for update in result.value)
+                for plex_id in batch:
+                    if plex_id not in changed:
+                        del self.pending[plex_id]
+                self.unchanged += len(batch) - len(changed)
+                metrics.inc("plex_db_items_unchanged", len(batch) - len(changed))
+                batch = [plex_id for plex_id in batch if plex_id in changed]
+                if not batch:
+                    continue
+            with metrics.timer("plex_db_write_seconds"):
+                result = self.database.write(partial(self._write_batch, batch))
+            if not result.ok:
+                metrics.inc("plex_db_write_failures")
+                self.failed += 1
+                self.retry_after = time.monotonic() + config.PLEX_DB_BACKOFF_MAX
+                logger.warning("Could not write {count} changes to the Plex DB, keeping them for later".format(
+                    count=len(self.pending)))
+                break
+            for plex_id in batch:
+                del self.pending[plex_id]
+            written += len(batch)
+            metrics.inc("plex_db_items_written", result.value)
+            self.written += result.value
+            self.transactions += 1
+            logger.debug("Written {count} items to the Plex DB".format(count=result.value))
+        return written
+
+    def _changes(self, plex_ids, cursor):
+        """
+        Compute the rows of which the final state differs from the current one
+        :return: list of rating, extra_data, user_fields and id tuples to update
+        """
+        rows = []
+        for start in range(0, len(plex_ids), SELECT_CHUNK_SIZE):
+            chunk = plex_ids[start:start + SELECT_CHUNK_SIZE]
+            rows.extend(self.database.execute(cursor, "SELECT id, rating, extra_data, user_fields FROM metadata_items "
+                                                      "WHERE id IN ({})".format(",".join("?" * len(chunk))), chunk))
+        updates = []
+        for plex_id, current_rating, current_extra_data, current_user_fields in rows:
+            rating = self.pending[plex_id]
+            extra_data = current_extra_data if rating is None else db.imdb_extra_data(current_extra_data)
+            user_fields = db.locked_user_fields(current_user_fields)
+            if (not same_rating(rating, current_rating) or extra_data != current_extra_data or
+                    user_fields != current_user_fields):
+                updates.append((rating, extra_data, user_fields, plex_id))
+        return updates
+
+    def _write_batch(self, plex_ids, cursor):
+        updates = self._changes(plex_ids, cursor)
+        if updates:
+            self.database.executemany(cursor, "UPDATE metadata_items SET rating = ?, extra_data = ?, "
+                                              "user_fields = ? WHERE id = ?", updates)
+        return len(updates)
+
+
+def same_rating(rating, current):
+    """
+    Whether a fetched rating equals the rating in the Plex DB. Providers return ratings as text or numbers,
+    the Plex DB stores them as floats.
+    """
+    if rating is None or current is None:
+        return rating is None and current is None
+    try:
+        return float(rating) == current
+    except ValueError:
+        return False
+
+
+class WriteScheduler(object):
+    """
+    Decides when the changes collected by a BatchWriter are written to the Plex DB. A background thread
+    checks for playback at a fixed cadence. While somebody is watching the changes stay in memory and
+    fetching continues, once the server is idle they are written in large batches. With a maintenance
+    window the changes are only written inside the window instead.
+    """
+
+    def __init__(self, writer, get_sessions, interval=None, window=None):
+        """
+        :param writer: the batch writer collecting the changes
+        :param get_sessions: function returning the current playback sessions
+        :param interval: the number of seconds between two checks, defaults to config.SESSION_CHECK_INTERVAL
+        :param window: the maintenance window as pair of start and end time, like ("03:00", "06:00"),
+                       defaults to config.MAINTENANCE_WINDOW
+        """
+        self.writer = writer
+        self.get_sessions = get_sessions
+        self.interval = interval or config.SESSION_CHECK_INTERVAL
+        self.window = parse_window(window if window is not None else config.MAINTENANCE_WINDOW)
+        self.idle = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.buffering = False
+        # statistics
+        self.checks = 0
+        self.waited = 0.0
+
+    def start(self):
+        """
+        Check for playback now and then in the background
+        :return: the scheduler
+        """
+        self.check()
+        self.thread = threading.Thread(target=self._run, name="plex-sessions", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        """
+        Check whether somebody is watching. The server counts as busy when it cannot be reached.
+        :return: True if the server is idle, False if not
+        """
+        try:
+            idle = len(self.get_sessions()) == 0
+        except Exception as e:
+            logger.warning("Could not get the Plex sessions: {error}".format(error=e))
+            idle = False
+        self.checks += 1
+        if idle:
+            self.idle.set()
+        else:
+            self.idle.clear()
+        return idle
+
+    def can_write(self, now=None):
+        """
+        Whether the changes may be written now
+        :param now: the current time, defaults to now
+        :return: True if inside the maintenance window, or the server is idle when there is no window
+        """
+        if self.window is not None:
+            return in_window(self.window, now or datetime.now())
+        return self.idle.is_set()
+
+    def flush_when_full(self):
+        """
+        Write the pending changes once a full batch has been collected and writing is allowed
+        :return: the number of written items
+        """
+        if not self.writer.is_full():
+            return 0
+        if not self.can_write():
+            if not self.buffering:
+                logger.info("Plex Media Server in use... keeping changes until it is idle")
+                self.buffering = True
+            return 0
+        return self.flush(wait=False)
+
+    def flush(self, wait=True, timeout=None):
+        """
+        Write all pending changes
+        :param wait: wait until writing is allowed, otherwise only write when it is allowed right now
+        :param timeout: the maximum number of seconds to wait, None to wait as long as it takes
+        :return: the number of written items
+        """
+        if not self.writer.pending:
+            return 0
+        if not self.can_write():
+            if not wait:
+                return 0
+            logger.info("Plex Media Server in use... waiting to write {count} changes".format(
+                count=len(self.writer.pending)))
+            start = time.monotonic()
+            deadline = start + timeout if timeout is not None else None
+            while not self.can_write():
+                remaining = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+                if remaining <= 0:
+                    break
+                if self.window is not None:
+                    self.stopped.wait(remaining)
+                else:
+                    self.idle.wait(remaining)
+            self.waited += time.monotonic() - start
+            metrics.observe("session_wait_seconds", time.monotonic() - start)
+            if not self.can_write():
+                return 0
+        self.buffering = False
+        return self.writer.flush()
+
+
+def parse_window(window):
+    """
+    Parse a maintenance window
+    :param window: pair of start and end time as HH:MM, None for no window
+    :return: pair of start and end time, None for no window
+    """
+    if not window:
+        return None
+    return tuple(datetime.strptime(value, "%H:%M").time() for value in window)
+
+
+def in_window(window, now):
+    """
+    Whether a time is inside a maintenance window, which may run past midnight
+    :param window: pair of start and end time
+    :param now: the datetime to check
+    :return: True if inside the window, False if not
+    """
+    start, end = window
+    if start <= end:
+        return start <= now.time() < end
+    return now.time() >= start or now.time() < end